@@ -0,0 +1,80 @@
+"""
+Compare conversion of fetched SQLite values by declared column types (`PARSE_DECLTYPES` with global converters)
+with the per-query conversion plan of model fields.
+
+Run from the project root:
+
+    python -m benchmarks.conversion
+"""
+import datetime
+from decimal import Decimal
+import os
+import sqlite3
+import tempfile
+import timeit
+
+from minorm.connectors import connector
+from minorm.db_specs import SQLiteSpec
+from minorm.fields import CharField, DateField, DecimalField, IntegerField
+from minorm.models import Model
+
+ROWS_NUMBER = 100000
+REPEAT = 5
+
+
+class Order(Model):
+    title = CharField(max_length=50)
+    quantity = IntegerField()
+    price = DecimalField(max_digits=10, decimal_places=2)
+    created = DateField()
+
+    class Meta:
+        table_name = 'orders'
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'benchmark.db')
+        db = connector.connect(SQLiteSpec(db_path))
+        try:
+            Order.create_table()
+            today = datetime.date.today()
+            Order.qs.copy_from((f'order {i}', i, Decimal(i) / 100, today) for i in range(ROWS_NUMBER))
+
+            decltypes_time = measure(lambda: fetch_with_decltypes(db_path))
+            plan_time = measure(lambda: fetch_with_plan(db))
+        finally:
+            connector.disconnect()
+
+    print(f'PARSE_DECLTYPES converters: {decltypes_time * 1000:.1f} ms per {ROWS_NUMBER} rows')
+    print(f'Conversion plan:            {plan_time * 1000:.1f} ms per {ROWS_NUMBER} rows '
+          f'({plan_time / decltypes_time:.0%} of declared types conversion)')
+
+
+def measure(func):
+    return min(timeit.repeat(func, number=1, repeat=REPEAT))
+
+
+def fetch_with_decltypes(db_path):
+    sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()))
+    sqlite3.register_converter('DATE', lambda value: datetime.datetime.strptime(value.decode(), DateField.FORMAT).date())
+    connection = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    try:
+        raw_sql = Order.qs.query.render_sql(SQLiteSpec(db_path))
+        rows = connection.execute(raw_sql).fetchall()
+    finally:
+        connection.close()
+    assert len(rows) == ROWS_NUMBER
+
+
+def fetch_with_plan(db):
+    convert_row = db.spec.get_row_converter(Order._meta.fields)
+    raw_sql = Order.qs.query.render_sql(db.spec)
+    with db.cursor() as curr:
+        curr.execute(raw_sql)
+        rows = [convert_row(row) for row in curr]
+    assert len(rows) == ROWS_NUMBER
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Measure memory, taken by a model instance fetched from db, for regular and compact models.
+
+Run from the project root:
+
+    python -m benchmarks.memory
+"""
+import tracemalloc
+
+from minorm.connectors import connector
+from minorm.db_specs import SQLiteSpec
+from minorm.fields import CharField, ForeignKey, IntegerField
+from minorm.models import Model
+
+ROWS_NUMBER = 100000
+
+
+def main():
+    connector.connect(SQLiteSpec(':memory:'))
+    try:
+        regular_size = measure_instance_size(is_compact=False)
+        compact_size = measure_instance_size(is_compact=True)
+    finally:
+        connector.disconnect()
+
+    print(f'Regular model instance: {regular_size:.1f} bytes')
+    print(f'Compact model instance: {compact_size:.1f} bytes ({compact_size / regular_size:.0%} of regular one)')
+
+
+def measure_instance_size(is_compact):
+    class Author(Model):
+        name = CharField(max_length=50)
+
+        class Meta:
+            table_name = 'author'
+            compact = is_compact
+
+    class Book(Model):
+        title = CharField(max_length=50)
+        pages = IntegerField()
+        author = ForeignKey(Author)
+
+        class Meta:
+            table_name = 'book'
+            compact = is_compact
+
+    Author.create_table()
+    Book.create_table()
+    try:
+        author = Author.qs.create(name='author')
+        Book.qs.copy_from((f'book {i}', i, author.pk) for i in range(ROWS_NUMBER))
+
+        tracemalloc.start()
+        books = list(Book.qs)
+        allocated_size, __ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert len(books) == ROWS_NUMBER
+    finally:
+        Book.drop_table()
+        Author.drop_table()
+
+    return allocated_size / ROWS_NUMBER
+
+
+if __name__ == '__main__':
+    main()
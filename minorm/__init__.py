@@ -2,6 +2,7 @@ from minorm.connectors import connector
 from minorm.db_specs import SQLiteSpec, PostgreSQLSpec
 from minorm.fields import (
     IntegerField,
+    VersionField,
     FloatField,
     BooleanField,
     CharField,
@@ -20,7 +21,7 @@ __version__ = "0.6.0"
 
 __all__ = [
     'connector', 'SQLiteSpec', 'PostgreSQLSpec',
-    'Field', 'IntegerField', 'FloatField', 'BooleanField', 'CharField',
+    'Field', 'IntegerField', 'VersionField', 'FloatField', 'BooleanField', 'CharField',
     'DecimalField', 'DateField', 'DateTimeField', 'AutoField', 'ForeignKey',
     'Model'
 ]
@@ -1,18 +1,93 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from itertools import chain
+import queue
+import threading
+import time
+import zlib
+
+from minorm.exceptions import QueryTimeout
 
 
 class ConnectorError(RuntimeError):
     pass
 
 
-class Connector:
+class TimeLimitedCursor:
+    """
+    Wraps a cursor of the connector, so its statements, that run longer than `timeout` seconds, are aborted.
+
+    The limit is set only while the cursor runs a statement (or fetches rows, that db computes lazily),
+    so a cursor, which was not read till the end, doesn't limit other statements of the connection.
+    """
+
+    ITER_CHUNK_SIZE = 100  # number of rows, fetched at once under the limit, while the cursor is iterated
+
+    def __init__(self, cursor, db, timeout):
+        self._cursor = cursor
+        self._db = db
+        self._timeout = timeout
+        self._deadline = None  # the time, when the last statement should be finished with its rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return chain.from_iterable(iter(lambda: self.fetchmany(self.ITER_CHUNK_SIZE), []))
+
+    def execute(self, *args):
+        self._deadline = time.monotonic() + self._timeout
+        self._run_limited(self._cursor.execute, args)
+        return self
+
+    def executemany(self, *args):
+        self._deadline = time.monotonic() + self._timeout
+        self._run_limited(self._cursor.executemany, args)
+        return self
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, args)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def _fetch(self, fetch, args=()):
+        if self._deadline is None or not self._db.spec.LAZY_RESULTS:
+            return fetch(*args)
+        return self._run_limited(fetch, args)
+
+    def _run_limited(self, operation, args):
+        spec = self._db.spec
+        connection = self._db.connection
+        spec.set_statement_timeout(connection, max(self._deadline - time.monotonic(), 0))
+        try:
+            return operation(*args)
+        except Exception as err:
+            if spec.is_timeout_error(err):
+                raise QueryTimeout(f'Statement was not finished in {self._timeout} seconds.') from err
+            raise
+        finally:
+            spec.reset_statement_timeout(connection, self._db.statement_timeout)
+
+
+class Connector:  # pylint: disable=too-many-instance-attributes
     NOT_CONNECTED_ERROR = 'Connect was not performed.'
 
-    def __init__(self):
+    def __init__(self, statement_timeout=None):
         self._connection = None
         self._db_spec = None
+        self._statement_timeout = statement_timeout  # default max duration of statements, in seconds
         self._autocommit = False
 
+        self._savepoints = None  # names of active savepoints, is None outside of atomic block
+        self._savepoint_counter = 0
+        self._on_commit_callbacks = []  # pairs of savepoints level and callback, to run after commit
+        self._immediate = False  # whether transaction of the outermost atomic block takes write lock at start
+
     def connect(self, db_spec):
         self.disconnect()
 
@@ -22,6 +97,8 @@ class Connector:
         # but it's not matches SQL standard,
         # so it's preferable to change the default behaviour:
         self.set_autocommit(True)
+        if self._statement_timeout is not None and db_spec.SESSION_STATEMENT_TIMEOUT:
+            db_spec.set_statement_timeout(self._connection, self._statement_timeout)
 
         return self
 
@@ -33,10 +110,27 @@ class Connector:
         self._db_spec = None
         self._autocommit = None
 
+        self._savepoints = None
+        self._on_commit_callbacks = []
+        self._immediate = False
+
     def set_autocommit(self, autocommit):
         self.spec.set_autocommit(self.connection, autocommit)
         self._autocommit = autocommit
 
+    @property
+    def statement_timeout(self):
+        return self._statement_timeout
+
+    @statement_timeout.setter
+    def statement_timeout(self, timeout):
+        self._statement_timeout = timeout
+        if self._connection and self._db_spec.SESSION_STATEMENT_TIMEOUT:
+            if timeout is None:
+                self._db_spec.reset_statement_timeout(self._connection)
+            else:
+                self._db_spec.set_statement_timeout(self._connection, timeout)
+
     @property
     def spec(self):
         self._check_if_connected()
@@ -49,12 +143,217 @@ class Connector:
         return self._connection
 
     @contextmanager
-    def cursor(self):
-        yield self.connection.cursor()
+    def cursor(self, timeout=None):
+        """
+        Yield a cursor of the connection. Statements of the cursor, that run longer than `timeout` seconds
+        (or `statement_timeout` of the connector), are aborted and `QueryTimeout` is raised.
+        """
+        if self.spec.SESSION_STATEMENT_TIMEOUT and timeout in (None, self._statement_timeout):
+            timeout = None  # the connection limits each statement by the default timeout already
+        elif timeout is None:
+            timeout = self._statement_timeout
+        cursor = self.connection.cursor()
+        yield cursor if timeout is None else TimeLimitedCursor(cursor, self, timeout)
+
+    @property
+    def in_atomic_block(self):
+        return self._savepoints is not None
+
+    @property
+    def in_immediate_block(self):
+        return self.in_atomic_block and self._immediate
+
+    @property
+    def savepoints(self):
+        return list(self._savepoints or ())
+
+    def begin(self, immediate=False):
+        """Start a transaction of the outermost atomic block, `immediate` one takes write lock at start."""
+        self.set_autocommit(False)
+        self.spec.begin(self.connection, immediate=immediate)
+        self._savepoints = []
+        self._immediate = immediate
+
+    def end(self, commit=True):
+        """Finish the transaction of the outermost atomic block by commit or rollback and turn on auto-commit."""
+        callbacks = [callback for __, callback in self._on_commit_callbacks] if commit else []
+        self._on_commit_callbacks = []
+        self._savepoints = None
+        self._immediate = False
+        try:
+            if commit:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.set_autocommit(True)
+
+        for callback in callbacks:
+            callback()
+
+    def commit(self):
+        self.connection.commit()
+        if self.in_atomic_block:
+            self.spec.begin(self.connection, immediate=self._immediate)
+
+    def rollback(self):
+        self.connection.rollback()
+        self._on_commit_callbacks = []
+        if self.in_atomic_block:
+            self.spec.begin(self.connection, immediate=self._immediate)
+
+    def savepoint(self):
+        self._savepoint_counter += 1
+        name = f'minorm_sp_{self._savepoint_counter}'
+        self._execute_transaction_statement(f'SAVEPOINT {name}')
+        self._savepoints.append(name)
+        return name
+
+    def release_savepoint(self, name):
+        self._execute_transaction_statement(f'RELEASE SAVEPOINT {name}')
+        self._pop_savepoint(name, keep_callbacks=True)
+
+    def rollback_to_savepoint(self, name):
+        self._execute_transaction_statement(f'ROLLBACK TO SAVEPOINT {name}')
+        self._execute_transaction_statement(f'RELEASE SAVEPOINT {name}')
+        self._pop_savepoint(name, keep_callbacks=False)
+
+    def on_commit(self, callback):
+        """Register a function to call after the transaction commit, or call it at once outside of atomic block."""
+        if not self.in_atomic_block:
+            callback()
+        else:
+            self._on_commit_callbacks.append((len(self._savepoints), callback))
+
+    def _pop_savepoint(self, name, keep_callbacks):
+        level = self._savepoints.index(name)
+        del self._savepoints[level:]
+
+        callbacks = []
+        for callback_level, callback in self._on_commit_callbacks:
+            if callback_level <= level:
+                callbacks.append((callback_level, callback))
+            elif keep_callbacks:
+                callbacks.append((level, callback))
+        self._on_commit_callbacks = callbacks
+
+    def _execute_transaction_statement(self, statement):
+        with self.cursor() as curr:
+            curr.execute(f'{statement};')
 
     def _check_if_connected(self):
         if not self._connection:
             raise ConnectorError(self.NOT_CONNECTED_ERROR)
 
 
+class ConnectionPool:
+    """
+    Keeps idle connectors of a db, so they could be reused by worker threads.
+
+    Connectors are created on demand (with the given `statement_timeout`), each of them is used by one thread
+    at a time.
+    """
+
+    def __init__(self, db_spec, max_idle=None, statement_timeout=None):
+        # a connection is created by one worker thread and could be used by others later:
+        self.db_spec = db_spec.shared_between_threads()
+        self.statement_timeout = statement_timeout
+        self._idle = queue.LifoQueue(maxsize=max_idle or 0)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return Connector(statement_timeout=self.statement_timeout).connect(self.db_spec)
+
+    def release(self, db):
+        if db.in_atomic_block:
+            db.end(commit=False)
+
+        with self._lock:
+            if not self._closed:
+                try:
+                    self._idle.put_nowait(db)
+                    return
+                except queue.Full:
+                    pass
+        db.disconnect()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            while not self._idle.empty():
+                self._idle.get_nowait().disconnect()
+
+
+class ShardedConnector:
+    """
+    A set of connectors (shards), that keep different rows of the same tables.
+
+    Rows are routed to a shard by value of shard key, declared in model meta.
+    All shards should be connected to databases of the same kind.
+    """
+
+    def __init__(self, shards, shard_for_key=None, max_workers=None):
+        """
+        `shards` is a mapping of shard names to connectors, `shard_for_key` is a function,
+        that takes a shard key value and returns name of the shard; by default values are distributed by hash.
+        `max_workers` limits number of threads, that query shards in parallel.
+        """
+        if not shards:
+            raise ValueError('At least one shard should be provided.')
+
+        self._shards = OrderedDict(shards)
+        self._shard_for_key = shard_for_key
+        self._max_workers = max_workers or len(self._shards)
+        self._executor = None
+
+    @property
+    def shards(self):
+        return OrderedDict(self._shards)
+
+    @property
+    def spec(self):
+        return next(iter(self._shards.values())).spec
+
+    @property
+    def in_atomic_block(self):
+        return any(shard.in_atomic_block for shard in self._shards.values())
+
+    def get_shard(self, name):
+        try:
+            return self._shards[name]
+        except KeyError:
+            raise ValueError(f'Unknown shard {name}.') from None
+
+    def get_shard_name(self, key_value):
+        if key_value is None:
+            raise ValueError('Shard key value should not be null.')
+        if self._shard_for_key:
+            return self._shard_for_key(key_value)
+
+        # crc32 is used instead of built-in hash, since it's the same in every process:
+        shard_names = list(self._shards)
+        return shard_names[zlib.crc32(str(key_value).encode('utf-8')) % len(shard_names)]
+
+    def get_shard_for_key(self, key_value):
+        return self.get_shard(self.get_shard_name(key_value))
+
+    def map(self, func):
+        """Call the function with name of each shard in parallel threads, return results in order of shards."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='minorm-shard')
+        return list(self._executor.map(func, self._shards))
+
+    def disconnect(self):
+        for shard in self._shards.values():
+            shard.disconnect()
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
 connector = Connector()
@@ -1,12 +1,29 @@
+import copy
+import datetime
 from decimal import Decimal
+import functools
+import re
+import time
 
+from minorm.schema import ColumnInfo, IndexInfo
 
-class BaseSpec:
+
+class BaseSpec:  # pylint: disable=too-many-public-methods
     """A base class for DB wrapper, to provide common interface for different database implementations."""
 
     VALUE_ESCAPE = None  # a character which is used as placeholder for sql parameter, to avoid sql injections
     AUTO_FIELD_TYPE = None  # an sql base type name for auto incremented field
     AUTO_FIELD_CONSTRAINS = ()  # constrains that auto incremented field should have (ex. 'AUTOINCREMENT')
+    SUPPORTS_COPY = False  # whether rows could be transferred by COPY command, instead of INSERT/SELECT queries
+    CONVERTS_RESULTS = True  # whether db driver converts fetched values to python types of model fields
+    LAZY_RESULTS = False  # whether rows of a statement are computed by db, while they are fetched from cursor
+    SESSION_STATEMENT_TIMEOUT = False  # whether timeout, set on a connection, limits each of its statements
+    SUPPORTS_ALTER_COLUMN = False  # whether nullability of existing column could be changed by ALTER TABLE
+    SUPPORTS_CONCURRENT_INDEX = False  # whether indexes could be created/dropped without locking writes to table
+    SUPPORTS_RETURNING = False  # whether INSERT/UPDATE/DELETE queries could return column values by RETURNING clause
+    SUPPORTS_SELECT_FOR_UPDATE = False  # whether selected rows could be locked by FOR UPDATE clause
+    SUPPORTS_PARTITIONING = False  # whether table could be declared as partitioned, with partitions of own tables
+    MAX_QUERY_PARAMS = 999  # max number of parameters of a single query
 
     def __init__(self, connection_url):
         assert self.VALUE_ESCAPE, f"{self.__class__.__name__} should define value escape."
@@ -31,6 +48,14 @@ class BaseSpec:
         connection = self.db_driver.connect(self.connection_url)
         return connection
 
+    def begin(self, connection, immediate=False):
+        """
+        The method is called when a transaction should be started on connection with turned off auto-commit mode.
+
+        Drivers start transactions implicitly before the first query, so it does nothing by default.
+        `immediate` asks to take write lock at start of transaction, databases with row locks could ignore it.
+        """
+
     @property
     def value_escape(self):
         return str(self.VALUE_ESCAPE)
@@ -43,35 +68,339 @@ class BaseSpec:
     def auto_field_constrains(self):
         return tuple(self.AUTO_FIELD_CONSTRAINS)
 
+    @property
+    def supports_copy(self):
+        return bool(self.SUPPORTS_COPY)
+
+    @property
+    def supports_alter_column(self):
+        return bool(self.SUPPORTS_ALTER_COLUMN)
+
+    @property
+    def supports_concurrent_index(self):
+        return bool(self.SUPPORTS_CONCURRENT_INDEX)
+
+    @property
+    def supports_returning(self):
+        return bool(self.SUPPORTS_RETURNING)
+
+    @property
+    def supports_select_for_update(self):
+        return bool(self.SUPPORTS_SELECT_FOR_UPDATE)
+
+    @property
+    def supports_partitioning(self):
+        return bool(self.SUPPORTS_PARTITIONING)
+
+    @property
+    def max_query_params(self):
+        return int(self.MAX_QUERY_PARAMS)
+
+    def interrupt(self, connection):
+        """The method should abort a query, that is running on the connection in other thread."""
+        raise NotImplementedError
+
+    def shared_between_threads(self):
+        """Return a spec of connections, that could be passed from one thread to another (used by one at a time)."""
+        return self
+
+    def set_statement_timeout(self, connection, timeout):
+        """The method should make db abort statements of the connection, that run longer than `timeout` seconds."""
+        raise NotImplementedError
+
+    def reset_statement_timeout(self, connection, timeout=None):
+        """
+        The method should remove the limit of statements duration, set by `set_statement_timeout`,
+        or restore the default `timeout` of the connection, if db keeps it for the session.
+        """
+        raise NotImplementedError
+
+    def is_timeout_error(self, error):
+        """Should return whether the error of db driver is raised, since a statement was aborted."""
+        raise NotImplementedError
+
+    def get_table_columns(self, connection, table_name):
+        """Should return a list of `ColumnInfo` of existing table, or empty list if there is no such table."""
+        raise NotImplementedError
+
+    def get_table_indexes(self, connection, table_name):
+        """Should return a list of `IndexInfo` of indexes of existing table."""
+        raise NotImplementedError
+
+    def get_search_index_queries(self, table_name, pk_column, columns):
+        """Should return sql queries, that create full-text search index of the columns (kept in sync with rows)."""
+        raise NotImplementedError
+
+    def get_drop_search_index_queries(self, table_name):  # pylint: disable=unused-argument,no-self-use
+        """Return sql queries, that drop full-text search index, which is not dropped together with the table."""
+        return []
+
+    def get_search_columns(self):  # pylint: disable=no-self-use
+        """Return names of columns, that full-text search index adds to the table."""
+        return ()
+
+    def has_search_index(self, connection, table_name):
+        """Should return whether full-text search index of the table exists."""
+        raise NotImplementedError
+
+    def get_search_condition(self, table_name, table_ref, pk_column):
+        """
+        Should return sql of full-text search condition as a triple of left operand, operator and right operand,
+        which contains a placeholder of the search query. `table_ref` is the table name or alias in the query.
+        """
+        raise NotImplementedError
+
+    def get_search_rank(self, table_name, table_ref, pk_column):
+        """Should return sql of relevance of a row to the search query (given by placeholder), greater is better."""
+        raise NotImplementedError
+
+    def prepare_search_query(self, query):  # pylint: disable=no-self-use
+        """Return parameter of search query, which is a plain text, that rows should contain all words of."""
+        return query
+
+    def get_row_converter(self, fields):
+        """
+        Return a function, that converts raw values of a fetched row to python values of the fields.
+
+        The conversion plan is prepared once for the select list, so only values that require conversion are touched.
+        Return None if no conversion is required.
+        """
+        if self.CONVERTS_RESULTS:
+            return None
+
+        conversion_plan = []
+        for index, field in enumerate(fields):
+            db_converter = field.get_db_converter()
+            if db_converter:
+                conversion_plan.append((index, db_converter))
+        if not conversion_plan:
+            return None
+
+        def convert_row(row):
+            row = list(row)
+            for index, db_converter in conversion_plan:
+                value = row[index]
+                if value is not None:
+                    row[index] = db_converter(value)
+            return row
+
+        return convert_row
+
 
 class SQLiteSpec(BaseSpec):
     VALUE_ESCAPE = '?'
     AUTO_FIELD_TYPE = "INTEGER"
     AUTO_FIELD_CONSTRAINS = ("AUTOINCREMENT",)
+    CONVERTS_RESULTS = False
+    LAZY_RESULTS = True
+
+    # pragmas for concurrent reads with fast writes, at cost of durability of the last transactions on power loss:
+    HIGH_THROUGHPUT_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,  # negative value means size in KiB
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,  # milliseconds
+    }
+    PRAGMA_VALUE_PATTERN = re.compile(r'-?\w+')
+    RETURNING_MIN_VERSION = (3, 35, 0)
+    MAX_QUERY_PARAMS_VERSION = (3, 32, 0)  # version, that increased the max number of query parameters
+    SEARCH_WORD_PATTERN = re.compile(r'\w')
+    PROGRESS_HANDLER_STEPS = 1000  # number of virtual machine instructions between checks of statement timeout
+
+    def __init__(self, connection_url, pragmas=None, uri=False, shared_cache=False, cached_statements=None,
+                 check_same_thread=True):
+        # pylint: disable=too-many-arguments
+        super().__init__(connection_url)
+        self.pragmas = dict(pragmas or {})
+        self.uri = uri or shared_cache
+        self.shared_cache = shared_cache
+        self.cached_statements = cached_statements
+        self.check_same_thread = check_same_thread  # should be turned off to use connection in other threads
+
+        for name, value in self.pragmas.items():
+            if not name.isidentifier() or not self.PRAGMA_VALUE_PATTERN.fullmatch(str(value)):
+                raise ValueError(f'Invalid pragma {name} = {value}.')
 
     def prepare_db_driver(self):
         import sqlite3  # pylint: disable=import-outside-toplevel
 
         sqlite3.register_adapter(Decimal, str)
-        sqlite3.register_converter("DECIMAL", Decimal)
+        sqlite3.register_adapter(datetime.date, datetime.date.isoformat)
+        sqlite3.register_adapter(datetime.datetime, functools.partial(datetime.datetime.isoformat, sep=' '))
 
         return sqlite3
 
     def create_connection(self):
         sqlite3 = self.db_driver
+        connect_kwargs = {}
+        if self.cached_statements is not None:
+            connect_kwargs['cached_statements'] = self.cached_statements
+        if not self.check_same_thread:
+            connect_kwargs['check_same_thread'] = False
+
         connection = sqlite3.connect(
-            self.connection_url,
-            detect_types=sqlite3.PARSE_DECLTYPES,  # parse declared types and convert to a proper python value
+            self.database_uri if self.uri else self.connection_url,
+            uri=self.uri,
+            **connect_kwargs,
         )
+        for name, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value};')
         return connection
 
+    @property
+    def database_uri(self):
+        uri = self.connection_url if self.connection_url.startswith('file:') else f'file:{self.connection_url}'
+        if self.shared_cache:
+            separator = '&' if '?' in uri else '?'
+            uri = f'{uri}{separator}cache=shared'
+        return uri
+
+    @property
+    def supports_returning(self):
+        return self.db_driver.sqlite_version_info >= self.RETURNING_MIN_VERSION
+
+    @property
+    def max_query_params(self):
+        return 32766 if self.db_driver.sqlite_version_info >= self.MAX_QUERY_PARAMS_VERSION else 999
+
     def set_autocommit(self, connection, autocommit):
         connection.isolation_level = None if autocommit else ''
 
+    def interrupt(self, connection):
+        connection.interrupt()
+
+    def shared_between_threads(self):
+        """
+        Return the spec without the check of connection thread.
+
+        Each connection to a private in-memory db has its own database, so in-memory db, used by several threads
+        (a connection of each), should be opened with shared cache.
+        """
+        if not self.check_same_thread:
+            return self
+        db_spec = copy.copy(self)
+        db_spec.check_same_thread = False
+        return db_spec
+
+    def set_statement_timeout(self, connection, timeout):
+        # SQLite has no statement timeout, so the handler, called every few virtual machine instructions,
+        # aborts the statement, when the time is over:
+        deadline = time.monotonic() + timeout
+        connection.set_progress_handler(lambda: time.monotonic() > deadline, self.PROGRESS_HANDLER_STEPS)
+
+    def reset_statement_timeout(self, connection, timeout=None):
+        connection.set_progress_handler(None, 0)
+
+    def is_timeout_error(self, error):
+        return isinstance(error, self.db_driver.OperationalError) and str(error) == 'interrupted'
+
+    def get_table_columns(self, connection, table_name):
+        cursor = connection.execute(f'PRAGMA table_info({table_name});')
+        return [
+            ColumnInfo(name=name, sql_type=sql_type, null=not not_null, pk=bool(pk))
+            for __, name, sql_type, not_null, __, pk in cursor.fetchall()
+        ]
+
+    def get_table_indexes(self, connection, table_name):
+        indexes = []
+        for __, index_name, unique, *__ in connection.execute(f'PRAGMA index_list({table_name});').fetchall():
+            index_columns = connection.execute(f'PRAGMA index_info({index_name});').fetchall()
+            columns = tuple(column_name for __, __, column_name in sorted(index_columns))
+            indexes.append(IndexInfo(name=index_name, columns=columns, unique=bool(unique)))
+        return indexes
+
+    def get_search_index_queries(self, table_name, pk_column, columns):
+        # external content table keeps only the index, text of rows is read from the table itself:
+        search_table = self._get_search_table(table_name)
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f'new.{column}' for column in columns)
+        old_values = ', '.join(f'old.{column}' for column in columns)
+        insert_new = f'INSERT INTO {search_table} (rowid, {column_list}) VALUES (new.{pk_column}, {new_values});'
+        delete_old = (f"INSERT INTO {search_table} ({search_table}, rowid, {column_list}) "
+                      f"VALUES ('delete', old.{pk_column}, {old_values});")
+        return [
+            f"CREATE VIRTUAL TABLE {search_table} USING fts5({column_list}, "
+            f"content='{table_name}', content_rowid='{pk_column}');",
+            f'CREATE TRIGGER {search_table}_insert AFTER INSERT ON {table_name} BEGIN {insert_new} END;',
+            f'CREATE TRIGGER {search_table}_delete AFTER DELETE ON {table_name} BEGIN {delete_old} END;',
+            f'CREATE TRIGGER {search_table}_update AFTER UPDATE OF {column_list} ON {table_name} '
+            f'BEGIN {delete_old} {insert_new} END;',
+            f"INSERT INTO {search_table} ({search_table}) VALUES ('rebuild');",  # index existing rows
+        ]
+
+    def get_drop_search_index_queries(self, table_name):
+        return [f'DROP TABLE IF EXISTS {self._get_search_table(table_name)};']
+
+    def has_search_index(self, connection, table_name):
+        return bool(self.get_table_columns(connection, self._get_search_table(table_name)))
+
+    def get_search_condition(self, table_name, table_ref, pk_column):
+        search_table = self._get_search_table(table_name)
+        return f'{table_ref}.{pk_column}', 'IN', f'(SELECT rowid FROM {search_table} WHERE {search_table} MATCH {{0}})'
+
+    def get_search_rank(self, table_name, table_ref, pk_column):
+        search_table = self._get_search_table(table_name)
+        # bm25 rank of FTS5 is negative, lesser is better:
+        return (f'(SELECT -rank FROM {search_table} '
+                f'WHERE {search_table} MATCH {{0}} AND rowid = {table_ref}.{pk_column})')
+
+    def prepare_search_query(self, query):
+        # words are quoted, so the query is not parsed as FTS5 expression, and all of them should be matched,
+        # punctuation is skipped, since it's not indexed and empty phrase matches nothing:
+        words = [word.replace('"', '""') for word in query.split() if self.SEARCH_WORD_PATTERN.search(word)]
+        return ' '.join(f'"{word}"' for word in words) or '""'
+
+    @staticmethod
+    def _get_search_table(table_name):
+        return f'{table_name}_fts'
+
+    def begin(self, connection, immediate=False):
+        # sqlite3 starts transactions implicitly only before data modification queries,
+        # so savepoint, created before any of them, would start and end its own transaction:
+        if not connection.in_transaction:
+            # SQLite has no row locks, immediate transaction takes write lock of the whole db at once,
+            # so rows, read by the transaction, could not be changed by others until its end:
+            connection.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+
 
 class PostgreSQLSpec(BaseSpec):
     VALUE_ESCAPE = '%s'
     AUTO_FIELD_TYPE = "SERIAL"
+    SUPPORTS_COPY = True
+    SUPPORTS_ALTER_COLUMN = True
+    SUPPORTS_CONCURRENT_INDEX = True
+    SUPPORTS_RETURNING = True
+    SUPPORTS_SELECT_FOR_UPDATE = True
+    SUPPORTS_PARTITIONING = True
+    SESSION_STATEMENT_TIMEOUT = True
+    MAX_QUERY_PARAMS = 65535
+    SEARCH_CONFIG = 'english'  # text search configuration, that parses documents and queries
+    SEARCH_VECTOR_COLUMN = 'search_vector'
+    QUERY_CANCELED_CODE = '57014'  # error code of statements, aborted by timeout or cancel request
+
+    COLUMNS_QUERY = (
+        "SELECT c.column_name, c.data_type, c.is_nullable = 'YES', EXISTS ("
+        "SELECT 1 FROM information_schema.table_constraints tc "
+        "JOIN information_schema.key_column_usage kcu "
+        "ON kcu.constraint_name = tc.constraint_name AND kcu.table_schema = tc.table_schema "
+        "WHERE tc.constraint_type = 'PRIMARY KEY' AND tc.table_schema = c.table_schema "
+        "AND tc.table_name = c.table_name AND kcu.column_name = c.column_name) "
+        "FROM information_schema.columns c "
+        "WHERE c.table_schema = current_schema() AND c.table_name = %s "
+        "ORDER BY c.ordinal_position;"
+    )
+    # information_schema doesn't describe indexes, so they are queried from the system catalog:
+    INDEXES_QUERY = (
+        "SELECT i.relname, ix.indisunique, a.attname "
+        "FROM pg_index ix "
+        "JOIN pg_class t ON t.oid = ix.indrelid "
+        "JOIN pg_class i ON i.oid = ix.indexrelid "
+        "JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ANY(ix.indkey) "
+        "WHERE t.relname = %s AND t.relnamespace = current_schema()::regnamespace "
+        "ORDER BY i.relname, array_position(ix.indkey::int2[], a.attnum);"
+    )
 
     def prepare_db_driver(self):
         try:
@@ -82,3 +411,59 @@ class PostgreSQLSpec(BaseSpec):
 
     def set_autocommit(self, connection, autocommit):
         connection.autocommit = autocommit
+
+    def interrupt(self, connection):
+        connection.cancel()
+
+    def set_statement_timeout(self, connection, timeout):
+        with connection.cursor() as cursor:
+            cursor.execute('SET statement_timeout = %s;', (max(int(timeout * 1000), 1),))  # milliseconds
+
+    def reset_statement_timeout(self, connection, timeout=None):
+        # statements fail in aborted transaction, and the setting is reverted by its rollback anyway:
+        if connection.get_transaction_status() == self.db_driver.extensions.TRANSACTION_STATUS_INERROR:
+            return
+        if timeout is not None:
+            self.set_statement_timeout(connection, timeout)
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute('SET statement_timeout = DEFAULT;')
+
+    def is_timeout_error(self, error):
+        return getattr(error, 'pgcode', None) == self.QUERY_CANCELED_CODE
+
+    def get_table_columns(self, connection, table_name):
+        with connection.cursor() as cursor:
+            cursor.execute(self.COLUMNS_QUERY, (table_name,))
+            return [ColumnInfo(*row) for row in cursor.fetchall()]
+
+    def get_table_indexes(self, connection, table_name):
+        indexes = {}
+        with connection.cursor() as cursor:
+            cursor.execute(self.INDEXES_QUERY, (table_name,))
+            for index_name, unique, column_name in cursor.fetchall():
+                index = indexes.setdefault(index_name, IndexInfo(name=index_name, columns=[], unique=unique))
+                index.columns.append(column_name)
+        return [index._replace(columns=tuple(index.columns)) for index in indexes.values()]
+
+    def get_search_index_queries(self, table_name, pk_column, columns):
+        document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+        vector_column = self.SEARCH_VECTOR_COLUMN
+        return [
+            f"ALTER TABLE {table_name} ADD COLUMN {vector_column} tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{self.SEARCH_CONFIG}', {document})) STORED;",
+            f'CREATE INDEX {table_name}_search_idx ON {table_name} USING GIN ({vector_column});',
+        ]
+
+    def get_search_columns(self):
+        return (self.SEARCH_VECTOR_COLUMN,)
+
+    def has_search_index(self, connection, table_name):
+        columns = self.get_table_columns(connection, table_name)
+        return any(column.name == self.SEARCH_VECTOR_COLUMN for column in columns)
+
+    def get_search_condition(self, table_name, table_ref, pk_column):
+        return f'{table_ref}.{self.SEARCH_VECTOR_COLUMN}', '@@', f"plainto_tsquery('{self.SEARCH_CONFIG}', {{0}})"
+
+    def get_search_rank(self, table_name, table_ref, pk_column):
+        return f"ts_rank({table_ref}.{self.SEARCH_VECTOR_COLUMN}, plainto_tsquery('{self.SEARCH_CONFIG}', {{0}}))"
@@ -6,3 +6,11 @@ class DoesNotExists(Exception):
 
 class MultipleQueryResult(Exception):
     pass
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class VersionConflict(Exception):
+    pass
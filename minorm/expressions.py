@@ -1,9 +1,16 @@
 from collections import namedtuple
+import copy
+import re
 
 
 LOOKUP_SEPARATOR = '__'
 
 
+def relabel_columns(sql, table_name, alias):
+    """Return the sql, where columns of the table are qualified by the alias instead of the table name."""
+    return re.sub(rf'(?<![\w.]){re.escape(table_name)}\.', f'{alias}.', sql)
+
+
 class WhereCondition:
     AND = 'AND'
     OR = 'OR'
@@ -47,7 +54,7 @@ class WhereCondition:
         self._negated = False
 
     def __str__(self):
-        result = f'{self.field} {self.op} {self.value if self.no_escape else self.resolved_escape}'
+        result = self.render_condition()
 
         if self._and:
             result = f'{result} {self.AND} {self._and}'
@@ -60,9 +67,24 @@ class WhereCondition:
 
         return result
 
+    def render_condition(self):
+        return f'{self.field} {self.op} {self.render_value()}'
+
+    def render_value(self):
+        if self.no_escape or isinstance(self.value, (OuterRef, Subquery, ResolvedExpression)):
+            return str(self.value)
+        return self.resolved_escape
+
     def values(self):
         value = self.value
-        result = tuple(value) if self.op in self.MULTIPLE_VALUE_OPS else (value, )
+        if isinstance(value, (Subquery, WhereCondition, ResolvedExpression)):
+            result = value.values()
+        elif self.no_escape or isinstance(value, OuterRef):
+            result = ()
+        elif self.op in self.MULTIPLE_VALUE_OPS:
+            result = tuple(value)
+        else:
+            result = (value, )
 
         if self._and:
             result += self._and.values()
@@ -79,28 +101,250 @@ class WhereCondition:
         return '{0}'
 
     def __and__(self, other):
-        self._and = other
-        return self.clone()
+        # negation and OR have lower precedence than AND, so such conditions should be wrapped in parentheses:
+        new_where = self.grouped() if self._or or self._negated else self.clone()
+        other = other.grouped() if other._or else other.clone()
+        new_where._and = new_where._and & other if new_where._and else other
+        return new_where
 
     def __or__(self, other):
-        self._or = other
-        return self.clone()
+        new_where = self.grouped() if self._negated else self.clone()
+        new_where._or = new_where._or | other if new_where._or else other.clone()
+        return new_where
 
     def __invert__(self):
-        self._negated = not self._negated
-        return self.clone()
+        new_where = self.clone()
+        new_where._negated = not self._negated
+        return new_where
+
+    def grouped(self):
+        return WhereGroup(self.clone())
+
+    def resolve_outer_refs(self, model):
+        """Bind outer references of nested subqueries to the model of the enclosing query."""
+        if isinstance(self.value, (Subquery, WhereCondition)):
+            self.value.resolve_outer_refs(model)
+
+        if self._and:
+            self._and.resolve_outer_refs(model)
+
+        if self._or:
+            self._or.resolve_outer_refs(model)
 
     # pylint: disable=protected-access
-    def clone(self):
-        new_where = self.__class__(field=self.field, op=self.op, value=self.value, no_escape=self.no_escape)
+    def relabeled(self, table_name, alias, outer_refs=False):
+        """
+        Return a copy of the conditions, where columns of the table are qualified by the alias,
+        or only outer references of nested subqueries to the table, if `outer_refs` is set.
+        """
+        new_where = copy.copy(self)
+        value = self.value
+        if self.field and not outer_refs:
+            new_where.field = relabel_columns(self.field, table_name, alias)
+        if isinstance(value, (WhereCondition, Subquery)):
+            new_where.value = value.relabeled(table_name, alias, outer_refs=outer_refs)
+        elif isinstance(value, ResolvedExpression) and not outer_refs:
+            new_where.value = value.relabeled(table_name, alias)
+        elif isinstance(value, OuterRef) and outer_refs:
+            new_where.value = value.relabeled(table_name, alias)
+
+        new_where._and = self._and.relabeled(table_name, alias, outer_refs=outer_refs) if self._and else None
+        new_where._or = self._or.relabeled(table_name, alias, outer_refs=outer_refs) if self._or else None
+        return new_where
+
+    def iter_conditions(self):
+        yield self
+
+        if isinstance(self.value, WhereCondition):
+            yield from self.value.iter_conditions()
+
         if self._and:
-            new_where._and = self._and.clone()
+            yield from self._and.iter_conditions()
+
         if self._or:
-            new_where._or = self._or.clone()
-        new_where._negated = self._negated
+            yield from self._or.iter_conditions()
+
+    def clone(self):
+        new_where = copy.copy(self)
+        new_where._and = self._and.clone() if self._and else None
+        new_where._or = self._or.clone() if self._or else None
         return new_where
 
 
+class WhereGroup(WhereCondition):
+    """A chain of conditions, wrapped in parentheses."""
+
+    def __init__(self, where):
+        super().__init__(field=None, op=None, value=where)
+
+    def render_condition(self):
+        return f'({self.value})'
+
+
+class Exists(WhereCondition):
+    EXISTS = 'EXISTS'
+
+    def __init__(self, queryset):
+        super().__init__(field=None, op=self.EXISTS, value=Subquery(queryset))
+
+    def render_condition(self):
+        return f'{self.op} {self.render_value()}'
+
+
+class Subquery:
+    """A select query of a queryset, nested into another query as a value."""
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def __str__(self):
+        return f'({self.queryset.query})'
+
+    def values(self):
+        return self.queryset.query_params
+
+    # pylint: disable=protected-access
+    def resolve_outer_refs(self, model):
+        queryset = self.queryset
+        if queryset.model._meta.table_name == model._meta.table_name and not queryset._related.alias:
+            # the nested table shadows the outer one, so outer references could refer to it only by an alias:
+            self.queryset = queryset = queryset._aliased()
+
+        where = queryset._where
+        if not where:
+            return
+
+        for where_cond in where.iter_conditions():
+            if isinstance(where_cond.value, OuterRef):
+                where_cond.value.model = model
+
+    def relabeled(self, table_name, alias, outer_refs=False):
+        """Return the subquery, where outer references to the table are qualified by the alias."""
+        where = self.queryset._where
+        if outer_refs or not where:
+            return self  # columns of the subquery are qualified by its own tables, its subqueries refer to it only
+
+        queryset = self.queryset.all()
+        queryset._where = where.relabeled(table_name, alias, outer_refs=True)
+        return Subquery(queryset)
+
+
+class OuterRef:
+    """A reference to a field of an outer query, makes it possible to correlate a subquery with it."""
+
+    def __init__(self, field_name):
+        self.field_name = field_name
+        self.model = None
+        self.table_name = None  # alias of the outer table, if it's not referred by its name
+
+    def __str__(self):
+        if not self.model:
+            raise ValueError(f'Outer reference to "{self.field_name}" is not bound to any query.')
+
+        meta = self.model._meta  # pylint: disable=protected-access
+        field = meta.pk_field if self.field_name == 'pk' else meta.get_field(self.field_name)
+        return f'{self.table_name}.{field.column_name}' if self.table_name else field.query_name
+
+    def relabeled(self, table_name, alias):
+        if not self.model or (self.table_name or self.model._meta.table_name) != table_name:
+            return self
+
+        new_ref = copy.copy(self)
+        new_ref.table_name = alias
+        return new_ref
+
+
+class Expression:
+    """An expression, computed by db from columns of a row, could be combined with values by arithmetic operators."""
+
+    ADD = '+'
+    SUB = '-'
+    MUL = '*'
+    DIV = '/'
+
+    def __add__(self, other):
+        return CombinedExpression(self, self.ADD, other)
+
+    def __radd__(self, other):
+        return CombinedExpression(other, self.ADD, self)
+
+    def __sub__(self, other):
+        return CombinedExpression(self, self.SUB, other)
+
+    def __rsub__(self, other):
+        return CombinedExpression(other, self.SUB, self)
+
+    def __mul__(self, other):
+        return CombinedExpression(self, self.MUL, other)
+
+    def __rmul__(self, other):
+        return CombinedExpression(other, self.MUL, self)
+
+    def __truediv__(self, other):
+        return CombinedExpression(self, self.DIV, other)
+
+    def __rtruediv__(self, other):
+        return CombinedExpression(other, self.DIV, self)
+
+    def resolve(self, model, table_name=None):
+        """Return sql of the expression for fields of the model, columns are qualified by table name, if it's given."""
+        raise NotImplementedError
+
+
+class F(Expression):
+    """A reference to a field of the processed row, e.g. `F('views') + 1`."""
+
+    def __init__(self, field_name):
+        self.field_name = field_name
+
+    def resolve(self, model, table_name=None):
+        meta = model._meta  # pylint: disable=protected-access
+        field = meta.pk_field if self.field_name == 'pk' else meta.get_field(self.field_name)
+        column_name = f'{table_name}.{field.column_name}' if table_name else field.column_name
+        return ResolvedExpression(column_name)
+
+
+class CombinedExpression(Expression):
+    """Arithmetic operation on expressions or values, values are passed to query as parameters."""
+
+    def __init__(self, lhs, op, rhs):
+        self.lhs = lhs
+        self.op = op
+        self.rhs = rhs
+
+    def resolve(self, model, table_name=None):
+        lhs = self._resolve_operand(self.lhs, model, table_name)
+        rhs = self._resolve_operand(self.rhs, model, table_name)
+        return ResolvedExpression(f'{lhs} {self.op} {rhs}', params=lhs.values() + rhs.values())
+
+    @staticmethod
+    def _resolve_operand(operand, model, table_name):
+        if not isinstance(operand, Expression):
+            return ResolvedExpression('{0}', params=(operand, ))
+
+        resolved = operand.resolve(model, table_name=table_name)
+        if isinstance(operand, CombinedExpression):
+            return ResolvedExpression(f'({resolved})', params=resolved.values())
+        return resolved
+
+
+class ResolvedExpression:
+    """Sql of an expression, values are rendered as placeholders and passed to query as parameters."""
+
+    def __init__(self, sql, params=()):
+        self.sql = sql
+        self.params = tuple(params)
+
+    def __str__(self):
+        return self.sql
+
+    def values(self):
+        return self.params
+
+    def relabeled(self, table_name, alias):
+        return ResolvedExpression(relabel_columns(self.sql, table_name, alias), self.params)
+
+
 class OrderByExpression(namedtuple('OrderByExpression', 'value, ordering')):
     ASC = 'ASC'
     DESC = 'DESC'
@@ -120,6 +364,24 @@ class OrderByExpression(namedtuple('OrderByExpression', 'value, ordering')):
         return f'{self.value} {self.ordering}'
 
 
+class LockExpression(namedtuple('LockExpression', 'of, nowait, skip_locked')):
+    """Locking clause of select query, locks selected rows (only of listed tables, if any) until end of transaction."""
+
+    FOR_UPDATE = 'FOR UPDATE'
+    NOWAIT = 'NOWAIT'
+    SKIP_LOCKED = 'SKIP LOCKED'
+
+    def __str__(self):
+        lock_parts = [self.FOR_UPDATE]
+        if self.of:
+            lock_parts.append(f"OF {', '.join(self.of)}")
+        if self.nowait:
+            lock_parts.append(self.NOWAIT)
+        elif self.skip_locked:
+            lock_parts.append(self.SKIP_LOCKED)
+        return ' '.join(lock_parts)
+
+
 class JoinExpression:
     LEFT_OUTER = 'LEFT OUTER'
     INNER = 'INNER'
@@ -1,16 +1,22 @@
 import datetime
 import decimal
 
+from minorm.expressions import OuterRef, ResolvedExpression, Subquery
 
-class Field:
+
+class Field:  # pylint: disable=too-many-instance-attributes
     SQL_TYPE = None
 
-    def __init__(self, pk=False, null=False, unique=False, default=None, column_name=None):
+    def __init__(self, pk=False, null=False, unique=False, default=None, column_name=None, index=False,
+                 db_default=None):
+        # pylint: disable=too-many-arguments
         self._pk = pk
         self._null = null
         self._unique = unique
         self._default = default
         self._column_name = column_name
+        self._index = index
+        self._db_default = db_default  # sql expression of column default, e.g. 'CURRENT_TIMESTAMP'
         self._name = None
         self._model = None
 
@@ -18,6 +24,16 @@ class Field:
         """Should take a python value and return data in a format that prepared for use as parameter in query."""
         return value
 
+    def get_db_converter(self):  # pylint: disable=no-self-use
+        """
+        Should return a function, that converts a raw non-null value, fetched from db, to a python value.
+
+        Used only for databases, which drivers don't convert values of the field type
+        (see `BaseSpec.get_row_converter`).
+        None means that the value doesn't need conversion.
+        """
+        return None
+
     def render_sql(self):
         column_name = self.column_name
         sql_type = self.render_sql_type()
@@ -35,11 +51,20 @@ class Field:
             constrains.append('NOT NULL')
         if self._unique:
             constrains.append('UNIQUE')
+        if self._db_default is not None:
+            constrains.append(f'DEFAULT {self._db_default}')
         return constrains
 
     def render_sql_type(self):
         return self.SQL_TYPE
 
+    def render_sql_default(self):
+        """Render the default value as sql literal, return None if it can't be a constant of column definition."""
+        value = self._default
+        if value is None or callable(value):
+            return None
+        return render_sql_literal(value)
+
     def get_default(self):
         if callable(self._default):
             return self._default()
@@ -67,6 +92,22 @@ class Field:
     def is_pk(self):
         return bool(self._pk)
 
+    @property
+    def is_null(self):
+        return bool(self._null)
+
+    @property
+    def is_unique(self):
+        return bool(self._unique)
+
+    @property
+    def is_indexed(self):
+        return bool(self._index)
+
+    @property
+    def db_default(self):
+        return self._db_default
+
     @property
     def query_name(self):
         return f'{self.model._meta.table_name}.{self.column_name}'
@@ -86,7 +127,9 @@ class Field:
         if not lookup:
             return None
 
-        if lookup.name == 'in':
+        if isinstance(value, (OuterRef, Subquery, ResolvedExpression)):
+            adopted_value = value
+        elif lookup.name == 'in':
             adopted_value = [self.to_query_parameter(option) for option in value]
         else:
             adopted_value = self.to_query_parameter(value)
@@ -116,6 +159,13 @@ class IntegerField(Field):
             raise type(e)(f'Field "{self.name}" expected a number but got {value}.') from e
 
 
+class VersionField(IntegerField):
+    """Version of a row for optimistic concurrency control, it's checked and incremented by each update of the row."""
+
+    def __init__(self, column_name=None, default=1):
+        super().__init__(default=default, column_name=column_name)
+
+
 class FloatField(IntegerField):
     SQL_TYPE = 'REAL'
     number_type = float
@@ -132,12 +182,20 @@ class BooleanField(Field):
 
         raise ValueError(f'Field "{self.name}" value must be either True or False.')
 
+    def get_db_converter(self):
+        return bool
+
 
 class CharField(Field):
 
-    def __init__(self, pk=False, null=False, unique=False, default=None, column_name=None, **extra_kwargs):
+    def __init__(self, pk=False, null=False, unique=False, default=None, column_name=None, index=False, **extra_kwargs):
+        # pylint: disable=too-many-arguments
         max_length = extra_kwargs.pop('max_length')
-        super().__init__(pk=pk, null=null, unique=unique, default=default, column_name=column_name)
+        db_default = extra_kwargs.pop('db_default', None)
+        super().__init__(
+            pk=pk, null=null, unique=unique, default=default, column_name=column_name, index=index,
+            db_default=db_default,
+        )
         self.max_length = min(int(max_length), 255)
 
     def render_sql_type(self):
@@ -153,11 +211,15 @@ class CharField(Field):
 
 class DecimalField(Field):
 
-    def __init__(self, pk=False, null=False, unique=False, default=None, column_name=None, **extra_kwargs):
+    def __init__(self, pk=False, null=False, unique=False, default=None, column_name=None, index=False, **extra_kwargs):
+        # pylint: disable=too-many-arguments
         max_digits = extra_kwargs.pop('max_digits')
         decimal_places = extra_kwargs.pop('decimal_places')
+        db_default = extra_kwargs.pop('db_default', None)
 
-        super().__init__(pk, null=null, unique=unique, default=default, column_name=column_name)
+        super().__init__(
+            pk, null=null, unique=unique, default=default, column_name=column_name, index=index, db_default=db_default,
+        )
 
         self._max_digits = max_digits
         self._decimal_places = decimal_places
@@ -178,6 +240,9 @@ class DecimalField(Field):
         except (decimal.InvalidOperation, TypeError, ValueError) as e:
             raise ValueError(f'Field "{self.name}" value must be a decimal number.') from e
 
+    def get_db_converter(self):
+        return _decimal_from_db
+
 
 class DateField(Field):
     SQL_TYPE = 'DATE'
@@ -203,6 +268,12 @@ class DateField(Field):
 
         raise TypeError(f'Field "{self.name}" should be of type date or iso-format string but got {value}.')
 
+    def get_db_converter(self):
+        return self._date_from_db
+
+    def _date_from_db(self, value):
+        return datetime.datetime.strptime(value, self.FORMAT).date()
+
 
 class DateTimeField(Field):
     SQL_TYPE = 'TIMESTAMP'
@@ -229,6 +300,17 @@ class DateTimeField(Field):
 
         raise TypeError(f'Field "{self.name}" should be of type datetime or iso-format string but got {value}.')
 
+    def get_db_converter(self):
+        return self._datetime_from_db
+
+    def _datetime_from_db(self, value):
+        for fmt in self.FORMATS[:-1]:
+            try:
+                return datetime.datetime.strptime(value, fmt)
+            except ValueError:
+                pass
+        return datetime.datetime.strptime(value, self.FORMATS[-1])
+
 
 class AutoField(Field):
 
@@ -249,19 +331,24 @@ class AutoField(Field):
 
 class ForeignKey(Field):
 
-    def __init__(self, to, pk=False, null=False, unique=False, default=None, column_name=None):
+    def __init__(self, to, pk=False, null=False, unique=False, default=None, column_name=None, related_name=None,
+                 index=False):
         # pylint: disable=too-many-arguments
         if not column_name:
             column_name = f"{to._meta.table_name}_id"
 
-        super().__init__(pk=pk, null=null, unique=unique, default=default, column_name=column_name)
+        super().__init__(pk=pk, null=null, unique=unique, default=default, column_name=column_name, index=index)
         self.to = to
+        self.related_name = related_name
 
     def to_query_parameter(self, value):
         if isinstance(value, self.to):
             return value.pk
         return self.to._meta.pk_field.to_query_parameter(value)
 
+    def get_db_converter(self):
+        return self.to._meta.pk_field.get_db_converter()
+
     def render_sql_type(self):
         ref_pk_field = self.to._meta.pk_field
         fk_type = 'INTEGER' if isinstance(ref_pk_field, AutoField) else ref_pk_field.render_sql_type()
@@ -292,3 +379,52 @@ class ForeignKey(Field):
     @property
     def cached_instance_attr(self):
         return f'_{self.name}_cached'
+
+
+def render_sql_literal(value):
+    """Render a python value as sql literal, return None if there is no literal of the value type."""
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat(sep=' ') if isinstance(value, datetime.datetime) else value.isoformat()
+    if isinstance(value, str):
+        escaped_value = value.replace("'", "''")
+        return f"'{escaped_value}'"
+    return None
+
+
+def _decimal_from_db(value):
+    return decimal.Decimal(str(value))  # db may store decimals with numeric affinity, as floats
+
+
+class ReverseRelation:
+    """Descriptor of the model, referenced by foreign key, gives access to the referencing rows."""
+
+    PREFETCH_CACHE_ATTR = '_prefetched_relations'  # instance attribute that keeps prefetched rows of relations
+
+    def __init__(self, fk_field, name):
+        self.fk_field = fk_field
+        self.name = name
+
+    @property
+    def related_model(self):
+        return self.fk_field.model
+
+    def set_prefetched(self, instance, related_instances):
+        prefetch_cache = getattr(instance, self.PREFETCH_CACHE_ATTR, None)
+        if prefetch_cache is None:
+            prefetch_cache = {}
+            setattr(instance, self.PREFETCH_CACHE_ATTR, prefetch_cache)
+        prefetch_cache[self.name] = related_instances
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        qs = self.related_model.qs.filter(**{self.fk_field.name: instance.pk})
+        prefetch_cache = getattr(instance, self.PREFETCH_CACHE_ATTR, None)
+        if prefetch_cache and self.name in prefetch_cache:
+            qs._result_cache = list(prefetch_cache[self.name])  # pylint: disable=protected-access
+        return qs
@@ -1,4 +1,4 @@
-from minorm.expressions import WhereCondition
+from minorm.expressions import ResolvedExpression, WhereCondition
 from minorm.fields import Field
 
 
@@ -43,6 +43,11 @@ class In(Lookup):
     name = 'in'
     operator = 'IN'
 
+    def process(self, field_name, value):
+        if isinstance(value, ResolvedExpression):
+            raise ValueError('Lookup `in` expects a list of values or a queryset, not an expression.')
+        return super().process(field_name, value)
+
 
 @Field.register_lookup
 class NotEqual(Lookup):
@@ -55,9 +60,21 @@ class LikePattern(Lookup):
     like_pattern = ''
 
     def process(self, field_name, value):
+        if isinstance(value, ResolvedExpression):
+            return super().process(field_name, self._concat_pattern(value))
         pattern_value = self.like_pattern.format(value)
         return super().process(field_name, pattern_value)
 
+    def _concat_pattern(self, expression):
+        # the pattern is built by db, wildcards are passed as parameters: `{0} || (person.nick) || {0}`
+        prefix, suffix = self.like_pattern.split('{0}')
+        sql, params = f'({expression})', expression.values()
+        if prefix:
+            sql, params = f'{{0}} || {sql}', (prefix, *params)
+        if suffix:
+            sql, params = f'{sql} || {{0}}', (*params, suffix)
+        return ResolvedExpression(sql, params=params)
+
 
 @Field.register_lookup
 class StartsWith(LikePattern):
@@ -1,145 +1,348 @@
 from collections import OrderedDict
+import csv
 import functools
+import itertools
 import operator
-
-from minorm.exceptions import MultipleQueryResult
-from minorm.expressions import JoinExpression, LOOKUP_SEPARATOR, OrderByExpression, WhereCondition
-from minorm.queries import DeleteQuery, InsertQuery, SelectQuery, UpdateQuery
-
-
-class QuerySet:
+import time
+
+from minorm import transaction
+from minorm.exceptions import MultipleQueryResult, VersionConflict
+from minorm.expressions import (
+    Expression,
+    F,
+    LockExpression,
+    LOOKUP_SEPARATOR,
+    OrderByExpression,
+    OuterRef,
+    relabel_columns,
+    ResolvedExpression,
+    Subquery,
+    WhereCondition,
+)
+from minorm.fields import AutoField, Field, ForeignKey
+from minorm.queries import CopyFromQuery, CopyToQuery, DeleteQuery, InsertQuery, SelectQuery, UpdateQuery
+from minorm.raw import RawQuerySet
+from minorm.relations import RelationNode
+from minorm.sharding import ShardedQuerySetMixin
+from minorm.streams import CSVRowStream, encode_csv_row, get_row_encoder
+
+
+class QuerySet(ShardedQuerySetMixin):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    SEARCH_LOOKUP = 'search'  # full-text search lookup of model (or relation) with `search_fields`
+    PREFETCH_CHUNK_SIZE = 500  # max number of parent keys passed to a single prefetch query
+    COPY_BATCH_SIZE = 1000  # number of rows inserted at once, when db doesn't support COPY
+    EXPORT_CHUNK_SIZE = 2000  # number of rows fetched and written to file at once by export
+    EXPORT_FORMATS = ('csv', 'jsonl')
 
     def __init__(self, model):
         self.model = model
 
         self._where = None
-        self._order_by = set()
+        self._order_by = []
         self._limit = None
+        self._offset = None
 
         self._related = RelationNode(base_model=self.model)
         self._values_mapping = OrderedDict()
+        self._prefetch_related = []
+        self._lock = None  # lock expression with lookups of locked relations
+        self._rank = None  # pair of attribute name and resolved expression of full-text search relevance
+        self._timeout = None  # max duration of queries in seconds, by default `statement_timeout` of connector
+
+        self._db = None  # connector, specified explicitly by `using`
+        self._shard = None  # shard name, specified explicitly by `using`
+        self._key_shard = None  # shard name, resolved from shard key filter
+
+        self._result_cache = None
+
+    # methods build a new queryset by a clone, and set up its state directly:
+    # pylint: disable=protected-access
 
     def all(self):
         return self._clone()
 
-    def filter(self, **kwargs):
-        where_cond = self._where_action(**kwargs)
-        self._reset_where(where_cond, operator.and_)
-        return self._clone()
+    def filter(self, *args, **kwargs):
+        qs = self._clone()
+        where_cond, relations = qs._where_action(*args, **kwargs)
+        qs._reset_where(where_cond, operator.and_)
+        for relation in relations:
+            relation.is_required = True  # rows without related rows are filtered out anyway
+        if qs._key_shard is None:
+            qs._key_shard = qs._get_key_shard(kwargs)
+        return qs
+
+    def aswell(self, *args, **kwargs):
+        qs = self._clone()
+        where_cond, __ = qs._where_action(*args, **kwargs)
+        qs._reset_where(where_cond, operator.or_)
+        qs._related.reset_required()  # rows, matched by alternative lookups, could have no related rows
+        qs._key_shard = None  # rows, matched by alternative lookups, could be kept by any shard
+        return qs
+
+    def using(self, db):
+        """Perform queries of the queryset on the given shard (by name) of sharded db, or on the given connector."""
+        qs = self._clone()
+        if not isinstance(db, str):
+            qs._db = db
+            return qs
+
+        if not self.model._meta.is_sharded:
+            raise ValueError(f'Model {self.model.__name__} is not sharded.')
+        self.model._meta.get_db(db)
+        qs._shard = db
+        return qs
 
-    def aswell(self, **kwargs):
-        where_cond = self._where_action(**kwargs)
-        self._reset_where(where_cond, operator.or_)
-        return self._clone()
+    @property
+    def db(self):
+        """Connector, that queries of the queryset are performed on."""
+        if self._db is not None:
+            return self._db
+        return self.model._meta.get_db(self._shard_name)
 
     def order_by(self, *args):
+        qs = self._clone()
         for field_name in args:
             order_exp = OrderByExpression.from_field_name(field_name)
             field = self.model._meta.check_field(order_exp.value, with_pk=True)
-            self._order_by.add(OrderByExpression(value=field.query_name, ordering=order_exp.ordering))
-        return self._clone()
+            order_by_exp = OrderByExpression(value=field.query_name, ordering=order_exp.ordering)
+            if order_by_exp not in qs._order_by:
+                qs._order_by.append(order_by_exp)
+        return qs
 
     def values(self, *args):
+        qs = self._clone()
         if len(args) == 1 and args[0] is None:
-            self._values_mapping = OrderedDict()
+            qs._values_mapping = OrderedDict()
         else:
             for lookup in args:
-                val_parts = lookup.split(LOOKUP_SEPARATOR)
-                *relation_lookup, field_name = val_parts
-                if relation_lookup:
-                    relation = self._related.resolve_relation(relation_lookup)
-                else:
-                    relation = self._related
-
-                field = relation.model._meta.check_field(field_name, with_pk=True)
-                self._values_mapping[lookup] = f'{relation.table_shortcut}.{field.column_name}'
-
-        return self._clone()
-
-    def select_related(self, *args):
+                relation, field = qs._resolve_lookup_field(lookup)
+                qs._values_mapping[lookup] = f'{relation.table_shortcut}.{field.column_name}'
+
+        return qs
+
+    def select_related(self, *args, only=None):
+        """
+        Select instances of related models by joins. Fields of the model and of selected relations could be limited
+        by `only` lookups (e.g. `only=['title', 'author__name']`): if any field of a model is listed, only the listed
+        fields and the primary key are loaded, other fields are set to None (so such instances should not be saved).
+        """
+        qs = self._clone()
         if len(args) == 1 and args[0] is None:
-            self._related = RelationNode(base_model=self.model)
+            qs._related.unselect()  # relations are kept, since filters could use them
         else:
             for lookup in args:
                 lookup_parts = lookup.split(LOOKUP_SEPARATOR)
-                self._related.resolve_relation(lookup_parts, is_selected=True)
+                qs._related.resolve_relation(lookup_parts, is_selected=True)
 
-        return self._clone()
+        for lookup in only or ():
+            *relation_lookup, field_name = lookup.split(LOOKUP_SEPARATOR)
+            relation = qs._related.resolve_relation(relation_lookup) if relation_lookup else qs._related
+            if not relation.is_selected and not relation.is_root_node:
+                raise ValueError(f'Relation of {lookup} should be selected to limit its fields.')
+            relation.set_only(field_name)
+
+        return qs
+
+    def prefetch_related(self, *args):
+        qs = self._clone()
+        if len(args) == 1 and args[0] is None:
+            qs._prefetch_related = []
+        else:
+            for name in args:
+                self.model._meta.get_reverse_relation(name)
+                if name not in qs._prefetch_related:
+                    qs._prefetch_related.append(name)
+
+        return qs
+
+    def select_for_update(self, skip_locked=False, nowait=False, of=()):
+        """
+        Lock selected rows until the end of transaction, so the queryset should be evaluated inside atomic block.
+
+        Rows, locked by other transactions, are skipped if `skip_locked` is set, or cause an error if `nowait` is set,
+        instead of waiting for them. Pass `of` to lock only rows of the given relations ('self' is the model itself).
+        SQLite has no row locks, so there the block should be `atomic(immediate=True)`, which locks the whole db.
+        """
+        if skip_locked and nowait:
+            raise ValueError('Options skip_locked and nowait could not be used together.')
+
+        qs = self._clone()
+        for lookup in of:
+            qs._resolve_lock_relation(lookup)
+        qs._lock = LockExpression(of=tuple(of), nowait=nowait, skip_locked=skip_locked)
+        return qs
+
+    def search(self, query, rank='rank'):
+        """
+        Filter rows by full-text search of the model `search_fields` and order them by relevance, best first.
+        Relevance is selected as `rank` attribute of instances (or key of `values` dicts), greater is better.
+        """
+        if not self.model._meta.search_fields:
+            raise ValueError(f'Model {self.model.__name__} has no search fields.')
+
+        qs = self.filter(**{self.SEARCH_LOOKUP: query})
+        spec = qs._search_spec
+        meta = self.model._meta
+        rank_sql = spec.get_search_rank(meta.table_name, qs._related.table_shortcut, meta.pk_field.column_name)
+        qs._rank = (rank, ResolvedExpression(rank_sql, (spec.prepare_search_query(query),)))
+        return qs
+
+    def timeout(self, seconds):
+        """
+        Abort queries of the queryset, that run longer than `seconds`, by raising `QueryTimeout`.
+        Rows are fetched from db while they are iterated, so iteration is limited as well.
+        """
+        if seconds is not None and seconds <= 0:
+            raise ValueError('Timeout should be a positive number of seconds.')
+
+        qs = self._clone()
+        qs._timeout = seconds
+        return qs
 
     def fetch(self):
         rows = self._fetch_all()
-        return [self._instance_from_row(row, is_namedtuple=True) for row in rows]
+        return list(map(self._get_row_reader(is_namedtuple=True), rows))
+
+    def iterator(self):
+        """Iterate over results, streaming rows from db cursor, without caching them in the queryset."""
+        rows = self._iter_rows()
+        read_row = self._get_row_reader()
+        if not self._prefetch_related:
+            yield from map(read_row, rows)
+            return
 
-    def update(self, **kwargs):
-        update_data = OrderedDict()
-        for key, value in kwargs.items():
-            field = self.model._meta.check_field(key, with_pk=False)
-            adopted_value = field.to_query_parameter(value)
-            update_data[field.column_name] = adopted_value
+        for rows_chunk in iter(lambda: list(itertools.islice(rows, self.PREFETCH_CHUNK_SIZE)), []):
+            instances = [read_row(row) for row in rows_chunk]
+            self._prefetch_related_objects(instances)
+            yield from instances
+
+    def update(self, batch_size=None, sleep=0, progress=None, returning=None, **kwargs):
+        """
+        Update rows of the queryset, values could be expressions of row fields, like `F('views') + 1`.
+
+        Return number of updated rows, or, if `returning` is given, updated rows: as dicts of listed fields,
+        or as model instances, if `returning` is True. Version field of the rows is incremented, unless it's set.
+        """
+        # pylint: disable=too-many-arguments
+        version_field = self.model._meta.version_field
+        if version_field and version_field.name not in kwargs:
+            kwargs[version_field.name] = F(version_field.name) + 1  # instances, read before, become outdated
+
+        update_data, expressions = self._get_update_values(kwargs)
+        if self._is_fan_out:
+            return self._combine_shard_results(
+                [self.using(shard).update(batch_size, sleep, progress, returning, **kwargs)
+                 for shard in self._shard_names],
+                returning,
+            )
 
+        returning_fields, read_row = self._get_returning_reader(returning)
+        returning_columns = [field.column_name for field in returning_fields]
         update_query = UpdateQuery(
             table_name=self.model._meta.table_name,
-            fields=update_data.keys(),
+            fields=list(update_data),
             where=self._where,
+            returning=returning_columns,
+            expressions=expressions,
         )
-        raw_sql = update_query.render_sql(self.model._meta.db.spec)
-        params = tuple(update_data.values()) + (self._where.values() if self._where else ())
-        with self.model._meta.db.cursor() as curr:
-            curr.execute(raw_sql, params)
-        return curr.rowcount
+        set_params = update_query.get_params(update_data.values())
+        if batch_size:
+            query_factory = functools.partial(
+                UpdateQuery, fields=list(update_data), returning=returning_columns, expressions=expressions,
+            )
+            return self._execute_in_batches(query_factory, set_params, batch_size, sleep, progress, read_row)
 
-    def delete(self):
-        delete_query = DeleteQuery(table_name=self.model._meta.table_name, where=self._where)
-        raw_sql = delete_query.render_sql(self.model._meta.db.spec)
+        return self._execute_modification(update_query, set_params + self.query_params, read_row)
 
-        with self.model._meta.db.cursor() as curr:
-            curr.execute(raw_sql, self.query_params)
-        return curr.rowcount
+    def delete(self, batch_size=None, sleep=0, progress=None, returning=None):
+        """
+        Delete rows of the queryset.
+
+        Return number of deleted rows, or, if `returning` is given, deleted rows: as dicts of listed fields,
+        or as model instances, if `returning` is True.
+        """
+        if self._is_fan_out:
+            return self._combine_shard_results(
+                [self.using(shard).delete(batch_size, sleep, progress, returning) for shard in self._shard_names],
+                returning,
+            )
+
+        returning_fields, read_row = self._get_returning_reader(returning)
+        returning_columns = [field.column_name for field in returning_fields]
+        if batch_size:
+            query_factory = functools.partial(DeleteQuery, returning=returning_columns)
+            return self._execute_in_batches(query_factory, (), batch_size, sleep, progress, read_row)
+
+        delete_query = DeleteQuery(
+            table_name=self.model._meta.table_name, where=self._where, returning=returning_columns,
+        )
+        return self._execute_modification(delete_query, self.query_params, read_row)
+
+    def raw(self, raw_sql, params=()):
+        return RawQuerySet(model=self.model, raw_sql=raw_sql, params=params, db=self.db, timeout=self._timeout)
 
     def create(self, **kwargs):
         instance = self.model(**kwargs)
-        instance.save()
+        instance.save(using=self._db if self._db is not None else self._shard)
         return instance
 
     def get(self, **kwargs):
-        self._limit = 2
-        results = self._fetch_all(**kwargs)
+        qs = self.filter(**kwargs) if kwargs else self._clone()
+        if qs._limit is None or qs._limit > 2:
+            qs._limit = 2
+
+        results = list(qs)
         if not results:
             raise self.model.DoesNotExists
         if len(results) > 1:
             raise MultipleQueryResult
 
-        return self._instance_from_row(results[0])
+        return results[0]
 
     def first(self):
-        self._limit = 1
-        row = self._fetch_one()
-        if not row:
-            return None
+        if self._result_cache is not None:
+            return self._result_cache[0] if self._result_cache else None
 
-        return self._instance_from_row(row)
+        return next(iter(self[:1]), None)
 
     def exists(self):
-        qs = self.select_related(None).values(self.model._meta.pk_field.column_name)[:1]
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+
+        qs = self.select_related(None).prefetch_related(None).values(self.model._meta.pk_field.name)[:1]
+        qs._rank = None  # pylint: disable=protected-access
         is_exists = bool(qs._fetch_one())  # pylint: disable=protected-access
         return is_exists
 
     def __iter__(self):
-        raw_sql, params = self._prepare_sql()
-        with self.model._meta.db.cursor() as curr:
-            curr.execute(raw_sql, params)
-            for row in curr:
-                yield self._instance_from_row(row)
+        self._fetch_results()
+        return iter(self._result_cache)
+
+    def __len__(self):
+        self._fetch_results()
+        return len(self._result_cache)
+
+    def __bool__(self):
+        return self.exists()
 
     def __getitem__(self, item):
         if not any(isinstance(item, supported_type) for supported_type in (int, slice)):
             raise TypeError(f'{self.__class__.__name__} indices must be integers or slices.')
 
         if isinstance(item, slice):
-            self._limit = item.stop
-            return self._clone()
+            is_simple_slice = item.step is None and all(
+                index is None or index >= 0 for index in (item.start, item.stop)
+            )
+            if self._result_cache is not None or not is_simple_slice:
+                return list(self)[item]
+            return self._clone_sliced(item.start, item.stop)
+
+        if self._result_cache is None and item >= 0:
+            fetched_items = list(self._clone_sliced(item, item + 1))
+            item = 0
+        else:
+            fetched_items = list(self)
 
-        fetched_items = tuple(self)
         try:
             return fetched_items[item]
         except IndexError:
@@ -147,55 +350,254 @@ class QuerySet:
 
     def bulk_create(self, instances):
         model = self.model
+        if self._is_fan_out:
+            shard_instances = self._group_by_shard(instances)
+            return sum(self.using(shard).bulk_create(objs) for shard, objs in shard_instances.items())
+
         fields = model._meta.fields
-        db = model._meta.db
+        db = self.db
 
         insert_query = InsertQuery(table_name=model._meta.table_name, fields=[field.column_name for field in fields])
         raw_sql = insert_query.render_sql(db.spec)
         params = [[getattr(obj, field.name) for field in fields] for obj in instances if isinstance(obj, model)]
-        with db.cursor() as curr:
+        with db.cursor(timeout=self._timeout) as curr:
             curr.executemany(raw_sql, params)
         return curr.rowcount
 
+    def bulk_update(self, instances, fields):
+        """
+        Update the given fields of rows of the instances, by their primary keys, in one transaction.
+
+        If the model has version field, rows are updated only if they have the same versions as the instances,
+        and versions are incremented. If any row was changed by other transaction, `VersionConflict` is raised,
+        and no rows are updated (of the same shard). Return number of updated rows.
+        """
+        model = self.model
+        instances = list(instances)
+        if self._is_fan_out:
+            shard_instances = self._group_by_shard(instances)
+            return sum(self.using(shard).bulk_update(objs, fields) for shard, objs in shard_instances.items())
+
+        meta = model._meta
+        version_field = meta.version_field
+        update_fields = [meta.check_field(field_name) for field_name in fields]
+        update_fields = [field for field in update_fields if field is not version_field]  # it's always incremented
+        if any(instance.pk is None for instance in instances):
+            raise ValueError(f'{model.__name__} instances without pk could not be updated.')
+
+        where_cond = WhereCondition(meta.pk_field.query_name, WhereCondition.EQ, None)
+        if version_field:
+            where_cond &= WhereCondition(version_field.query_name, WhereCondition.EQ, None)
+        column_names = [field.column_name for field in update_fields]
+        if version_field:
+            column_names.append(version_field.column_name)
+        query = UpdateQuery(table_name=meta.table_name, fields=column_names, where=where_cond)
+        params = [self._get_bulk_update_params(instance, update_fields, version_field) for instance in instances]
+
+        db = self.db
+        with transaction.atomic(db=db):
+            with db.cursor(timeout=self._timeout) as curr:
+                curr.executemany(query.render_sql(db.spec), params)
+                if version_field and curr.rowcount < len(instances):
+                    raise VersionConflict(
+                        f'{len(instances) - curr.rowcount} rows of {model.__name__} were changed or deleted.'
+                    )
+
+        if version_field:
+            for instance in instances:
+                setattr(instance, version_field.name, getattr(instance, version_field.name) + 1)
+        self._result_cache = None
+        return curr.rowcount
+
+    def copy_from(self, rows, batch_size=None):
+        """
+        Load rows, given as model instances or tuples of non-auto field values, to the model table.
+
+        Uses COPY command when db supports it, otherwise rows are inserted in batches.
+        """
+        model = self.model
+        db = self.db
+        fields = [field for field in model._meta.fields if not isinstance(field, AutoField)]
+        column_names = [field.column_name for field in fields]
+        row_values = (self._copy_row_values(row, fields) for row in rows)
+
+        if db.spec.supports_copy:
+            copy_query = CopyFromQuery(table_name=model._meta.table_name, fields=column_names)
+            with db.cursor(timeout=self._timeout) as curr:
+                curr.copy_expert(copy_query.render_sql(db.spec), CSVRowStream(row_values))
+            return curr.rowcount
+
+        insert_query = InsertQuery(table_name=model._meta.table_name, fields=column_names)
+        raw_sql = insert_query.render_sql(db.spec)
+        batch_size = batch_size or self.COPY_BATCH_SIZE
+        rowcount = 0
+        with db.cursor(timeout=self._timeout) as curr:
+            for batch in iter(lambda: list(itertools.islice(row_values, batch_size)), []):
+                curr.executemany(raw_sql, batch)
+                rowcount += curr.rowcount
+        return rowcount
+
+    def copy_to(self, file_obj, header=False):
+        """
+        Write rows of the queryset to a text file in CSV format, return number of written rows.
+
+        Uses COPY command when db supports it, otherwise rows are streamed from select query.
+        """
+        db = self.db
+        if header:
+            field_names = list(self._values_mapping) if self._values_mapping else self._related.get_field_names()
+            csv.writer(file_obj, lineterminator='\n').writerow(field_names)
+
+        select_sql = str(self.query).format(db.spec.value_escape)
+        if db.spec.supports_copy:
+            with db.cursor(timeout=self._timeout) as curr:
+                bound_select_sql = curr.mogrify(select_sql, self.query_params).decode()
+                copy_query = CopyToQuery(table_name=f'({bound_select_sql})')
+                curr.copy_expert(copy_query.render_sql(db.spec), file_obj)
+            return curr.rowcount
+
+        rowcount = 0
+        with db.cursor(timeout=self._timeout) as curr:
+            curr.execute(select_sql, self.query_params)
+            for row in curr:
+                file_obj.write(encode_csv_row(row))
+                rowcount += 1
+        return rowcount
+
+    def export(self, file_obj, format='csv', fields=None, header=True):  # pylint: disable=redefined-builtin
+        """
+        Write rows of the queryset to a text file in CSV or JSON Lines ('jsonl') format, return number of rows.
+
+        Only the `fields` lookups are exported, if they are given. Rows are fetched from db by chunks and encoded
+        right from raw values of columns, without creating model instances, and each chunk is written at once.
+        """
+        if format not in self.EXPORT_FORMATS:
+            raise ValueError(f'Unknown export format {format}, it should be one of: {", ".join(self.EXPORT_FORMATS)}.')
+
+        qs = self.values(None).values(*fields) if fields else self
+        names = list(qs._values_mapping) if qs._values_mapping else qs._related.get_field_names()
+        if qs._rank:
+            names.append(qs._rank[0])
+        encode_row = get_row_encoder(format, names, qs._get_select_fields())
+        if format == 'csv' and header:
+            csv.writer(file_obj, lineterminator='\n').writerow(names)
+
+        rowcount = 0
+        for chunk in qs._iter_raw_chunks(self.EXPORT_CHUNK_SIZE):
+            file_obj.write('\n'.join(map(encode_row, chunk)) + '\n')
+            rowcount += len(chunk)
+        return rowcount
+
     @property
     def query(self):
-        column_names = self._values_mapping.values() if self._values_mapping else self._related.get_column_names()
-        joins = self._related.get_joins()
+        column_names = self._get_column_names()
+        if self._rank:
+            rank_name, rank_expression = self._rank
+            column_names.append(f'{rank_expression} AS {rank_name}')
+        used_relations = self._get_used_relations()
 
         query = (SelectQuery(table_name=self._related.table_name, fields=column_names)
-                 .join(joins)
+                 .join(self._related.get_joins(used_relations))
                  .where(self._where)
                  .limit(self._limit)
-                 .order_by(self._order_by))
+                 .offset(self._offset)
+                 .order_by(self._get_ordering()))
+        if self._lock:
+            locked_tables = [self._resolve_lock_relation(lookup).table_shortcut for lookup in self._lock.of]
+            query.lock(self._lock._replace(of=locked_tables))
         return query
 
     @property
     def query_params(self):
-        return self._where.values() if self._where else ()
+        select_params = self._rank[1].values() if self._rank else ()
+        return select_params + (self._where.values() if self._where else ())
 
-    # pylint: disable=protected-access
     def _clone(self):
         new_qs = self.__class__(model=self.model)
         if self._where:
             new_qs._where = self._where.clone()
-        new_qs._order_by = set(self._order_by)
+        new_qs._order_by = list(self._order_by)
         new_qs._limit = self._limit
+        new_qs._offset = self._offset
         new_qs._related = self._related.clone()
         new_qs._values_mapping = OrderedDict(self._values_mapping)
+        new_qs._prefetch_related = list(self._prefetch_related)
+        new_qs._lock = self._lock
+        new_qs._rank = self._rank
+        new_qs._timeout = self._timeout
+        new_qs._db = self._db
+        new_qs._shard = self._shard
+        new_qs._key_shard = self._key_shard
+        return new_qs
+
+    def _aliased(self):
+        """Return a clone, which root table is referred by an alias, so it could be nested into a query of the table."""
+        table_name = self.model._meta.table_name
+        where_conds = self._where.iter_conditions() if self._where else ()
+        nested_aliases = {
+            cond.value.queryset._related.alias for cond in where_conds if isinstance(cond.value, Subquery)
+        }
+        alias = next(f'U{index}' for index in itertools.count() if f'U{index}' not in nested_aliases)
+
+        qs = self._clone()
+        qs._related.alias = alias
+        qs._where = self._where.relabeled(table_name, alias) if self._where else None
+        for lookup, column_name in self._values_mapping.items():
+            qs._values_mapping[lookup] = relabel_columns(column_name, table_name, alias)
+        qs._order_by = [exp._replace(value=relabel_columns(exp.value, table_name, alias)) for exp in self._order_by]
+        if self._rank:
+            qs._rank = (self._rank[0], self._rank[1].relabeled(table_name, alias))
+        return qs
+
+    def _clone_sliced(self, start, stop):
+        """Return a clone, that selects a part of the queryset rows (indices are relative to the queryset)."""
+        start = start or 0
+        new_qs = self._clone()
+        new_qs._offset = (self._offset or 0) + start or None
+
+        limit = self._limit - start if self._limit is not None else None
+        if stop is not None:
+            limit = stop - start if limit is None else min(limit, stop - start)
+        new_qs._limit = max(limit, 0) if limit is not None else None
         return new_qs
 
+    def _fetch_results(self):
+        if self._result_cache is None:
+            self._result_cache = list(self.iterator())
+
     def _where_action(self, *args, **kwargs):
+        """Return where condition of the lookups, and relation nodes, that the conditions of lookups refer to."""
         kwargs = self._check_pk_lookups(kwargs)
         where_conds = list(args)
+        relations = []
+        reverse_lookups = OrderedDict()  # lookups of reverse relations, by lookup parts of the relations
         for key, value in kwargs.items():
             lookup_parts = key.split(LOOKUP_SEPARATOR)
-            where_cond = self._check_lookup_condition(lookup_parts, value)
+            reverse_parts = self._get_reverse_relation_parts(lookup_parts)
+            if reverse_parts:
+                related_lookup = LOOKUP_SEPARATOR.join(lookup_parts[len(reverse_parts):]) or 'pk'
+                reverse_lookups.setdefault(tuple(reverse_parts), {})[related_lookup] = value
+                continue
+
+            relation, where_cond = self._check_lookup_condition(lookup_parts, value)
+            if not where_cond:
+                relation, where_cond = self._get_search_condition(lookup_parts, value)
             if not where_cond:
-                where_cond = self._get_field_equal_condition(lookup_parts, value)
+                relation, where_cond = self._get_field_equal_condition(lookup_parts, value)
+            relation.is_filtered = True
+            relations.append(relation)
+            where_conds.append(where_cond)
+
+        for reverse_parts, related_lookups in reverse_lookups.items():
+            relation, where_cond = self._get_reverse_relation_condition(list(reverse_parts), related_lookups)
+            relation.is_filtered = True
+            relations.append(relation)
             where_conds.append(where_cond)
 
         result = functools.reduce(operator.and_, where_conds) if where_conds else None
-        return result
+        if result:
+            result.resolve_outer_refs(self.model)
+        return result, relations
 
     def _reset_where(self, where_cond, op):
         if not where_cond:
@@ -206,30 +608,269 @@ class QuerySet:
         else:
             self._where = op(self._where, where_cond)
 
-    def _fetch_all(self, **extra_lookups):
-        raw_sql, params = self._prepare_sql(**extra_lookups)
-        with self.model._meta.db.cursor() as curr:
+    def _iter_rows(self):
+        if self._is_fan_out:
+            yield from self._iter_shards_rows()
+            return
+
+        db = self.db
+        if self._lock:
+            self._check_lock_transaction(db)
+        raw_sql, params = self._prepare_sql()
+        convert_row = db.spec.get_row_converter(self._get_select_fields())
+        with db.cursor(timeout=self._timeout) as curr:
             curr.execute(raw_sql, params)
-            results = curr.fetchall()
-        return results
+            if convert_row:
+                yield from map(convert_row, curr)
+            else:
+                yield from curr
+
+    def _iter_raw_chunks(self, chunk_size):
+        """Select rows by chunks of `chunk_size` rows, values are not converted."""
+        if self._is_fan_out:
+            # each shard streams rows by its own cursor, so only a chunk of rows per shard is kept in memory:
+            rows = self._iter_shards_raw_rows(chunk_size)
+            yield from iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+            return
 
-    def _fetch_one(self, **extra_lookups):
-        raw_sql, params = self._prepare_sql(**extra_lookups)
-        with self.model._meta.db.cursor() as curr:
+        db = self.db
+        if self._lock:
+            self._check_lock_transaction(db)
+        raw_sql, params = self._prepare_sql()
+        with db.cursor(timeout=self._timeout) as curr:
             curr.execute(raw_sql, params)
-            result = curr.fetchone()
-        return result
+            yield from iter(lambda: curr.fetchmany(chunk_size), [])
+
+    def _iter_pk_batches(self, batch_size):
+        """
+        Select primary keys of the queryset rows in ascending order, by chunks of `batch_size` keys.
+
+        Rows of a sliced queryset depend on its ordering, so their keys are selected by one query, in that order.
+        """
+        pk_field = self.model._meta.pk_field
+        pk_qs = self.values(None).values(pk_field.name)
+        pk_qs._lock = None  # keys are selected outside of transactions of chunks
+        if self._limit is not None or self._offset:
+            pks = [row[0] for row in pk_qs._fetch_all()]
+            for index in range(0, len(pks), batch_size):
+                yield pks[index:index + batch_size]
+            return
+
+        pk_qs._order_by = [OrderByExpression(value=pk_field.query_name, ordering=OrderByExpression.ASC)]
+        pk_qs._limit = batch_size
+        pk_qs._rank = None
+
+        batch_qs = pk_qs
+        while True:
+            pks = [row[0] for row in batch_qs._fetch_all()]
+            if not pks:
+                return
+            yield pks
+            if len(pks) < batch_size:
+                return
+            batch_qs = pk_qs.filter(**{f'{pk_field.name}__gt': pks[-1]})  # keyset pagination, instead of offset
+
+    def _execute_in_batches(self, query_factory, params, batch_size, sleep, progress, read_row=None):
+        """
+        Run update/delete query for chunks of rows, selected by primary keys, and commit each chunk separately.
+
+        Sleep for `sleep` seconds between chunks, and pass number of processed rows to `progress` after each one.
+        Return number of processed rows, or list of returned rows, read by `read_row`, if it's given.
+        """
+        # pylint: disable=too-many-arguments,too-many-locals
+        meta = self.model._meta
+        db = self.db
+        # rows are re-checked by filters, in case they were changed since keys were selected:
+        recheck_where = self._where if self._where and not self._related.get_joins() else None
+
+        processed_number = 0
+        returned_rows = []
+        for batch_number, pks in enumerate(self._iter_pk_batches(batch_size)):
+            if batch_number and sleep:
+                time.sleep(sleep)
+
+            where_cond = WhereCondition(meta.pk_field.query_name, WhereCondition.IN, pks)
+            if recheck_where:
+                where_cond = where_cond & recheck_where
+            query = query_factory(table_name=meta.table_name, where=where_cond)
+            with transaction.atomic(db=db):
+                with db.cursor(timeout=self._timeout) as curr:
+                    curr.execute(query.render_sql(db.spec), params + where_cond.values())
+                    batch_rows = curr.fetchall() if read_row else None
+            if read_row:
+                returned_rows.extend(batch_rows)
+                processed_number += len(batch_rows)
+            else:
+                processed_number += curr.rowcount
+
+            if progress:
+                progress(processed_number)
+
+        self._result_cache = None
+        return list(map(read_row, returned_rows)) if read_row else processed_number
+
+    def _get_update_values(self, kwargs):
+        """Return query parameters of updated columns, and resolved expressions of columns, which are computed by db."""
+        update_data = OrderedDict()
+        expressions = {}
+        for key, value in kwargs.items():
+            field = self.model._meta.check_field(key, with_pk=False)
+            if isinstance(value, Expression):
+                expressions[field.column_name] = value.resolve(self.model)
+                update_data[field.column_name] = None
+            else:
+                update_data[field.column_name] = field.to_query_parameter(value)
+        return update_data, expressions
+
+    def _execute_modification(self, query, params, read_row=None):
+        """Run update/delete query, return number of modified rows, or their returned rows, if `read_row` is given."""
+        db = self.db
+        with db.cursor(timeout=self._timeout) as curr:
+            curr.execute(query.render_sql(db.spec), params)
+            returned_rows = curr.fetchall() if read_row else None
+        self._result_cache = None
+        return list(map(read_row, returned_rows)) if read_row else curr.rowcount
+
+    def _get_returning_reader(self, returning):
+        """Return fields, that should be returned by update/delete query, and a function, that reads returned row."""
+        if returning is None:
+            return [], None
+
+        db = self.db
+        if not db.spec.supports_returning:
+            raise ValueError(f'{db.spec.__class__.__name__} database does not support RETURNING.')
+
+        meta = self.model._meta
+        names = None if returning is True else list(returning)
+        if names is None:
+            fields = meta.fields
+        else:
+            fields = [meta.pk_field if name == 'pk' else meta.get_field(name) for name in names]
+        convert_row = db.spec.get_row_converter(fields)
 
-    def _prepare_sql(self, **extra_lookups):
-        if extra_lookups:
-            where_cond = self._where_action(**extra_lookups)
-            self._reset_where(where_cond, operator.and_)
+        def read_row(row):
+            if convert_row:
+                row = convert_row(row)
+            return self.model.hydrate(row) if names is None else dict(zip(names, row))
 
+        return fields, read_row
+
+    def _fetch_all(self):
+        return list(self._iter_rows())
+
+    def _fetch_one(self):
+        return next(self._iter_rows(), None)
+
+    def _get_select_fields(self):
+        if not self._values_mapping:
+            fields = self._related.get_fields()
+        else:
+            fields = [self._resolve_lookup_field(lookup)[1] for lookup in self._values_mapping]
+        if self._rank:
+            fields.append(Field())  # values of rank are not converted
+        return fields
+
+    def _get_column_names(self):
+        return list(self._values_mapping.values()) if self._values_mapping else self._related.get_column_names()
+
+    def _get_ordering(self):
+        if not self._rank:
+            return self._order_by
+        rank_ordering = OrderByExpression(value=self._rank[0], ordering=OrderByExpression.DESC)
+        return [rank_ordering, *self._order_by]
+
+    @property
+    def _search_spec(self):
+        # shards are databases of the same kind, so spec of any of them renders search queries:
+        db = self._db if self._db is not None else self.model._meta.dbs[0]
+        return db.spec
+
+    def _get_used_relations(self):
+        """Return relation nodes, which columns are selected (or rows are locked) by the query."""
+        if self._values_mapping:
+            used_relations = {self._resolve_lookup_field(lookup)[0] for lookup in self._values_mapping}
+        else:
+            used_relations = {node for node, __, __ in self._related.get_selected_nodes()}
+        if self._lock:
+            used_relations.update(self._resolve_lock_relation(lookup) for lookup in self._lock.of)
+        return used_relations
+
+    def _resolve_lock_relation(self, lookup):
+        if lookup == 'self':
+            return self._related
+        return self._related.resolve_relation(lookup.split(LOOKUP_SEPARATOR))
+
+    @staticmethod
+    def _check_lock_transaction(db):
+        if not db.in_atomic_block:
+            raise transaction.TransactionError('Rows could be selected for update only inside atomic block.')
+        if not db.spec.supports_select_for_update and not db.in_immediate_block:
+            raise transaction.TransactionError(
+                f'{db.spec.__class__.__name__} database has no row locks, '
+                f'so rows could be selected for update only inside atomic(immediate=True) block.'
+            )
+
+    def _resolve_lookup_field(self, lookup):
+        *relation_lookup, field_name = lookup.split(LOOKUP_SEPARATOR)
+        relation = self._related.resolve_relation(relation_lookup) if relation_lookup else self._related
+        field = relation.model._meta.check_field(field_name, with_pk=True)
+        return relation, field
+
+    def _prepare_sql(self):
         select_query = self.query
-        raw_sql = select_query.render_sql(self.model._meta.db.spec)
+        raw_sql = select_query.render_sql(self.db.spec)
         params = self.query_params
         return raw_sql, params
 
+    def _prefetch_related_objects(self, instances):
+        if not instances or self._values_mapping:
+            return
+
+        pks = [instance.pk for instance in instances]
+        for name in self._prefetch_related:
+            reverse_relation = self.model._meta.get_reverse_relation(name)
+            fk_field = reverse_relation.fk_field
+            related_qs = reverse_relation.related_model.qs
+            if self._db is not None:
+                related_qs = related_qs.using(self._db)
+            elif self._shard_name is not None and related_qs.model._meta.is_sharded:
+                # related rows are expected to be kept in the same shard:
+                related_qs = related_qs.using(self._shard_name)
+
+            related_groups = {}
+            for i in range(0, len(pks), self.PREFETCH_CHUNK_SIZE):
+                chunk_lookup = {f'{fk_field.name}__in': pks[i:i + self.PREFETCH_CHUNK_SIZE]}
+                for related_instance in related_qs.filter(**chunk_lookup):
+                    related_groups.setdefault(getattr(related_instance, fk_field.raw_fk_attr), []).append(
+                        related_instance
+                    )
+
+            for instance in instances:
+                related_instances = related_groups.get(instance.pk, [])
+                for related_instance in related_instances:
+                    setattr(related_instance, fk_field.cached_instance_attr, instance)
+                reverse_relation.set_prefetched(instance, related_instances)
+
+    def _copy_row_values(self, row, fields):
+        if isinstance(row, self.model):
+            attr_names = [field.raw_fk_attr if isinstance(field, ForeignKey) else field.name for field in fields]
+            values = [getattr(row, attr_name) for attr_name in attr_names]
+        elif len(row) != len(fields):
+            raise ValueError(f'Row {row} should contain {len(fields)} values.')
+        else:
+            values = row
+
+        return [field.to_query_parameter(value) for field, value in zip(fields, values)]
+
+    def _get_bulk_update_params(self, instance, fields, version_field=None):
+        """Return parameters of update query of the instance row: values of the fields, pk and version condition."""
+        row_params = self._copy_row_values(instance, fields)
+        if not version_field:
+            return row_params + [instance.pk]
+
+        version = getattr(instance, version_field.name)
+        return row_params + [version + 1, instance.pk, version]
+
     def _check_pk_lookups(self, kwargs):
         pk_field_name = self.model._meta.pk_field.name
         result = {}
@@ -243,22 +884,44 @@ class QuerySet:
 
         return result
 
-    def _instance_from_row(self, row, is_namedtuple=False):
+    def _get_row_reader(self, is_namedtuple=False):
         if self._values_mapping:
-            return dict(zip(self._values_mapping, row))
+            keys = list(self._values_mapping)
+            if self._rank:
+                keys.append(self._rank[0])
+            return lambda row: dict(zip(keys, row))
 
-        instance, __ = self._related.row_to_instance(row, is_namedtuple=is_namedtuple)
-        return instance
+        read_row = self._related.get_row_reader(is_namedtuple=is_namedtuple)
+        if not self._rank or is_namedtuple:
+            return read_row
+
+        rank_name = self._rank[0]
+        if self.model._meta.compact:
+            raise ValueError(f'Compact model {self.model.__name__} could not keep {rank_name} attribute.')
+
+        def read_ranked_row(row):
+            instance = read_row(row)
+            instance.__dict__[rank_name] = row[-1]
+            return instance
+
+        return read_ranked_row
 
     def _check_lookup_condition(self, lookup_parts, value):
         if len(lookup_parts) < 2:
-            return None
+            return None, None
 
         *rel_lookups, field_name, lookup_name = lookup_parts
         related = self._related.resolve_relation(rel_lookups) if rel_lookups else self._related
 
-        field = related.model._meta.check_field(field_name, with_pk=True)
-        return field.resolve_lookup(lookup_name, value, table_name=related.table_shortcut)
+        try:
+            field = related.model._meta.check_field(field_name, with_pk=True)
+        except ValueError:
+            return None, None  # the last part is a field of reverse relation, not a lookup
+        if isinstance(value, QuerySet):
+            value = value._as_subquery()
+        elif isinstance(value, Expression):
+            value = value.resolve(self.model, table_name=self._related.table_shortcut)
+        return related, field.resolve_lookup(lookup_name, value, table_name=related.table_shortcut)
 
     def _get_field_equal_condition(self, lookup_parts, value):
         *rel_lookups, field_name = lookup_parts
@@ -266,96 +929,62 @@ class QuerySet:
         field = related.model._meta.check_field(field_name, with_pk=True)
 
         column_name = f'{related.table_shortcut}.{field.column_name}'
-        adopted_value = field.to_query_parameter(value)
-        return WhereCondition(field=column_name, op='=', value=adopted_value)
-
-
-class RelationNode:
-    """A helper class for constructing nested foreign relations."""
-
-    def __init__(self, base_model, depth=0, position=0):
-        self.model = base_model
-
-        self.depth = depth
-        self.position = position
-
-        self.is_selected = False  # should be True when the relation is marked in `select_related` method
-
-        self.relations = OrderedDict()
-
-    def resolve_relation(self, lookup_parts, is_selected=False):
-        field_name, *rest_lookup_parts = lookup_parts
-        if field_name not in self.relations:
-            field = self.model._meta.get_fk_field(field_name)
-            position = len(self.relations) + 1
-            self.relations[field_name] = RelationNode(base_model=field.to, depth=self.depth + 1, position=position)
-
-        if is_selected:
-            self.relations[field_name].is_selected = True
-
-        if rest_lookup_parts:
-            return self.relations[field_name].resolve_relation(rest_lookup_parts, is_selected=is_selected)
-        return self.relations[field_name]
-
-    @property
-    def is_root_node(self):
-        return self.depth == self.position == 0
-
-    @property
-    def table_shortcut(self):
-        if self.is_root_node:
-            return self.model._meta.table_name
-
-        return f'T{self.depth}{self.position}'
-
-    @property
-    def table_name(self):
-        if self.is_root_node:
-            return self.model._meta.table_name
-
-        return f'{self.model._meta.table_name} {self.table_shortcut}'
-
-    def get_column_names(self):
-        column_names = [f'{self.table_shortcut}.{field.column_name}' for field in self.model._meta.fields]
-        for rel in self.relations.values():
-            if rel.is_selected:
-                column_names.extend(rel.get_column_names())
-        return column_names
-
-    def get_joins(self):
-        joins = []
-        for attr_name, rel in self.relations.items():
-            fk = self.model._meta.get_fk_field(attr_name)
-            joins.append(
-                JoinExpression.on_pk(
-                    outer_table=rel.table_name,
-                    fk_field=f'{self.table_shortcut}.{fk.column_name}',
-                    pk_field=f'{rel.table_shortcut}.{fk.to._meta.pk_field.column_name}',
-                )
-            )
-            joins.extend(rel.get_joins())
+        if isinstance(value, Expression):
+            adopted_value = value.resolve(self.model, table_name=self._related.table_shortcut)
+        elif isinstance(value, OuterRef):
+            adopted_value = value
+        else:
+            adopted_value = field.to_query_parameter(value)
+        return related, WhereCondition(field=column_name, op='=', value=adopted_value)
+
+    def _get_reverse_relation_parts(self, lookup_parts):
+        """Return parts of the lookup up to the first reverse relation, or None, if it has no reverse relations."""
+        meta = self.model._meta
+        for index, name in enumerate(lookup_parts):
+            if name in meta.reverse_relations:
+                return lookup_parts[:index + 1]
+            try:
+                meta = meta.get_fk_field(name).to._meta
+            except ValueError:
+                return None
+        return None
+
+    def _get_reverse_relation_condition(self, reverse_parts, related_lookups):
+        """
+        Return condition of rows, that have related rows, matched by all the lookups of the reverse relation.
+
+        Related rows are selected by subquery instead of join, so rows are not repeated for each related row.
+        """
+        *rel_lookups, reverse_name = reverse_parts
+        related = self._related.resolve_relation(rel_lookups) if rel_lookups else self._related
+        reverse_relation = related.model._meta.get_reverse_relation(reverse_name)
+        fk_name = reverse_relation.fk_field.name
+        related_qs = reverse_relation.related_model.qs.filter(**related_lookups).values(fk_name)
 
-        return joins
+        pk_column = f'{related.table_shortcut}.{related.model._meta.pk_field.column_name}'
+        return related, WhereCondition(field=pk_column, op=WhereCondition.IN, value=Subquery(related_qs))
 
-    def row_to_instance(self, row, is_namedtuple, row_shift=0):
-        model = self.model
+    def _get_search_condition(self, lookup_parts, value):
+        *rel_lookups, lookup_name = lookup_parts
+        if lookup_name != self.SEARCH_LOOKUP:
+            return None, None
 
-        row_part = row[row_shift:]
-        attr_names = (field.name for field in model._meta.fields)
-        kwargs = dict(zip(attr_names, row_part))
-        row_shift += len(kwargs)
-
-        for fk_name, rel in self.relations.items():
-            if rel.is_selected:
-                kwargs[fk_name], row_shift = rel.row_to_instance(row, is_namedtuple, row_shift=row_shift)
-
-        klass = model.query_namedtuple if is_namedtuple else model
-        return klass(**kwargs), row_shift
-
-    def clone(self):
-        new_instance = self.__class__(base_model=self.model, depth=self.depth, position=self.position)
-        new_instance.is_selected = self.is_selected
-        new_instance.relations = OrderedDict((
-            (field, relation.clone()) for field, relation in self.relations.items()
-        ))
-        return new_instance
+        related = self._related.resolve_relation(rel_lookups) if rel_lookups else self._related
+        meta = related.model._meta
+        if not meta.search_fields or lookup_name in [field.name for field in meta.fields]:
+            return None, None  # it's a field named as the lookup
+
+        spec = self._search_spec
+        lhs, op, rhs = spec.get_search_condition(meta.table_name, related.table_shortcut, meta.pk_field.column_name)
+        search_query = ResolvedExpression(rhs, (spec.prepare_search_query(value),))
+        return related, WhereCondition(field=lhs, op=op, value=search_query)
+
+    def _as_subquery(self):
+        qs = self.all()
+        qs._rank = None
+        if not qs._values_mapping:
+            qs = qs.values(self.model._meta.pk_field.name)
+        elif len(qs._values_mapping) > 1:
+            raise ValueError('Subquery should select only one field.')
+
+        return Subquery(qs)
@@ -1,11 +1,12 @@
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
-from minorm.connectors import connector
-from minorm.exceptions import DoesNotExists
-from minorm.expressions import WhereCondition
-from minorm.fields import AutoField, Field, ForeignKey
+from minorm.connectors import connector, ShardedConnector
+from minorm.exceptions import DoesNotExists, VersionConflict
+from minorm.expressions import Expression, WhereCondition
+from minorm.fields import AutoField, Field, ForeignKey, ReverseRelation, VersionField
 from minorm.managers import QuerySet
-from minorm.queries import CreateTableQuery, DeleteQuery, DropTableQuery, InsertQuery, UpdateQuery, SelectQuery
+from minorm.queries import DeleteQuery, DropTableQuery, InsertQuery, UpdateQuery, SelectQuery
+from minorm.schema import create_index_queries, create_search_index_queries, create_table_query
 
 
 class ModelMetaclass(type):
@@ -16,32 +17,25 @@ class ModelMetaclass(type):
             return super().__new__(cls, name, bases, namespace)
 
         fields = [class_attr for class_attr in namespace.values() if isinstance(class_attr, Field)]
-        # Extract model meta
         meta = namespace.pop('Meta', None)
-        table_name = getattr(meta, 'table_name', name.lower())
-        db = getattr(meta, 'db', connector)
-
         queryset_class = namespace.pop('queryset_class', QuerySet)
 
-        # Extract primary key:
-        pk_fields = [field for field in fields if field.is_pk]
-        if len(pk_fields) > 1:
-            raise ModelSetupError(f'Model {name} should have only one primary key.')
-        if pk_fields:
-            pk_field = pk_fields[0]
-        else:
-            pk_field = AutoField(pk=True, column_name='id')
-            setattr(pk_field, '_name', 'id')
+        pk_field = cls._get_pk_field(name, fields)
         fields.append(pk_field)
 
+        compact = getattr(meta, 'compact', False)
+        slotted_fields = cls._prepare_compact_namespace(namespace, pk_field) if compact else {}
+
         # Setup model pk, meta and queryset attributes:
         model = super().__new__(cls, name, bases, namespace)
 
+        for attr_name, field in slotted_fields.items():
+            field.__set_name__(model, attr_name)  # fields are replaced by slots, so it's not called automatically
+
         if not pk_field.model:
             setattr(pk_field, '_model', model)
 
-        setattr(model, '_meta', ModelOptions(model_name=model.__name__, db=db, table_name=table_name, fields=fields))
-
+        setattr(model, '_meta', cls._create_options(name, meta, fields))
         setattr(model, '_queryset_class', queryset_class)
 
         does_not_exists = type(f'{model.__name__}DoesNotExists', (DoesNotExists,), {})
@@ -50,30 +44,131 @@ class ModelMetaclass(type):
         query_namedtuple = namedtuple(f'{model.__name__}QueryNamedTuple', field_names=[field.name for field in fields])
         setattr(model, 'query_namedtuple', query_namedtuple)
 
+        for field in fields:
+            if isinstance(field, ForeignKey):
+                cls._register_reverse_relation(field)
+
         return model
 
+    @staticmethod
+    def _get_pk_field(name, fields):
+        """Return primary key of the model fields, or a new auto field, if pk is not declared."""
+        if len([field for field in fields if isinstance(field, VersionField)]) > 1:
+            raise ModelSetupError(f'Model {name} should have only one version field.')
+
+        pk_fields = [field for field in fields if field.is_pk]
+        if len(pk_fields) > 1:
+            raise ModelSetupError(f'Model {name} should have only one primary key.')
+        if pk_fields:
+            return pk_fields[0]
+
+        pk_field = AutoField(pk=True, column_name='id')
+        setattr(pk_field, '_name', 'id')
+        return pk_field
+
+    @staticmethod
+    def _create_options(name, meta, fields):
+        """Create options of the model from its `Meta` class, field names of the options are checked."""
+        shard_key = getattr(meta, 'shard_key', None)
+        partition_by = getattr(meta, 'partition_by', None)
+        options = ModelOptions(
+            model_name=name, db=getattr(meta, 'db', connector), table_name=getattr(meta, 'table_name', name.lower()),
+            fields=fields, compact=getattr(meta, 'compact', False), shard_key=shard_key, partition_by=partition_by,
+        )
+        if partition_by:
+            try:
+                method, key = partition_by
+                options.get_field(key)
+            except ValueError as err:
+                raise ModelSetupError(f'Partition of model {name} should be a pair of method and field name.') from err
+            if method.upper() not in ModelOptions.PARTITION_METHODS:
+                raise ModelSetupError(f'Partition method of model {name} should be one of '
+                                      f'{", ".join(ModelOptions.PARTITION_METHODS)}.')
+        try:
+            search_fields = [options.get_field(field_name) for field_name in getattr(meta, 'search_fields', ())]
+        except ValueError as err:
+            raise ModelSetupError(f'Search fields of model {name} should be field names.') from err
+        options.set_search_fields(search_fields)
+        if shard_key:
+            try:
+                options.get_field(shard_key)
+            except ValueError as err:
+                raise ModelSetupError(f'Shard key of model {name} should be a field name.') from err
+        return options
+
+    @staticmethod
+    def _prepare_compact_namespace(namespace, pk_field):
+        """
+        Replace field attributes of namespace by `__slots__`, so model instances are created without `__dict__`.
+
+        Foreign keys remain as descriptors, and their raw value and cached instance get own slots.
+        Return mapping of removed fields.
+        """
+        named_fields = {attr_name: attr for attr_name, attr in namespace.items() if isinstance(attr, Field)}
+        slots = [ReverseRelation.PREFETCH_CACHE_ATTR]
+        if pk_field.name not in named_fields:
+            slots.append(pk_field.name)
+
+        slotted_fields = {}
+        for attr_name, field in named_fields.items():
+            setattr(field, '_name', attr_name)
+            if isinstance(field, ForeignKey):
+                slots.extend((field.raw_fk_attr, field.cached_instance_attr))
+            else:
+                slots.append(attr_name)
+                slotted_fields[attr_name] = namespace.pop(attr_name)
+
+        namespace['__slots__'] = tuple(slots)
+        return slotted_fields
+
+    @staticmethod
+    def _register_reverse_relation(fk_field):
+        target = fk_field.to
+        name = fk_field.related_name or f'{fk_field.model._meta.name}_set'
+        if name in target._meta.reverse_relations or hasattr(target, name):
+            if fk_field.related_name:
+                raise ModelSetupError(f'Reverse relation {name} clashes with attribute of model {target.__name__}.')
+            return  # implicit name is already taken, `related_name` should be used to access the relation
+
+        reverse_relation = ReverseRelation(fk_field=fk_field, name=name)
+        target._meta.add_reverse_relation(reverse_relation)
+        setattr(target, name, reverse_relation)
+
     @property
     def qs(cls):
         return cls._queryset_class(model=cls)
 
+    def hydrate(cls, values):
+        """Create an instance from column values of a row, ordered as model fields, without calling `__init__`."""
+        instance = cls.__new__(cls)
+        for attr_setter, value in zip(cls._meta.attr_setters, values):
+            attr_setter(instance, value)
+        return instance
+
     def render_sql(cls):
-        field_params = [field.render_sql() for field in cls._meta.fields]
-        create_query = CreateTableQuery(table_name=cls._meta.table_name, params=field_params)
-        return create_query.render_sql()
+        return create_table_query(cls, cls._meta.db).render_sql()
 
     def create_table(cls):
         raw_sql = cls.render_sql()
-        with cls._meta.db.cursor() as curr:
-            curr.execute(raw_sql)
+        for db in cls._meta.dbs:
+            with db.cursor() as curr:
+                curr.execute(raw_sql)
+                for index_query in [*create_index_queries(cls), *create_search_index_queries(cls, db)]:
+                    curr.execute(index_query.render_sql())
 
     def drop_table(cls):
         drop_query = DropTableQuery(table_name=cls._meta.table_name)
         raw_sql = drop_query.render_sql()
-        with cls._meta.db.cursor() as curr:
-            curr.execute(raw_sql)
+        for db in cls._meta.dbs:
+            with db.cursor() as curr:
+                if cls._meta.search_fields:
+                    for search_sql in db.spec.get_drop_search_index_queries(cls._meta.table_name):
+                        curr.execute(search_sql)
+                curr.execute(raw_sql)
 
 
 class Model(metaclass=ModelMetaclass):
+    __slots__ = ()  # compact models should not get `__dict__` from the base class
 
     def __init__(self, **kwargs):
         for field in self.__class__._meta.fields:
@@ -88,89 +183,211 @@ class Model(metaclass=ModelMetaclass):
     def pk(self):
         return getattr(self, self.__class__._meta.pk_field.name)
 
-    def save(self):
+    def save(self, using=None, update_fields=None):
+        """
+        Insert a row of the instance, or update it, if the instance has pk (only `update_fields`, if they are given).
+
+        On insert, auto field and unset fields with `db_default` get values from db, they are returned by the same
+        query, if db supports RETURNING (otherwise only pk is set, by id of the last inserted row).
+        Updated values could be expressions of row fields, like `F('views') + 1`, they are computed by db,
+        so the instance should be refreshed from db to get them.
+        If the model has version field, the row is updated only if it has the same version as the instance,
+        and the version is incremented, otherwise (the row was changed by other transaction) `VersionConflict`
+        is raised.
+        """
         is_creation = not bool(self.pk)
+        modified_fields = self._get_modified_fields(is_creation, update_fields)
         self._adapt_values()
+        db = self._get_db(using)
+        if is_creation:
+            self._insert_row(db, modified_fields)
+        else:
+            self._update_row(db, modified_fields)
 
+    def _get_modified_fields(self, is_creation, update_fields=None):
         model = self.__class__
-
-        modified_fields = [field for field in model._meta.fields if not isinstance(field, AutoField)]
-        if is_creation:
-            query_class = InsertQuery
-            where_cond = None
+        if update_fields is not None:
+            if is_creation:
+                raise ValueError(f'{model.__name__} instance without pk could not be saved with update_fields.')
+            modified_fields = [model._meta.check_field(field_name) for field_name in update_fields]
         else:
-            query_class = UpdateQuery
-            where_cond = WhereCondition(model._meta.pk_field.query_name, WhereCondition.EQ, self.pk)
+            modified_fields = [field for field in model._meta.fields if not isinstance(field, AutoField)]
+            if is_creation:
+                # values of unset fields with db defaults are generated by db:
+                return [field for field in modified_fields
+                        if field.db_default is None or getattr(self, field.name) is not None]
+
+        version_field = model._meta.version_field
+        if version_field and not is_creation:
+            # version is always incremented, and it's set after the row is updated:
+            modified_fields = [field for field in modified_fields if field is not version_field] + [version_field]
+        return modified_fields
+
+    def _insert_row(self, db, fields):
+        """Insert a row of the instance, and set values, generated by db, to the instance."""
+        model = self.__class__
+        values = []
+        for field in fields:
+            value = getattr(self, field.name)
+            if isinstance(value, Expression):
+                raise ValueError(f'Expressions could not be saved to a new row of {model.__name__}.')
+            values.append(field.to_query_parameter(value))
+
+        generated_fields = [field for field in model._meta.fields if field not in fields]
+        returning = [field.column_name for field in generated_fields] if db.spec.supports_returning else ()
+        column_names = [field.column_name for field in fields]
+        query = InsertQuery(table_name=model._meta.table_name, fields=column_names, returning=returning)
+        with db.cursor() as curr:
+            curr.execute(query.render_sql(db.spec), values)
+            returned_row = curr.fetchone() if returning else None
+
+        if returned_row is None:
+            setattr(self, model._meta.pk_field.name, curr.lastrowid)
+            return
 
-        query = query_class(
-            table_name=model._meta.table_name,
-            fields=[field.column_name for field in modified_fields],
-            where=where_cond,
+        convert_row = db.spec.get_row_converter(generated_fields)
+        if convert_row:
+            returned_row = convert_row(returned_row)
+        for field, value in zip(generated_fields, returned_row):
+            setattr(self, field.name, value)
+
+    def _update_row(self, db, fields):
+        """Update the row of the instance, checking and incrementing its version, if the model has version field."""
+        model = self.__class__
+        version_field = model._meta.version_field
+        values = []
+        expressions = {}
+        for field in fields:
+            value = getattr(self, field.name)
+            if isinstance(value, Expression):
+                expressions[field.column_name] = value.resolve(model)
+                values.append(None)
+            elif field is version_field:
+                values.append(value + 1)
+            else:
+                values.append(field.to_query_parameter(value))
+
+        where_cond = WhereCondition(model._meta.pk_field.query_name, WhereCondition.EQ, self.pk)
+        if version_field:
+            version = getattr(self, version_field.name)
+            where_cond &= WhereCondition(version_field.query_name, WhereCondition.EQ, version)
+        query = UpdateQuery(
+            table_name=model._meta.table_name, fields=[field.column_name for field in fields], where=where_cond,
+            expressions=expressions,
         )
-        raw_sql = query.render_sql(model._meta.db.spec)
-        query_params = [field.to_query_parameter(getattr(self, field.name)) for field in modified_fields]
-        if where_cond:
-            query_params.extend(where_cond.values())
-        with model._meta.db.cursor() as curr:
-            curr.execute(raw_sql, query_params)
-        if is_creation:
-            setattr(self, model._meta.pk_field.name, curr.lastrowid)
+        with db.cursor() as curr:
+            curr.execute(query.render_sql(db.spec), query.get_params(values) + where_cond.values())
+
+        if version_field:
+            if curr.rowcount == 0:
+                raise VersionConflict(f'{model.__name__} row {self.pk} of version {version} was changed or deleted.')
+            setattr(self, version_field.name, version + 1)
 
     def _adapt_values(self):
         for field in self.__class__._meta.fields:
             field_name = field.name
-            adapted_value = field.to_query_parameter(getattr(self, field_name))
-            setattr(self, field_name, adapted_value)
+            value = getattr(self, field_name)
+            if not isinstance(value, Expression):
+                setattr(self, field_name, field.to_query_parameter(value))
 
-    def refresh_from_db(self):
+    def refresh_from_db(self, using=None):
         if not self.pk:
             return
 
         model = self.__class__
+        db = self._get_db(using)
 
         pk_cond = WhereCondition(model._meta.pk_field.query_name, WhereCondition.EQ, self.pk)
         query_fields = [field.query_name for field in model._meta.fields]
         select_query = SelectQuery(table_name=model._meta.table_name, fields=query_fields, where=pk_cond)
-        raw_sql = select_query.render_sql(model._meta.db.spec)
+        raw_sql = select_query.render_sql(db.spec)
         params = pk_cond.values()
-        with model._meta.db.cursor() as curr:
+        with db.cursor() as curr:
             curr.execute(raw_sql, params)
             row = curr.fetchone()
+        convert_row = db.spec.get_row_converter(model._meta.fields)
+        if convert_row:
+            row = convert_row(row)
         for i, field in enumerate(model._meta.fields):
             setattr(self, field.name, row[i])
 
-    def delete(self):
+    def delete(self, using=None):
         if not self.pk:
             return 0
 
         model = self.__class__
+        db = self._get_db(using)
         pk_cond = WhereCondition(model._meta.pk_field.query_name, WhereCondition.EQ, self.pk)
         delete_query = DeleteQuery(table_name=model._meta.table_name, where=pk_cond)
 
-        raw_sql = delete_query.render_sql(model._meta.db.spec)
-        with model._meta.db.cursor() as curr:
+        raw_sql = delete_query.render_sql(db.spec)
+        with db.cursor() as curr:
             curr.execute(raw_sql, pk_cond.values())
 
         setattr(self, model._meta.pk_field.name, None)
         return curr.rowcount
 
+    def _get_db(self, using=None):
+        if using is not None and not isinstance(using, str):
+            return using
+        meta = self.__class__._meta
+        if using is None and meta.is_sharded:
+            using = meta.get_instance_shard(self)
+        return meta.get_db(using)
+
 
 class ModelSetupError(Exception):
     pass
 
 
-class ModelOptions:
+def _instance_dict_setter(attr_name):
+    def set_attr(instance, value):
+        instance.__dict__[attr_name] = value
+    return set_attr
+
 
-    def __init__(self, model_name, db, table_name, fields):
+class ModelOptions:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    PARTITION_METHODS = ('RANGE', 'LIST', 'HASH')
+
+    def __init__(self, model_name, db, table_name, fields, compact=False, shard_key=None, partition_by=None):
+        # pylint: disable=too-many-arguments
         self._model_name = model_name
         self._db = db
         self._table_name = table_name
         self._fields = fields
+        self._compact = compact
+        self._shard_key = shard_key
+        self._partition_by = partition_by  # pair of partitioning method and name of partition key field
+        self._reverse_relations = OrderedDict()
+        self._attr_setters = None
+        self._search_fields = []
 
     @property
     def db(self):
         return self._db
 
+    @property
+    def is_sharded(self):
+        return isinstance(self._db, ShardedConnector)
+
+    @property
+    def dbs(self):
+        """All connectors, that keep rows of the model."""
+        return list(self._db.shards.values()) if self.is_sharded else [self._db]
+
+    @property
+    def shard_key(self):
+        return self._shard_key
+
+    @property
+    def partition_method(self):
+        return self._partition_by[0].upper() if self._partition_by else None
+
+    @property
+    def partition_key(self):
+        """Field, which value defines partition of a row of partitioned table, or None for a regular table."""
+        return self.get_field(self._partition_by[1]) if self._partition_by else None
+
     @property
     def table_name(self):
         return self._table_name
@@ -179,6 +396,38 @@ class ModelOptions:
     def fields(self):
         return list(self._fields)
 
+    @property
+    def compact(self):
+        return self._compact
+
+    @property
+    def search_fields(self):
+        """Fields, which text makes up a document of the row for full-text search."""
+        return list(self._search_fields)
+
+    def set_search_fields(self, fields):
+        self._search_fields = list(fields)
+
+    @property
+    def attr_setters(self):
+        """Functions that set a raw value of each field to an instance, used to hydrate instances from db rows."""
+        if self._attr_setters is None:
+            model = self.pk_field.model
+            attr_names = [field.raw_fk_attr if isinstance(field, ForeignKey) else field.name for field in self._fields]
+            if self._compact:
+                self._attr_setters = tuple(getattr(model, attr_name).__set__ for attr_name in attr_names)
+            else:
+                self._attr_setters = tuple(_instance_dict_setter(attr_name) for attr_name in attr_names)
+        return self._attr_setters
+
+    @property
+    def reverse_relations(self):
+        return OrderedDict(self._reverse_relations)
+
+    @property
+    def version_field(self):
+        return next((field for field in self._fields if isinstance(field, VersionField)), None)
+
     @property
     def pk_field(self):
         return next((field for field in self.fields if field.is_pk))
@@ -211,3 +460,31 @@ class ModelOptions:
                 return field
 
         raise ValueError(f'{field_name} is not a valid foreign relation for model {self._model_name}.')
+
+    def get_db(self, shard=None):
+        """Return connector of the shard for sharded model, or the only connector of regular one."""
+        if not self.is_sharded:
+            return self._db
+        if shard is None:
+            raise ValueError(f'Shard of model {self._model_name} should be specified by `using` or shard key lookup.')
+        return self._db.get_shard(shard)
+
+    def get_shard_name(self, key_value):
+        return self._db.get_shard_name(key_value)
+
+    def get_instance_shard(self, instance):
+        if not self._shard_key:
+            raise ValueError(f'Model {self._model_name} has no shard key, shard should be specified by `using`.')
+
+        field = self.get_field(self._shard_key)
+        key_attr = field.raw_fk_attr if isinstance(field, ForeignKey) else field.name
+        return self.get_shard_name(getattr(instance, key_attr))
+
+    def add_reverse_relation(self, reverse_relation):
+        self._reverse_relations[reverse_relation.name] = reverse_relation
+
+    def get_reverse_relation(self, name):
+        try:
+            return self._reverse_relations[name]
+        except KeyError:
+            raise ValueError(f'{name} is not a valid reverse relation for model {self._model_name}.') from None
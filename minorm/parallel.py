@@ -0,0 +1,149 @@
+from concurrent.futures import CancelledError, FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+import time
+
+from minorm.connectors import ConnectionPool
+from minorm.exceptions import QueryTimeout
+from minorm.managers import QuerySet
+
+
+class ParallelExecutor:
+    """
+    Evaluates independent querysets concurrently, in a pool of threads.
+
+    Each query is run on its own connection, taken from a pool of connections of the queryset db,
+    so databases should allow several connections (see `SQLiteSpec.shared_between_threads` for in-memory db).
+    """
+
+    DEFAULT_MAX_WORKERS = 8
+    POLL_INTERVAL = 0.05  # seconds between checks of queries, that are waiting for a free thread or being cancelled
+
+    def __init__(self, max_workers=None):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or self.DEFAULT_MAX_WORKERS, thread_name_prefix='minorm-parallel',
+        )
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def gather(self, *querysets, timeout=None):
+        """
+        Evaluate querysets (or raw querysets) and return list of their results (lists of rows), in order of querysets.
+
+        If a query runs longer than `timeout` seconds, or fails, all unfinished queries are cancelled,
+        and `QueryTimeout` (or the error of the query) is raised.
+        """
+        tasks = [_QueryTask(queryset, self._get_pool(queryset)) for queryset in querysets]
+        futures = [self._executor.submit(task.run) for task in tasks]
+        try:
+            self._wait(tasks, futures, timeout)
+            return [future.result() for future in futures]
+        finally:
+            self._cancel(tasks, futures)
+
+    def close(self):
+        self._executor.shutdown()
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools = {}
+
+    def _get_pool(self, queryset):
+        # pylint: disable=protected-access
+        if isinstance(queryset, QuerySet) and queryset._is_fan_out:
+            return None  # sharded db runs queries of the queryset in its own threads
+
+        db = queryset.db
+        pool_key = (db.spec, db.statement_timeout)
+        with self._lock:
+            if pool_key not in self._pools:
+                self._pools[pool_key] = ConnectionPool(db.spec, statement_timeout=db.statement_timeout)
+            return self._pools[pool_key]
+
+    def _wait(self, tasks, futures, timeout):
+        pending = set(futures)
+        while pending:
+            wait_timeout = None
+            if timeout is not None:
+                now = time.monotonic()
+                deadlines = [task.started_at + timeout for task, future in zip(tasks, futures)
+                             if task.started_at is not None and not future.done()]
+                if any(deadline <= now for deadline in deadlines):
+                    raise QueryTimeout(f'Query was not finished in {timeout} seconds.')
+                wait_timeout = min([deadline - now for deadline in deadlines] + [self.POLL_INTERVAL])
+
+            done, pending = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()  # fail fast, if any query raised an error
+
+    def _cancel(self, tasks, futures):
+        for task, future in zip(tasks, futures):
+            if not future.cancel():
+                task.cancel()
+
+        # running queries are waited, so their connections are returned to pools:
+        for task, future in zip(tasks, futures):
+            while not future.done():
+                task.interrupt()
+                wait([future], timeout=self.POLL_INTERVAL)
+
+
+class _QueryTask:
+
+    def __init__(self, queryset, pool):
+        self.queryset = queryset
+        self.pool = pool
+        self.started_at = None
+
+        self._db = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self):
+        self.started_at = time.monotonic()
+        if self.pool is None:
+            return list(self.queryset)
+
+        db = self.pool.acquire()
+        with self._lock:
+            self._db = db
+        try:
+            if self._cancelled.is_set():
+                raise CancelledError
+            return list(self.queryset.using(db))
+        finally:
+            with self._lock:
+                self._db = None
+            self.pool.release(db)
+
+    def cancel(self):
+        self._cancelled.set()
+        self.interrupt()
+
+    def interrupt(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.spec.interrupt(self._db.connection)
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def gather(*querysets, timeout=None):
+    """Evaluate querysets concurrently by the default executor, return list of their results in order."""
+    global _default_executor  # pylint: disable=global-statement
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ParallelExecutor()
+        executor = _default_executor
+
+    return executor.gather(*querysets, timeout=timeout)
+
+
+def shutdown():
+    """Stop threads and close pooled connections of the default executor."""
+    global _default_executor  # pylint: disable=global-statement
+    with _default_executor_lock:
+        if _default_executor is not None:
+            _default_executor.close()
+            _default_executor = None
@@ -11,11 +11,16 @@ class DDLQuery:
 
 
 class CreateTableQuery(DDLQuery):
-    TEMPLATE = 'CREATE TABLE {table} ({fields});'
+    TEMPLATE = 'CREATE TABLE {table} ({fields}){partition};'
+
+    def __init__(self, table_name, params=(), partition_by=None):
+        super().__init__(table_name, params=params)
+        self.partition_by = partition_by  # partitioning method and key, e.g. 'RANGE (created)'
 
     def render_sql(self):
         field_part = ', '.join(self.params)
-        return self.TEMPLATE.format(table=self.table_name, fields=field_part)
+        partition_part = f' PARTITION BY {self.partition_by}' if self.partition_by else ''
+        return self.TEMPLATE.format(table=self.table_name, fields=field_part, partition=partition_part)
 
 
 class DropTableQuery(DDLQuery):
@@ -25,11 +30,106 @@ class DropTableQuery(DDLQuery):
         return self.TEMPLATE.format(table=self.table_name)
 
 
+class AddColumnQuery(DDLQuery):
+    TEMPLATE = 'ALTER TABLE {table} ADD COLUMN {column};'
+
+    def __init__(self, table_name, column):
+        super().__init__(table_name, params=(column,))
+
+    def render_sql(self):
+        return self.TEMPLATE.format(table=self.table_name, column=self.params[0])
+
+
+class DropColumnQuery(AddColumnQuery):
+    TEMPLATE = 'ALTER TABLE {table} DROP COLUMN {column};'
+
+
+class AlterColumnNullQuery(DDLQuery):
+    TEMPLATE = 'ALTER TABLE {table} ALTER COLUMN {column} {action} NOT NULL;'
+
+    def __init__(self, table_name, column, null):
+        super().__init__(table_name, params=(column,))
+        self.null = null
+
+    def render_sql(self):
+        action = 'DROP' if self.null else 'SET'
+        return self.TEMPLATE.format(table=self.table_name, column=self.params[0], action=action)
+
+
+class CreateIndexQuery(DDLQuery):
+
+    def __init__(self, table_name, index_name, columns, unique=False, concurrently=False):
+        # pylint: disable=too-many-arguments
+        super().__init__(table_name, params=tuple(columns))
+        self.index_name = index_name
+        self.unique = unique
+        self.concurrently = concurrently  # build index without locking writes, can't be run in transaction
+
+    def render_sql(self):
+        unique_part = 'UNIQUE ' if self.unique else ''
+        concurrently_part = 'CONCURRENTLY ' if self.concurrently else ''
+        columns_part = ', '.join(self.params)
+        return f'CREATE {unique_part}INDEX {concurrently_part}{self.index_name} ON {self.table_name} ({columns_part});'
+
+
+class DropIndexQuery(DDLQuery):
+
+    def __init__(self, table_name, index_name, concurrently=False):
+        super().__init__(table_name)
+        self.index_name = index_name
+        self.concurrently = concurrently
+
+    def render_sql(self):
+        concurrently_part = 'CONCURRENTLY ' if self.concurrently else ''
+        return f'DROP INDEX {concurrently_part}{self.index_name};'
+
+
+class CreatePartitionQuery(DDLQuery):
+
+    def __init__(self, table_name, partition_name, bounds):
+        super().__init__(table_name)
+        self.partition_name = partition_name
+        self.bounds = bounds  # rendered bounds of partition rows, e.g. "FOR VALUES IN ('a', 'b')" or 'DEFAULT'
+
+    def render_sql(self):
+        return f'CREATE TABLE {self.partition_name} PARTITION OF {self.table_name} {self.bounds};'
+
+
+class AttachPartitionQuery(CreatePartitionQuery):
+
+    def render_sql(self):
+        return f'ALTER TABLE {self.table_name} ATTACH PARTITION {self.partition_name} {self.bounds};'
+
+
+class DetachPartitionQuery(DDLQuery):
+
+    def __init__(self, table_name, partition_name, concurrently=False):
+        super().__init__(table_name)
+        self.partition_name = partition_name
+        self.concurrently = concurrently  # detach without locking queries of the table, can't be run in transaction
+
+    def render_sql(self):
+        concurrently_part = ' CONCURRENTLY' if self.concurrently else ''
+        return f'ALTER TABLE {self.table_name} DETACH PARTITION {self.partition_name}{concurrently_part};'
+
+
+class SearchIndexQuery(DDLQuery):
+    """A query of full-text search index, its sql depends on db, so it's rendered by db spec in advance."""
+
+    def __init__(self, table_name, sql):
+        super().__init__(table_name, params=(sql,))
+
+    def render_sql(self):
+        return self.params[0]
+
+
 class DMLQuery:
 
-    def __init__(self, table_name, fields=(), where=None, limit=None):
+    def __init__(self, table_name, fields=(), where=None, limit=None, returning=()):
+        # pylint: disable=too-many-arguments
         self.table_name = table_name
         self.fields = fields
+        self.returning = returning  # columns of modified rows, that should be returned
 
         self._where = where
         self._limit = limit
@@ -45,24 +145,54 @@ class DMLQuery:
     def render_sql(self, db_spec):
         raise NotImplementedError
 
+    def _render_returning(self):
+        return f"RETURNING {', '.join(self.returning)}"
+
 
 class InsertQuery(DMLQuery):
 
+    def __init__(self, table_name, fields=(), returning=(), rows_number=1):
+        super().__init__(table_name, fields=fields, returning=returning)
+        self.rows_number = rows_number  # number of rows, inserted by the query at once
+
+    def render_sql(self, db_spec):
+        if self.fields:
+            fields_part = ', '.join(self.fields)
+            value_escape = db_spec.value_escape
+            row_part = f"({', '.join(value_escape for _ in self.fields)})"
+            values_part = ', '.join(row_part for _ in range(self.rows_number))
+            insert_str = f'INSERT INTO {self.table_name} ({fields_part}) VALUES {values_part}'
+        else:
+            insert_str = f'INSERT INTO {self.table_name} DEFAULT VALUES'
+
+        if self.returning:
+            insert_str = f'{insert_str} {self._render_returning()}'
+        return f'{insert_str};'
+
+
+class CopyFromQuery(DMLQuery):
+
     def render_sql(self, db_spec):
         fields_part = ', '.join(self.fields)
+        return f'COPY {self.table_name} ({fields_part}) FROM STDIN WITH (FORMAT csv);'
 
-        value_escape = db_spec.value_escape
-        values_part = ', '.join(value_escape for _ in self.fields)
 
-        result = f'INSERT INTO {self.table_name} ({fields_part}) VALUES ({values_part});'
-        return result
+class CopyToQuery(DMLQuery):
+
+    def render_sql(self, db_spec):
+        return f'COPY {self.table_name} TO STDOUT WITH (FORMAT csv);'
 
 
 class UpdateQuery(DMLQuery):
 
+    def __init__(self, table_name, fields=(), where=None, limit=None, returning=(), expressions=None):
+        # pylint: disable=too-many-arguments
+        super().__init__(table_name, fields=fields, where=where, limit=limit, returning=returning)
+        self.expressions = expressions or {}  # resolved expressions of fields, that are computed by db
+
     def render_sql(self, db_spec):
         value_escape = db_spec.value_escape
-        fields_part = ', '.join(f'{field} = {value_escape}' for field in self.fields)
+        fields_part = ', '.join(f'{field} = {self._render_value(field, value_escape)}' for field in self.fields)
 
         update_str = f'UPDATE {self.table_name} SET {fields_part}'
         query_parts = [update_str]
@@ -72,8 +202,28 @@ class UpdateQuery(DMLQuery):
             where_part_proper_escape = where_part.format(value_escape)
             query_parts.append(where_part_proper_escape)
 
+        if self.returning:
+            query_parts.append(self._render_returning())
+
         return f"{' '.join(query_parts)};"
 
+    def get_params(self, values):
+        """Return parameters of set values, given in order of fields (values of expression fields are ignored)."""
+        params = []
+        for field, value in zip(self.fields, values):
+            expression = self.expressions.get(field)
+            if expression is None:
+                params.append(value)
+            else:
+                params.extend(expression.values())
+        return tuple(params)
+
+    def _render_value(self, field, value_escape):
+        expression = self.expressions.get(field)
+        if expression is None:
+            return value_escape
+        return str(expression).format(value_escape)
+
 
 class DeleteQuery(DMLQuery):
 
@@ -87,42 +237,57 @@ class DeleteQuery(DMLQuery):
             where_part_proper_escape = where_part.format(value_escape)
             query_parts.append(where_part_proper_escape)
 
+        if self.returning:
+            query_parts.append(self._render_returning())
+
         return f"{' '.join(query_parts)};"
 
 
 class SelectQuery(DMLQuery):
+    NO_LIMIT = 2 ** 63 - 1  # some databases (SQLite) require LIMIT when OFFSET is used
 
     def __init__(self, table_name, fields=(), where=None):
         super().__init__(table_name, fields, where)
+        self._offset = None
 
         self._joins = []
         self._order_by = None
+        self._distinct = False
+        self._lock = None
 
-    def render_sql(self, db_spec):
+    def __str__(self):
         fields_part = ', '.join(self.fields)
 
-        select_str = f'SELECT {fields_part} FROM {self.table_name}'
+        select_clause = 'SELECT DISTINCT' if self._distinct else 'SELECT'
+        select_str = f'{select_clause} {fields_part} FROM {self.table_name}'
         query_parts = [select_str]
 
         query_parts.extend(str(join) for join in self._joins)
 
         if self._where:
-            value_escape = db_spec.value_escape
-
-            where_part = f'WHERE {self._where}'
-            where_part_proper_escape = where_part.format(value_escape)
-            query_parts.append(where_part_proper_escape)
+            query_parts.append(f'WHERE {self._where}')
 
         if self._order_by:
             order_part = ', '.join(str(ordering) for ordering in self._order_by)
             order_str = f'ORDER BY {order_part}'
             query_parts.append(order_str)
 
-        if self._limit:
-            limit_str = f'LIMIT {self._limit}'
+        if self._limit is not None or self._offset:
+            limit = self.NO_LIMIT if self._limit is None else self._limit
+            limit_str = f'LIMIT {limit}'
             query_parts.append(limit_str)
 
-        return f"{' '.join(query_parts)};"
+        if self._offset:
+            offset_str = f'OFFSET {self._offset}'
+            query_parts.append(offset_str)
+
+        return ' '.join(query_parts)
+
+    def render_sql(self, db_spec):
+        select_sql = str(self)
+        if self._lock and db_spec.supports_select_for_update:
+            select_sql = f'{select_sql} {self._lock}'
+        return f'{select_sql};'.format(db_spec.value_escape)
 
     def join(self, join_expression):
         self._joins.extend(join_expression)
@@ -131,3 +296,16 @@ class SelectQuery(DMLQuery):
     def order_by(self, order_expression):
         self._order_by = order_expression
         return self
+
+    def offset(self, value):
+        self._offset = value
+        return self
+
+    def distinct(self, value=True):
+        self._distinct = value
+        return self
+
+    def lock(self, lock_expression):
+        """Set locking clause, it's rendered only for databases, that support row locks."""
+        self._lock = lock_expression
+        return self
@@ -0,0 +1,97 @@
+from minorm.fields import Field
+
+
+class RawQuerySet:
+    """
+    Rows of a raw sql query, fetched lazily as instances of the model.
+
+    Columns are mapped to fields by column names (or field names), other columns are set as extra attributes.
+    """
+
+    def __init__(self, model, raw_sql, params=(), db=None, timeout=None):
+        self.model = model
+        self.raw_sql = raw_sql
+        self.params = params
+        self.db = db or model._meta.db
+        self._timeout = timeout  # max duration of the query in seconds, by default `statement_timeout` of connector
+
+        self._result_cache = None
+
+    def using(self, db):
+        """Perform the query on the given connector."""
+        return self.__class__(model=self.model, raw_sql=self.raw_sql, params=self.params, db=db, timeout=self._timeout)
+
+    def iterator(self):
+        """Iterate over results, streaming rows from db cursor, without caching them in the queryset."""
+        with self.db.cursor(timeout=self._timeout) as curr:
+            curr.execute(self.raw_sql, self.params)
+            instance_from_row = self._get_instance_builder([column[0] for column in curr.description])
+            for row in curr:
+                yield instance_from_row(row)
+
+    def __iter__(self):
+        self._fetch_results()
+        return iter(self._result_cache)
+
+    def __len__(self):
+        self._fetch_results()
+        return len(self._result_cache)
+
+    def __getitem__(self, item):
+        self._fetch_results()
+        return self._result_cache[item]
+
+    def _fetch_results(self):
+        if self._result_cache is None:
+            self._result_cache = list(self.iterator())
+
+    def _get_instance_builder(self, column_names):
+        value_positions, annotations, row_fields = self._map_columns(column_names)
+        if annotations and self.model._meta.compact:
+            annotation_names = ', '.join(name for __, name in annotations)
+            raise ValueError(
+                f'Compact model {self.model.__name__} could not keep extra attributes: {annotation_names}.'
+            )
+
+        convert_row = self.db.spec.get_row_converter(row_fields)
+        fields_number = len(self.model._meta.fields)
+
+        def instance_from_row(row):
+            if convert_row:
+                row = convert_row(row)
+
+            values = [None] * fields_number
+            for row_index, field_index in value_positions:
+                values[field_index] = row[row_index]
+            instance = self.model.hydrate(values)
+
+            for row_index, attr_name in annotations:
+                setattr(instance, attr_name, row[row_index])
+            return instance
+
+        return instance_from_row
+
+    def _map_columns(self, column_names):
+        """
+        Map columns of the result to model fields by column names (or field names).
+
+        Return pairs of row index and model field index, pairs of row index and attribute name of other columns,
+        and fields of all columns.
+        """
+        model_fields = self.model._meta.fields
+        fields_by_name = {field.name: field for field in model_fields}
+        fields_by_name.update((field.column_name, field) for field in model_fields)
+        field_positions = {field.name: index for index, field in enumerate(model_fields)}
+
+        value_positions = []
+        annotations = []
+        row_fields = []
+        for row_index, column_name in enumerate(column_names):
+            field = fields_by_name.get(column_name)
+            if field:
+                value_positions.append((row_index, field_positions[field.name]))
+                row_fields.append(field)
+            else:
+                annotations.append((row_index, column_name))
+                row_fields.append(Field())  # values of annotations are not converted
+        return value_positions, annotations, row_fields
@@ -0,0 +1,265 @@
+from collections import OrderedDict
+
+from minorm.expressions import JoinExpression, LOOKUP_SEPARATOR
+
+
+class RelationNode:  # pylint: disable=too-many-instance-attributes
+    """A helper class for constructing nested foreign relations."""
+
+    def __init__(self, base_model, depth=0, position=0, fk_field=None, is_reverse=False):
+        # pylint: disable=too-many-arguments
+        self.model = base_model
+
+        self.depth = depth
+        self.position = position
+
+        self.fk_field = fk_field  # foreign key that links the relation with the parent node
+        self.is_reverse = is_reverse  # should be True when the foreign key is declared on the relation model
+
+        self.is_selected = False  # should be True when the relation is marked in `select_related` method
+        self.only_fields = None  # names of loaded fields, all fields are loaded if not set
+        self.is_filtered = False  # should be True when columns of the relation are used by where conditions
+        self.is_required = False  # should be True when rows without the related row are filtered out
+
+        self.alias = None  # alias of the root table, e.g. when it's nested into a query of the same table
+
+        self.relations = OrderedDict()
+
+    def resolve_relation(self, lookup_parts, is_selected=False):
+        field_name, *rest_lookup_parts = lookup_parts
+        if field_name not in self.relations:
+            self.relations[field_name] = self._create_relation(field_name)
+
+        if is_selected:
+            if self.relations[field_name].is_reverse:
+                raise ValueError(f'Reverse relation {field_name} could not be selected, use prefetch instead.')
+            self.relations[field_name].is_selected = True
+
+        if rest_lookup_parts:
+            return self.relations[field_name].resolve_relation(rest_lookup_parts, is_selected=is_selected)
+        return self.relations[field_name]
+
+    def _create_relation(self, field_name):
+        position = len(self.relations) + 1
+        meta = self.model._meta
+        if field_name in meta.reverse_relations:
+            fk_field = meta.get_reverse_relation(field_name).fk_field
+            return RelationNode(
+                base_model=fk_field.model, depth=self.depth + 1, position=position, fk_field=fk_field, is_reverse=True,
+            )
+
+        fk_field = meta.get_fk_field(field_name)
+        return RelationNode(base_model=fk_field.to, depth=self.depth + 1, position=position, fk_field=fk_field)
+
+    def is_used(self, used_nodes=()):
+        """Whether the relation should be joined: it's filtered, listed in `used_nodes`, or some its relation is."""
+        return (self.is_filtered or self in used_nodes
+                or any(rel.is_used(used_nodes) for rel in self.relations.values()))
+
+    @property
+    def has_required_relations(self):
+        return self.is_required or any(rel.has_required_relations for rel in self.relations.values())
+
+    def reset_required(self):
+        self.is_required = False
+        for rel in self.relations.values():
+            rel.reset_required()
+
+    def unselect(self):
+        self.is_selected = False
+        self.only_fields = None
+        for rel in self.relations.values():
+            rel.unselect()
+
+    @property
+    def is_root_node(self):
+        return self.depth == self.position == 0
+
+    @property
+    def table_shortcut(self):
+        if self.is_root_node:
+            return self.alias or self.model._meta.table_name
+
+        return f'T{self.depth}{self.position}'
+
+    @property
+    def table_name(self):
+        if self.is_root_node and not self.alias:
+            return self.model._meta.table_name
+
+        return f'{self.model._meta.table_name} {self.table_shortcut}'
+
+    def get_selected_nodes(self):
+        """
+        Return the node and its selected relations, in order of their columns in select query, as tuples of
+        a node, an index of its parent node in the list (None for the node itself) and a name of the linking field.
+        """
+        nodes = []
+        stack = [(self, None, None)]
+        while stack:
+            node, parent_index, fk_name = stack.pop()
+            nodes.append((node, parent_index, fk_name))
+            index = len(nodes) - 1
+            selected = [(rel, index, name) for name, rel in node.relations.items() if rel.is_selected]
+            stack.extend(reversed(selected))
+        return nodes
+
+    def set_only(self, field_name):
+        """Mark a field of the node model as loaded, other non-pk fields are not selected, if any field is marked."""
+        self.model._meta.get_field(field_name)
+        if self.only_fields is None:
+            self.only_fields = set()
+        self.only_fields.add(field_name)
+
+    def is_loaded(self, field):
+        return self.only_fields is None or field.is_pk or field.name in self.only_fields
+
+    @property
+    def loaded_fields(self):
+        return [field for field in self.model._meta.fields if self.is_loaded(field)]
+
+    def get_attr_setters(self):
+        """Return setters of the loaded fields and setters of the fields, that are not loaded, in order of fields."""
+        meta = self.model._meta
+        loaded_setters, unloaded_setters = [], []
+        for attr_setter, field in zip(meta.attr_setters, meta.fields):
+            (loaded_setters if self.is_loaded(field) else unloaded_setters).append(attr_setter)
+        return loaded_setters, unloaded_setters
+
+    def get_fields(self):
+        return [field for node, __, __ in self.get_selected_nodes() for field in node.loaded_fields]
+
+    def get_column_names(self):
+        return [
+            f'{node.table_shortcut}.{field.column_name}'
+            for node, __, __ in self.get_selected_nodes() for field in node.loaded_fields
+        ]
+
+    def get_field_names(self, prefix=''):
+        field_names = []
+        prefixes = []
+        for node, parent_index, fk_name in self.get_selected_nodes():
+            node_prefix = prefix if parent_index is None else f'{prefixes[parent_index]}{fk_name}{LOOKUP_SEPARATOR}'
+            prefixes.append(node_prefix)
+            field_names.extend(f'{node_prefix}{field.name}' for field in node.loaded_fields)
+        return field_names
+
+    def get_joins(self, used_nodes=(), is_inner=True):
+        """
+        Return joins of relations, that are filtered or listed in `used_nodes`, other relations are not joined.
+
+        INNER JOIN is used when every row of the node has a related row: when rows without it are filtered out,
+        or when the relation is linked by non-null foreign key to the root or to an inner joined node.
+        """
+        joins = []
+        for rel in self.relations.values():
+            if not rel.is_used(used_nodes):
+                continue
+
+            fk = rel.fk_field
+            if rel.is_reverse:
+                fk_column = f'{rel.table_shortcut}.{fk.column_name}'
+                pk_column = f'{self.table_shortcut}.{self.model._meta.pk_field.column_name}'
+            else:
+                fk_column = f'{self.table_shortcut}.{fk.column_name}'
+                pk_column = f'{rel.table_shortcut}.{fk.to._meta.pk_field.column_name}'
+
+            is_inner_rel = rel.has_required_relations or (is_inner and not rel.is_reverse and not fk.is_null)
+            join_type = JoinExpression.INNER if is_inner_rel else JoinExpression.LEFT_OUTER
+            joins.append(JoinExpression.on_pk(
+                outer_table=rel.table_name, fk_field=fk_column, pk_field=pk_column, join_type=join_type,
+            ))
+            joins.extend(rel.get_joins(used_nodes, is_inner=is_inner_rel))
+
+        return joins
+
+    def get_row_reader(self, is_namedtuple=False):
+        """
+        Return a function, that builds an instance of the model (with instances of selected relations) from a row.
+
+        Slices of the row, that belong to each selected node, are computed once, so rows are read without recursion.
+        Fields, that are not loaded because of `only` option, are set to None.
+        """
+        steps = []
+        start = 0
+        for node, parent_index, fk_name in self.get_selected_nodes():
+            meta = node.model._meta
+            loaded_fields = node.loaded_fields
+            row_slice = slice(start, start + len(loaded_fields))
+            pk_position = start + loaded_fields.index(meta.pk_field)
+            if is_namedtuple:
+                step_data = ([field.name for field in meta.fields], [field.name for field in loaded_fields])
+            else:
+                step_data = node.get_attr_setters()
+            steps.append((node.model, row_slice, pk_position, step_data, parent_index, fk_name, node.fk_field))
+            start = row_slice.stop
+
+        return self._read_namedtuple_row(steps) if is_namedtuple else self._read_instance_row(steps)
+
+    @staticmethod
+    def _read_instance_row(steps):
+
+        def read_row(row):
+            instances = []
+            for model, row_slice, pk_position, setters, parent_index, fk_name, fk_field in steps:
+                if parent_index is not None:
+                    parent = instances[parent_index]
+                    if parent is None or row[pk_position] is None:
+                        if parent is not None:
+                            setattr(parent, fk_field.cached_instance_attr, None)  # related row is missing
+                        instances.append(None)
+                        continue
+
+                attr_setters, unloaded_setters = setters
+                instance = model.__new__(model)
+                for attr_setter, value in zip(attr_setters, row[row_slice]):
+                    attr_setter(instance, value)
+                for attr_setter in unloaded_setters:
+                    attr_setter(instance, None)
+                if parent_index is not None:
+                    setattr(parent, fk_name, instance)
+                instances.append(instance)
+            return instances[0]
+
+        return read_row
+
+    @staticmethod
+    def _read_namedtuple_row(steps):
+
+        def read_row(row):
+            # nested tuples are immutable, so relations are built before their parents:
+            related_values = [{} for __ in steps]
+            result = None
+            for index in range(len(steps) - 1, -1, -1):
+                model, row_slice, pk_position, (field_names, loaded_names), parent_index, fk_name, __ = steps[index]
+                if parent_index is not None and row[pk_position] is None:
+                    related_values[parent_index][fk_name] = None
+                    continue
+
+                kwargs = dict.fromkeys(field_names)
+                kwargs.update(zip(loaded_names, row[row_slice]))
+                kwargs.update(related_values[index])
+                result = model.query_namedtuple(**kwargs)
+                if parent_index is not None:
+                    related_values[parent_index][fk_name] = result
+            return result
+
+        return read_row
+
+    def clone(self):
+        new_instance = self.__class__(
+            base_model=self.model,
+            depth=self.depth,
+            position=self.position,
+            fk_field=self.fk_field,
+            is_reverse=self.is_reverse,
+        )
+        new_instance.is_selected = self.is_selected
+        new_instance.only_fields = set(self.only_fields) if self.only_fields is not None else None
+        new_instance.is_filtered = self.is_filtered
+        new_instance.is_required = self.is_required
+        new_instance.alias = self.alias
+        new_instance.relations = OrderedDict((
+            (field, relation.clone()) for field, relation in self.relations.items()
+        ))
+        return new_instance
@@ -0,0 +1,284 @@
+from collections import namedtuple
+
+from minorm.fields import render_sql_literal
+from minorm.queries import (
+    AddColumnQuery,
+    AlterColumnNullQuery,
+    AttachPartitionQuery,
+    CreateIndexQuery,
+    CreatePartitionQuery,
+    CreateTableQuery,
+    DetachPartitionQuery,
+    DropColumnQuery,
+    DropIndexQuery,
+    DropTableQuery,
+    SearchIndexQuery,
+)
+
+
+ColumnInfo = namedtuple('ColumnInfo', 'name, sql_type, null, pk')
+IndexInfo = namedtuple('IndexInfo', 'name, columns, unique')
+
+INDEX_SUFFIX = 'idx'
+UNIQUE_INDEX_SUFFIX = 'uniq'
+
+
+class SchemaError(Exception):
+    pass
+
+
+def get_table_columns(table_name, db):
+    return db.spec.get_table_columns(db.connection, table_name)
+
+
+def get_table_indexes(table_name, db):
+    return db.spec.get_table_indexes(db.connection, table_name)
+
+
+def get_index_name(table_name, columns, unique=False):
+    suffix = UNIQUE_INDEX_SUFFIX if unique else INDEX_SUFFIX
+    return f"{table_name}_{'_'.join(columns)}_{suffix}"
+
+
+def create_table_query(model, db):
+    """
+    Return query that creates table of the model. Table of model with `partition_by` is created as partitioned,
+    if db supports it, otherwise as a regular one.
+    """
+    meta = model._meta
+    partition_key = meta.partition_key
+    if not partition_key or not db.spec.supports_partitioning:
+        return CreateTableQuery(table_name=meta.table_name, params=[field.render_sql() for field in meta.fields])
+
+    field_params = []
+    for field in meta.fields:
+        if field.is_pk and field is not partition_key:
+            # unique constraints of partitioned table should include partition key:
+            constrains = [constrain for constrain in field.get_field_constrains() if constrain != 'PRIMARY KEY']
+            field_params.append(' '.join([field.column_name, field.render_sql_type(), *constrains]))
+            field_params.append(f'PRIMARY KEY ({field.column_name}, {partition_key.column_name})')
+        else:
+            field_params.append(field.render_sql())
+    return CreateTableQuery(
+        table_name=meta.table_name, params=field_params,
+        partition_by=f'{meta.partition_method} ({partition_key.column_name})',
+    )
+
+
+def create_index_queries(model, concurrently=False):
+    """Return queries that create indexes of the model fields, declared with `index` option."""
+    table_name = model._meta.table_name
+    return [
+        CreateIndexQuery(table_name, index.name, index.columns, unique=index.unique, concurrently=concurrently)
+        for index in _get_model_indexes(model) if not index.unique
+    ]
+
+
+def create_search_index_queries(model, db):
+    """Return queries that create full-text search index of the model `search_fields`, in the way of the db kind."""
+    meta = model._meta
+    if not meta.search_fields:
+        return []
+
+    columns = [field.column_name for field in meta.search_fields]
+    return [
+        SearchIndexQuery(meta.table_name, sql)
+        for sql in db.spec.get_search_index_queries(meta.table_name, meta.pk_field.column_name, columns)
+    ]
+
+
+def diff(model, drop=False, db=None):
+    """
+    Compare the model with its table in db and return DDL queries, that make the table match the model.
+
+    Missing columns are added, nullability is changed if db allows it, indexes of unique and indexed fields are
+    created (concurrently, if db supports it), as well as full-text search index of `search_fields`.
+    Columns and indexes, that don't belong to the model, are dropped only if `drop` is set;
+    only indexes that are named by this module could be dropped.
+    Column types are not compared. Pass `db` to compare the table of a particular shard.
+    """
+    meta = model._meta
+    db = db or meta.get_db()
+    table_name = meta.table_name
+
+    columns = get_table_columns(table_name, db)
+    if not columns:
+        return [
+            create_table_query(model, db),
+            *create_index_queries(model),
+            *create_search_index_queries(model, db),
+        ]
+
+    queries = _get_column_queries(model, columns, db)
+
+    # PostgreSQL doesn't build indexes of partitioned tables concurrently:
+    concurrently = db.spec.supports_concurrent_index and not meta.partition_key
+    indexes = get_table_indexes(table_name, db)
+    model_indexes = _get_model_indexes(model)
+    if drop:
+        model_index_names = {index.name for index in model_indexes}
+        queries.extend(
+            DropIndexQuery(table_name, index.name, concurrently=concurrently) for index in indexes
+            if index.name not in model_index_names and _is_managed_index(table_name, index)
+        )
+        kept_columns = meta.column_names + list(db.spec.get_search_columns() if meta.search_fields else ())
+        queries.extend(
+            DropColumnQuery(table_name, column.name) for column in columns if column.name not in kept_columns
+        )
+
+    for model_index in model_indexes:
+        # unique index is enough for lookups, so it satisfies a regular one:
+        if not any(index.columns == model_index.columns and (index.unique or not model_index.unique)
+                   for index in indexes):
+            queries.append(CreateIndexQuery(
+                table_name, model_index.name, model_index.columns, unique=model_index.unique, concurrently=concurrently,
+            ))
+
+    if meta.search_fields and not db.spec.has_search_index(db.connection, table_name):
+        queries.extend(create_search_index_queries(model, db))
+
+    return queries
+
+
+def migrate(*models, drop=False):
+    """Apply differences between models and their tables to db (to every shard), return list of performed queries."""
+    performed_queries = []
+    for model in models:
+        for db in model._meta.dbs:
+            queries = diff(model, drop=drop, db=db)
+            if db.in_atomic_block and any(getattr(query, 'concurrently', False) for query in queries):
+                raise SchemaError(f'Table {model._meta.table_name} indexes could not be changed concurrently '
+                                  f'inside a transaction.')
+
+            with db.cursor() as curr:
+                for query in queries:
+                    curr.execute(query.render_sql())
+            performed_queries.extend(queries)
+
+    return performed_queries
+
+
+def create_partition(model, name, start=None, end=None, values=None, modulus=None, remainder=None, default=False):
+    """
+    Create a partition table `name` of partitioned model (on every shard), return performed query.
+
+    Bounds of partition rows depend on partitioning method: `start` (inclusive) and `end` (exclusive) values of
+    range, None means unbounded; `values` of list; `modulus` and `remainder` of hash. `default` partition keeps rows,
+    that don't fit other partitions.
+    """
+    # pylint: disable=too-many-arguments
+    bounds = _render_partition_bounds(model, start, end, values, modulus, remainder, default)
+    return _execute_partition_query(model, CreatePartitionQuery(model._meta.table_name, name, bounds))
+
+
+def attach_partition(model, name, start=None, end=None, values=None, modulus=None, remainder=None, default=False):
+    """Attach existing table `name` as a partition of the model table, with bounds as of `create_partition`."""
+    # pylint: disable=too-many-arguments
+    bounds = _render_partition_bounds(model, start, end, values, modulus, remainder, default)
+    return _execute_partition_query(model, AttachPartitionQuery(model._meta.table_name, name, bounds))
+
+
+def detach_partition(model, name, concurrently=False):
+    """
+    Detach partition `name`, so it becomes a regular table (e.g. to be archived).
+    Partition is detached `concurrently` without blocking queries of the model table, outside of transaction only.
+    """
+    if concurrently and any(db.in_atomic_block for db in model._meta.dbs):
+        raise SchemaError(f'Partition {name} could not be detached concurrently inside a transaction.')
+    query = DetachPartitionQuery(model._meta.table_name, name, concurrently=concurrently)
+    return _execute_partition_query(model, query)
+
+
+def drop_partition(model, name):
+    """Drop partition `name` together with its rows, it's much faster than deletion of the rows."""
+    return _execute_partition_query(model, DropTableQuery(table_name=name))
+
+
+def _execute_partition_query(model, query):
+    meta = model._meta
+    if not meta.partition_key:
+        raise SchemaError(f'Table {meta.table_name} is not partitioned.')
+
+    for db in meta.dbs:
+        if not db.spec.supports_partitioning:
+            raise SchemaError(f'{db.spec.__class__.__name__} database does not support table partitioning.')
+        with db.cursor() as curr:
+            curr.execute(query.render_sql())
+    return query
+
+
+def _render_partition_bounds(model, start, end, values, modulus, remainder, default):
+    # pylint: disable=too-many-arguments
+    meta = model._meta
+    method = meta.partition_method
+    if default:
+        if method == 'HASH':
+            raise ValueError('Hash partitioned table could not have default partition.')
+        return 'DEFAULT'
+
+    def render_value(value):
+        literal = render_sql_literal(meta.partition_key.to_query_parameter(value))
+        if literal is None:
+            raise ValueError(f'Value {value} could not be a partition bound.')
+        return literal
+
+    if method == 'RANGE':
+        if start is None and end is None:
+            raise ValueError('Range partition should have start or end.')
+        start_part = 'MINVALUE' if start is None else render_value(start)
+        end_part = 'MAXVALUE' if end is None else render_value(end)
+        return f'FOR VALUES FROM ({start_part}) TO ({end_part})'
+    if method == 'LIST':
+        if not values:
+            raise ValueError('List partition should have values.')
+        values_part = ', '.join('NULL' if value is None else render_value(value) for value in values)
+        return f'FOR VALUES IN ({values_part})'
+
+    if modulus is None or remainder is None:
+        raise ValueError('Hash partition should have modulus and remainder.')
+    return f'FOR VALUES WITH (MODULUS {int(modulus)}, REMAINDER {int(remainder)})'
+
+
+def _get_column_queries(model, columns, db):
+    """Return queries, that add missing columns of the model fields and change nullability of existing ones."""
+    table_name = model._meta.table_name
+    existing_columns = {column.name: column for column in columns}
+    queries = []
+    for field in model._meta.fields:
+        column = existing_columns.get(field.column_name)
+        if column is None:
+            queries.append(AddColumnQuery(table_name, _render_added_column(field)))
+        elif not (column.pk or field.is_pk) and column.null != field.is_null:
+            if not db.spec.supports_alter_column:
+                raise SchemaError(f'Column {table_name}.{column.name} nullability could not be changed '
+                                  f'without rebuild of the table.')
+            queries.append(AlterColumnNullQuery(table_name, column.name, null=field.is_null))
+    return queries
+
+
+def _get_model_indexes(model):
+    table_name = model._meta.table_name
+    indexes = []
+    for field in model._meta.fields:
+        if field.is_pk or not (field.is_unique or field.is_indexed):
+            continue
+        columns = (field.column_name,)
+        index_name = get_index_name(table_name, columns, unique=field.is_unique)
+        indexes.append(IndexInfo(name=index_name, columns=columns, unique=field.is_unique))
+    return indexes
+
+
+def _is_managed_index(table_name, index):
+    return index.name == get_index_name(table_name, index.columns, unique=index.unique)
+
+
+def _render_added_column(field):
+    # column is added to existing rows, so unique constraint is added separately, by an index:
+    constrains = [constrain for constrain in field.get_field_constrains() if constrain != 'UNIQUE']
+    if not field.is_null and field.db_default is None:
+        default = field.render_sql_default()
+        if default is None:
+            raise SchemaError(f'Field {field.name} is not nullable and has no constant default, '
+                              f'so it could not be added to existing table.')
+        constrains.append(f'DEFAULT {default}')
+    return ' '.join([field.column_name, field.render_sql_type(), *constrains])
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+import heapq
+import itertools
+
+from minorm.expressions import Expression, OrderByExpression
+
+
+class ShardedQuerySetMixin:  # pylint: disable=too-few-public-methods
+    """Routing of queryset queries to shards of sharded db, and merging of rows, selected from every shard."""
+    # pylint: disable=protected-access
+
+    @staticmethod
+    def _combine_shard_results(results, returning):
+        if returning is None:
+            return sum(results)
+        return list(itertools.chain.from_iterable(results))
+
+    @property
+    def _shard_name(self):
+        return self._shard if self._shard is not None else self._key_shard
+
+    @property
+    def _is_fan_out(self):
+        """Whether queries should be performed on every shard, since rows of the queryset could be kept by any."""
+        return self.model._meta.is_sharded and self._db is None and self._shard_name is None
+
+    @property
+    def _shard_names(self):
+        return list(self.model._meta.db.shards)
+
+    def _get_key_shard(self, lookups):
+        meta = self.model._meta
+        if not meta.is_sharded or not meta.shard_key:
+            return None
+
+        lookups = self._check_pk_lookups(lookups)
+        if meta.shard_key not in lookups or isinstance(lookups[meta.shard_key], Expression):
+            return None
+
+        key_value = meta.get_field(meta.shard_key).to_query_parameter(lookups[meta.shard_key])
+        return meta.get_shard_name(key_value)
+
+    def _group_by_shard(self, instances):
+        """Return instances, grouped by names of shards, that keep their rows."""
+        meta = self.model._meta
+        shard_instances = OrderedDict()
+        for instance in instances:
+            shard_instances.setdefault(meta.get_instance_shard(instance), []).append(instance)
+        return shard_instances
+
+    def _iter_shards_rows(self):
+        """Select rows from all shards in parallel and merge them, keeping ordering, offset and limit of the query."""
+        shard_qs = self._get_shard_queryset()
+        sharded_db = self.model._meta.db
+        return self._merge_shards_rows(sharded_db.map(lambda shard: list(shard_qs.using(shard)._iter_rows())))
+
+    def _iter_shards_raw_rows(self, chunk_size):
+        """Stream rows from all shards, by chunks of `chunk_size` rows of each shard, and merge them."""
+        shard_qs = self._get_shard_queryset()
+        return self._merge_shards_rows([
+            itertools.chain.from_iterable(shard_qs.using(shard)._iter_raw_chunks(chunk_size))
+            for shard in self._shard_names
+        ])
+
+    def _get_shard_queryset(self):
+        shard_qs = self._clone()
+        shard_qs._offset = None
+        if self._limit is not None:
+            shard_qs._limit = (self._offset or 0) + self._limit  # all rows of the page could be kept by one shard
+        return shard_qs
+
+    def _merge_shards_rows(self, shards_rows):
+        """Merge rows of shards, keeping ordering, offset and limit of the query."""
+        if self._get_ordering():
+            rows = heapq.merge(*shards_rows, key=self._get_row_order_key())
+        else:
+            rows = itertools.chain.from_iterable(shards_rows)
+
+        stop = (self._offset or 0) + self._limit if self._limit is not None else None
+        return itertools.islice(rows, self._offset or 0, stop)
+
+    def _get_row_order_key(self):
+        column_names = self._get_column_names()
+        if self._rank:
+            column_names.append(self._rank[0])  # rank is the last selected column
+        ordering = self._get_ordering()
+        positions = []
+        for order_by_exp in ordering:
+            if order_by_exp.value not in column_names:
+                raise ValueError(f'Ordering column {order_by_exp.value} should be selected to merge rows of shards.')
+            positions.append(column_names.index(order_by_exp.value))
+        descending = [order_by_exp.ordering == OrderByExpression.DESC for order_by_exp in ordering]
+
+        def row_order_key(row):
+            return RowOrderKey([row[position] for position in positions], descending)
+
+        return row_order_key
+
+
+class RowOrderKey:
+    """Sorting key of a row, that compares values in the given directions, null values go first in ascending order."""
+
+    __slots__ = ('values', 'descending')
+
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+    def __lt__(self, other):
+        for value, other_value, is_descending in zip(self.values, other.values, self.descending):
+            if value == other_value:
+                continue
+            if value is None or other_value is None:
+                is_less = value is None
+            else:
+                is_less = value < other_value
+            return is_less != is_descending
+        return False
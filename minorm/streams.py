@@ -0,0 +1,143 @@
+import json
+
+from minorm.fields import AutoField, BooleanField, DateField, DateTimeField, DecimalField, ForeignKey, IntegerField
+
+
+def encode_csv_value(value):
+    """
+    Encode a value to CSV format, that is understood by PostgreSQL COPY command.
+
+    Strings are always quoted, so unquoted empty value stands for NULL and differs from an empty string.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        escaped_value = value.replace('"', '""')
+        return f'"{escaped_value}"'
+    return str(value)
+
+
+def encode_csv_row(row):
+    return ','.join(encode_csv_value(value) for value in row) + '\n'
+
+
+def get_csv_encoder(field):
+    """
+    Return a function, that encodes values of the field column to CSV, as they are fetched from db.
+
+    Raw values of db are accepted, so rows are encoded without conversion: e.g. SQLite keeps dates as iso-format
+    strings and booleans as integers, while other databases return python objects.
+    """
+    if isinstance(field, ForeignKey):
+        return get_csv_encoder(field.to._meta.pk_field)
+    if isinstance(field, BooleanField):
+        return _encode_csv_bool
+    if isinstance(field, (DateField, DateTimeField)):
+        return _encode_csv_date
+    if isinstance(field, (IntegerField, DecimalField, AutoField)):
+        return _encode_number
+    return encode_csv_value
+
+
+def get_json_encoder(field):
+    """Return a function, that encodes values of the field column to JSON, as they are fetched from db."""
+    if isinstance(field, ForeignKey):
+        return get_json_encoder(field.to._meta.pk_field)
+    if isinstance(field, BooleanField):
+        return _encode_json_bool
+    if isinstance(field, (DateField, DateTimeField)):
+        return _encode_json_date
+    if isinstance(field, (IntegerField, DecimalField, AutoField)):
+        return _encode_json_number
+    return _encode_json_value
+
+
+def get_row_encoder(format, names, fields):  # pylint: disable=redefined-builtin
+    """
+    Return a function, that encodes a row of the fields columns to a line of CSV or JSON Lines ('jsonl') format.
+
+    Keys of JSON objects are `names` of the columns, lines are returned without line breaks.
+    """
+    if format == 'csv':
+        encoders = [get_csv_encoder(field) for field in fields]
+
+        def encode_row(row):
+            return ','.join([encode(value) for encode, value in zip(encoders, row)])
+    else:
+        encoders = [get_json_encoder(field) for field in fields]
+        key_parts = [f'{json.dumps(name)}: ' for name in names]
+
+        def encode_row(row):
+            items = [key + encode(value) for key, encode, value in zip(key_parts, encoders, row)]
+            return '{' + ', '.join(items) + '}'
+
+    return encode_row
+
+
+def _encode_number(value):
+    return '' if value is None else str(value)
+
+
+def _encode_csv_bool(value):
+    if value is None:
+        return ''
+    return 'true' if value else 'false'
+
+
+def _encode_csv_date(value):
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else _format_date(value)
+
+
+def _encode_json_bool(value):
+    if value is None:
+        return 'null'
+    return 'true' if value else 'false'
+
+
+def _encode_json_date(value):
+    if value is None:
+        return 'null'
+    return f'"{value}"' if isinstance(value, str) else f'"{_format_date(value)}"'
+
+
+def _encode_json_number(value):
+    return 'null' if value is None else str(value)
+
+
+def _encode_json_value(value):
+    return json.dumps(value, default=str)
+
+
+def _format_date(value):
+    # datetime is formatted like SQLite keeps it, so exported values don't depend on db:
+    return value.isoformat(sep=' ') if hasattr(value, 'hour') else value.isoformat()
+
+
+class CSVRowStream:
+    """A file-like object, that encodes rows to CSV lazily, as its content is read."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+
+            line = encode_csv_row(row)
+            chunks.append(line)
+            length += len(line)
+
+        data = ''.join(chunks)
+        if size < 0:
+            self._buffer = ''
+            return data
+
+        self._buffer = data[size:]
+        return data[:size]
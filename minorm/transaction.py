@@ -1,28 +1,86 @@
 from contextlib import contextmanager
+import itertools
 
 from minorm.connectors import connector
 
 
+class TransactionError(RuntimeError):
+    pass
+
+
 def commit(db=None):
     if not db:
         db = connector
 
-    db.connection.commit()
+    _check_not_nested(db, 'commit')
+    db.commit()
 
 
 def rollback(db=None):
     if not db:
         db = connector
 
-    db.connection.rollback()
+    _check_not_nested(db, 'rollback')
+    db.rollback()
+
+
+def on_commit(callback, db=None):
+    """Call the function after the transaction of the current atomic block is committed."""
+    if not db:
+        db = connector
+
+    db.on_commit(callback)
 
 
 @contextmanager
-def atomic(db=None):
+def atomic(db=None, immediate=False):
+    """
+    Run db operations inside the block in a transaction.
+
+    Nested blocks are run inside savepoints, so they could be rolled back without affecting the outer transaction.
+    `immediate` transaction takes write lock at start (`BEGIN IMMEDIATE` on SQLite, that has no row locks),
+    so rows, selected for update, could not be changed by other connections until the end of the block.
+    """
     if not db:
         db = connector
 
-    connector.set_autocommit(False)
-    with db.connection:
+    if db.in_atomic_block:
+        if immediate and not db.in_immediate_block:
+            raise TransactionError('Immediate atomic block could not be nested in a deferred one.')
+        savepoint = db.savepoint()
+        try:
+            yield
+        except BaseException:
+            db.rollback_to_savepoint(savepoint)
+            raise
+        db.release_savepoint(savepoint)
+        return
+
+    db.begin(immediate=immediate)
+    try:
         yield
-    connector.set_autocommit(True)
+    except BaseException:
+        db.end(commit=False)
+        raise
+    db.end(commit=True)
+
+
+def batched(func, items, batch_size=1000, db=None):
+    """
+    Call the function for each item, committing the transaction once per `batch_size` items.
+
+    Return number of processed items.
+    """
+    items_iterator = iter(items)
+    processed_number = 0
+    for batch in iter(lambda: list(itertools.islice(items_iterator, batch_size)), []):
+        with atomic(db):
+            for item in batch:
+                func(item)
+        processed_number += len(batch)
+    return processed_number
+
+
+def _check_not_nested(db, action):
+    if db.savepoints:
+        raise TransactionError(f'It is not possible to {action} inside of nested atomic block.')
@@ -0,0 +1,187 @@
+import atexit
+import queue
+import threading
+import time
+
+from minorm import transaction
+from minorm.connectors import Connector
+from minorm.fields import AutoField, ForeignKey
+from minorm.queries import InsertQuery
+
+
+class WriterError(RuntimeError):
+    pass
+
+
+class BufferedWriter:  # pylint: disable=too-many-instance-attributes
+    """
+    Write-behind buffer of model instances, that are inserted by a background thread, in batches.
+
+    A batch is inserted by multi-row queries in one transaction, when it gets `max_rows` instances, or when its first
+    instance waits for `max_latency` seconds. Rows of a failed batch are retried one by one, and rows that fail again
+    are passed to `on_error(instance, error)`, or, if there is no callback, the first error is raised by `flush()`.
+    The thread uses its own connection to db of the model (to a shard, for sharded model), see
+    `SQLiteSpec.shared_between_threads` for in-memory db. Unset fields with `db_default` get values from db,
+    as on `save()`, but primary keys are not set to written instances.
+    """
+
+    POLL_INTERVAL = 0.05  # seconds between checks of closed writer, when buffer is full
+
+    _STOP = object()  # marker of the end of items in buffer
+
+    def __init__(self, model, max_rows=1000, max_latency=1.0, max_buffered=None, on_error=None):
+        # pylint: disable=too-many-arguments
+        self.model = model
+        self.max_rows = max_rows
+        self.max_latency = max_latency
+        self.on_error = on_error
+
+        self._fields = [field for field in model._meta.fields if not isinstance(field, AutoField)]
+        self._attr_names = [
+            field.raw_fk_attr if isinstance(field, ForeignKey) else field.name for field in self._fields
+        ]
+        # writes are blocked, when buffer is full, until the thread inserts buffered rows:
+        self._buffer = queue.Queue(maxsize=max_buffered or max_rows * 10)
+        self._error = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name='minorm-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)  # buffered rows are flushed on interpreter exit
+
+    def write(self, instance, timeout=None):
+        """
+        Add the instance to the buffer. Values and shard are resolved at once, so invalid ones fail in the caller.
+
+        If the buffer is full, wait until there is free space, for `timeout` seconds at most (or forever).
+        """
+        meta = self.model._meta
+        column_names = []
+        values = []
+        for field, attr_name in zip(self._fields, self._attr_names):
+            value = getattr(instance, attr_name)
+            if value is None and field.db_default is not None:
+                continue  # values of unset fields with db defaults are generated by db
+            column_names.append(field.column_name)
+            values.append(field.to_query_parameter(value))
+        shard = meta.get_instance_shard(instance) if meta.is_sharded else None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._closed:
+                raise WriterError('Instances could not be written to closed writer.')
+            wait_timeout = self.POLL_INTERVAL
+            if deadline is not None:
+                wait_timeout = min(wait_timeout, deadline - time.monotonic())
+                if wait_timeout <= 0:
+                    raise WriterError(f'Buffer of writer is full for {timeout} seconds.')
+            try:
+                self._buffer.put((instance, tuple(column_names), values, shard), timeout=wait_timeout)
+                return
+            except queue.Full:
+                pass
+
+    def flush(self):
+        """Wait until all written instances are inserted, raise the first error of rows, if there is no callback."""
+        flushed = threading.Event()
+        with self._lock:
+            if self._closed:
+                flushed.set()
+            else:
+                self._buffer.put(flushed)  # it's put before the end marker, so the thread sets it
+        flushed.wait()
+        self._raise_error()
+
+    def close(self):
+        """Insert all buffered instances and stop the thread."""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._buffer.put(self._STOP)
+                self._thread.join()
+                atexit.unregister(self.close)
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _raise_error(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise WriterError(f'Some rows of {self.model.__name__} were not written.') from error
+
+    def _run(self):
+        dbs = {}  # connectors of the thread, by shard names
+        batch = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if not batch else max(deadline - time.monotonic(), 0)
+                try:
+                    item = self._buffer.get(timeout=timeout)
+                except queue.Empty:
+                    item = None  # the oldest instance waits for too long
+
+                if isinstance(item, tuple):
+                    if not batch:
+                        deadline = time.monotonic() + self.max_latency
+                    batch.append(item)
+                    if len(batch) < self.max_rows:
+                        continue
+
+                self._write_batch(batch, dbs)
+                batch = []
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is self._STOP:
+                    return
+        finally:
+            for db in dbs.values():
+                db.disconnect()
+
+    def _write_batch(self, batch, dbs):
+        # rows are inserted by multi-row queries, so they are grouped by shard and by inserted columns:
+        grouped_rows = {}
+        for instance, column_names, values, shard in batch:
+            grouped_rows.setdefault((shard, column_names), []).append((instance, values))
+
+        for (shard, column_names), rows in grouped_rows.items():
+            try:
+                self._insert(self._get_db(dbs, shard), [values for __, values in rows], column_names)
+            except Exception:  # pylint: disable=broad-except
+                # rows are retried one by one, so only invalid ones are lost:
+                for instance, values in rows:
+                    try:
+                        self._insert(self._get_db(dbs, shard), [values], column_names)
+                    except Exception as err:  # pylint: disable=broad-except
+                        self._handle_error(instance, err)
+
+    def _get_db(self, dbs, shard):
+        if shard not in dbs:
+            db = self.model._meta.get_db(shard)
+            dbs[shard] = Connector(statement_timeout=db.statement_timeout).connect(db.spec)
+        return dbs[shard]
+
+    def _insert(self, db, rows, column_names):
+        table_name = self.model._meta.table_name
+        # a row of db defaults only is inserted by DEFAULT VALUES, that inserts one row at once:
+        chunk_size = max(db.spec.max_query_params // len(column_names), 1) if column_names else 1
+        with transaction.atomic(db=db):
+            with db.cursor() as curr:
+                for i in range(0, len(rows), chunk_size):
+                    chunk = rows[i:i + chunk_size]
+                    query = InsertQuery(table_name=table_name, fields=column_names, rows_number=len(chunk))
+                    curr.execute(query.render_sql(db.spec), [value for values in chunk for value in values])
+
+    def _handle_error(self, instance, error):
+        if self.on_error:
+            try:
+                self.on_error(instance, error)
+                return
+            except Exception as callback_error:  # pylint: disable=broad-except
+                error = callback_error  # the thread should keep writing, so error of callback is raised by flush
+        if self._error is None:
+            self._error = error
@@ -1,6 +1,6 @@
 import pytest
 
-from minorm.connectors import connector
+from minorm.connectors import connector, Connector, ShardedConnector
 from minorm.db_specs import SQLiteSpec
 from minorm.fields import CharField, IntegerField, ForeignKey
 from minorm.models import Model
@@ -39,3 +39,21 @@ def related_models(test_model):
     Book.create_table()
     yield Book, test_model
     Book.drop_table()
+
+
+@pytest.fixture(scope="function")
+def sharded_model():
+    shards = {name: Connector().connect(SQLiteSpec(":memory:", check_same_thread=False)) for name in ('a', 'b')}
+    sharded_db = ShardedConnector(shards, shard_for_key=lambda tenant_id: 'ab'[tenant_id % 2])
+
+    class Purchase(Model):
+        tenant_id = IntegerField()
+        title = CharField(max_length=50)
+
+        class Meta:
+            db = sharded_db
+            shard_key = 'tenant_id'
+
+    Purchase.create_table()
+    yield Purchase
+    sharded_db.disconnect()
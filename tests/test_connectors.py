@@ -1,7 +1,10 @@
+import threading
+
 import pytest
 
-from minorm.connectors import Connector, ConnectorError
+from minorm.connectors import ConnectionPool, Connector, ConnectorError, ShardedConnector
 from minorm.db_specs import SQLiteSpec
+from minorm.exceptions import QueryTimeout
 
 
 class TestConnector:
@@ -42,3 +45,116 @@ class TestConnector:
         with pytest.raises(ConnectorError, match=r'[cC]onnect.*'):
             with connector.cursor():
                 pass
+
+    def test_cursor_timeout(self, test_db):
+        endless_query = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c;'
+        with pytest.raises(QueryTimeout):
+            with test_db.cursor(timeout=0.05) as curr:
+                curr.execute(endless_query)
+
+        with test_db.cursor(timeout=0.05) as curr:
+            curr.execute('SELECT 1;')  # the limit is removed after the block
+            assert curr.fetchone() == (1, )
+
+        db = Connector(statement_timeout=0.05).connect(SQLiteSpec(':memory:'))
+        with pytest.raises(QueryTimeout):
+            with db.cursor() as curr:
+                curr.execute(endless_query)
+        db.disconnect()
+
+    def test_session_statement_timeout(self, mocker):
+        db_spec = mocker.MagicMock(SESSION_STATEMENT_TIMEOUT=True, LAZY_RESULTS=False)
+        connection = db_spec.create_connection.return_value
+        db = Connector(statement_timeout=5).connect(db_spec)
+        db_spec.set_statement_timeout.assert_called_once_with(connection, 5)  # once for the connection
+
+        with db.cursor() as curr:
+            curr.execute('SELECT 1;')
+        with db.cursor(timeout=5) as curr:
+            curr.execute('SELECT 1;')
+        db_spec.set_statement_timeout.assert_called_once()
+
+        with db.cursor(timeout=1) as curr:
+            curr.execute('SELECT 1;')
+        assert db_spec.set_statement_timeout.call_args[0][1] == pytest.approx(1, abs=0.5)
+        db_spec.reset_statement_timeout.assert_called_once_with(connection, 5)  # the default is restored
+
+        db.statement_timeout = None
+        db_spec.reset_statement_timeout.assert_called_with(connection)
+
+
+class TestShardedConnector:
+
+    def test_get_shard(self):
+        first, second = Connector(), Connector()
+        sharded_db = ShardedConnector({'a': first, 'b': second})
+
+        assert sharded_db.get_shard('b') is second
+        with pytest.raises(ValueError, match='Unknown shard c'):
+            sharded_db.get_shard('c')
+
+    def test_get_shard_name(self):
+        sharded_db = ShardedConnector({'a': Connector(), 'b': Connector()})
+
+        assert {sharded_db.get_shard_name(key) for key in range(20)} == {'a', 'b'}
+        assert sharded_db.get_shard_name(42) == sharded_db.get_shard_name(42)
+        with pytest.raises(ValueError):
+            sharded_db.get_shard_name(None)
+
+    def test_get_shard_name_custom(self):
+        sharded_db = ShardedConnector({'a': Connector(), 'b': Connector()}, shard_for_key=lambda key: 'ab'[key % 2])
+        assert sharded_db.get_shard_name(3) == 'b'
+        assert sharded_db.get_shard_for_key(4) is sharded_db.get_shard('a')
+
+    def test_map(self):
+        sharded_db = ShardedConnector({'a': Connector(), 'b': Connector(), 'c': Connector()})
+        assert sharded_db.map(str.upper) == ['A', 'B', 'C']
+        sharded_db.disconnect()
+
+
+class TestConnectionPool:
+
+    def test_acquire_release(self):
+        pool = ConnectionPool(SQLiteSpec(":memory:"))
+        db = pool.acquire()
+        assert db.spec is pool.db_spec
+        pool.release(db)
+        assert pool.acquire() is db
+        assert pool.acquire() is not db
+
+    def test_statement_timeout(self):
+        pool = ConnectionPool(SQLiteSpec(":memory:"), statement_timeout=3)
+        assert pool.acquire().statement_timeout == 3
+
+    def test_connections_shared_between_threads(self):
+        db_spec = SQLiteSpec(":memory:")
+        pool = ConnectionPool(db_spec)
+        assert not pool.db_spec.check_same_thread
+        assert db_spec.check_same_thread  # the given spec is not changed
+
+        db = pool.acquire()
+        thread = threading.Thread(target=pool.release, args=(db, ))
+        thread.start()
+        thread.join()
+        pool.close()  # connections are closed by other thread, than created them
+        assert not db._connection
+
+    def test_release_rollbacks_transaction(self):
+        pool = ConnectionPool(SQLiteSpec(":memory:"))
+        db = pool.acquire()
+        db.begin()
+        pool.release(db)
+        assert not db.in_atomic_block
+
+    def test_close(self):
+        pool = ConnectionPool(SQLiteSpec(":memory:"))
+        db = pool.acquire()
+        pool.release(db)
+        pool.close()
+        with pytest.raises(ConnectorError):
+            db.connection
+
+        other_db = pool.acquire()
+        pool.release(other_db)  # connectors, released to closed pool, are disconnected
+        with pytest.raises(ConnectorError):
+            other_db.connection
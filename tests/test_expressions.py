@@ -1,6 +1,6 @@
 import pytest
 
-from minorm.expressions import WhereCondition, OrderByExpression
+from minorm.expressions import Exists, F, OuterRef, WhereCondition, OrderByExpression
 
 
 class TestWhereCondition:
@@ -52,6 +52,38 @@ class TestWhereCondition:
         assert str(not_and) == "NOT (x = {0} AND y = {0})"
         assert not_and.values() == ('3', '5')
 
+    def test_and_multiple(self):
+        where_cond1 = WhereCondition(field='x', op='=', value='3')
+        where_cond2 = WhereCondition(field='y', op='=', value='5')
+        where_cond3 = WhereCondition(field='z', op='=', value='42')
+
+        result = where_cond1 & where_cond2 & where_cond3
+        assert str(result) == "x = {0} AND y = {0} AND z = {0}"
+        assert result.values() == ('3', '5', '42')
+        assert str(where_cond1) == "x = {0}"  # operands should not be changed
+
+    def test_or_grouped(self):
+        where_cond1 = WhereCondition(field='x', op='=', value='3')
+        where_cond2 = WhereCondition(field='y', op='=', value='5')
+        where_cond3 = WhereCondition(field='z', op='=', value='42')
+
+        result = (where_cond1 | where_cond2) & where_cond3
+        assert str(result) == "(x = {0} OR y = {0}) AND z = {0}"
+        assert result.values() == ('3', '5', '42')
+
+        result = where_cond3 & (where_cond1 | where_cond2)
+        assert str(result) == "z = {0} AND (x = {0} OR y = {0})"
+        assert result.values() == ('42', '3', '5')
+
+    def test_not_grouped(self):
+        where_cond1 = WhereCondition(field='x', op='=', value='3')
+        where_cond2 = WhereCondition(field='y', op='=', value='5')
+
+        result = ~where_cond1 & where_cond2
+        assert str(result) == "(NOT (x = {0})) AND y = {0}"
+        assert result.values() == ('3', '5')
+        assert not where_cond1._negated
+
     def test_clone(self):
         where = WhereCondition(field='x', op='=', value='3') | WhereCondition(field='y', op='=', value='5')
         clone_where = where.clone()
@@ -59,6 +91,50 @@ class TestWhereCondition:
         assert clone_where.values() == where.values()
 
 
+class TestExists:
+
+    def test_str(self, test_model):
+        qs = test_model.qs.filter(name='x', id=OuterRef('pk'))
+        where_cond = Exists(qs)
+        where_cond.resolve_outer_refs(test_model)
+
+        assert str(where_cond) == (
+            "EXISTS (SELECT U0.name, U0.age, U0.id FROM person U0 "
+            "WHERE U0.name = {0} AND U0.id = person.id)"
+        )
+        assert where_cond.values() == ('x', )
+
+    def test_not(self, test_model):
+        where_cond = ~Exists(test_model.qs.filter(age__gt=3)) & WhereCondition(field='x', op='=', value='3')
+
+        assert str(where_cond).startswith("(NOT (EXISTS (SELECT ")
+        assert where_cond.values() == (3, '3')
+
+    def test_outer_ref_not_bound(self):
+        with pytest.raises(ValueError, match=r'.*foo.*'):
+            str(OuterRef('foo'))
+
+
+class TestF:
+
+    def test_resolve(self, test_model):
+        assert str(F('age').resolve(test_model)) == 'age'
+        assert str(F('pk').resolve(test_model, table_name='person')) == 'person.id'
+
+    def test_arithmetic(self, test_model):
+        expression = ((F('age') + 1) * 2 - F('id') / 3).resolve(test_model)
+        assert str(expression) == '((age + {0}) * {0}) - (id / {0})'
+        assert expression.values() == (1, 2, 3)
+
+        reversed_expression = (10 - F('age')).resolve(test_model, table_name='person')
+        assert str(reversed_expression) == '{0} - person.age'
+        assert reversed_expression.values() == (10, )
+
+    def test_invalid_field(self, test_model):
+        with pytest.raises(ValueError, match='foo'):
+            F('foo').resolve(test_model)
+
+
 class TestOrderByExpression:
 
     def test_from_field_name(self):
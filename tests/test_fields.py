@@ -33,6 +33,9 @@ class TestField:
         non_unique = Field(null=True, unique=False, column_name='test', default=None)
         assert non_unique.render_sql() == 'test INTEGER'
 
+        db_default_field = Field(column_name='test', db_default='0')
+        assert db_default_field.render_sql() == 'test INTEGER NOT NULL DEFAULT 0'
+
     @pytest.mark.parametrize('lookup_name, operator', [
         ('lt', '<'),
         ('lte', '<='),
@@ -56,6 +59,19 @@ class TestField:
         assert result.op == 'IN'
         assert result.value == ['foo', 'bar']
 
+    @pytest.mark.parametrize('default, expected', [
+        pytest.param(None, None, id='no-default'),
+        pytest.param(dict, None, id='callable-default'),
+        pytest.param(True, 'TRUE', id='boolean-default'),
+        pytest.param(42, '42', id='number-default'),
+        pytest.param(Decimal('2.50'), '2.50', id='decimal-default'),
+        pytest.param("it's", "'it''s'", id='string-default'),
+        pytest.param(date(2020, 9, 2), "'2020-09-02'", id='date-default'),
+        pytest.param(datetime(2020, 9, 2, 11, 42), "'2020-09-02 11:42:00'", id='date-time-default'),
+    ])
+    def test_render_sql_default(self, default, expected):
+        assert Field(default=default).render_sql_default() == expected
+
     def test_resolve_wrong_lookup(self):
         field = Field(column_name='test_column')
 
@@ -131,6 +147,11 @@ class TestBooleanField:
         with pytest.raises(ValueError, match=r'"test_field"\s+value\s+must\s+be\s+either\s+True\s+or\s+False'):
             bool_field.to_query_parameter(invalid_value)
 
+    def test_get_db_converter(self):
+        convert = BooleanField().get_db_converter()
+        assert convert(1) is True
+        assert convert(0) is False
+
 
 class TestCharField:
 
@@ -176,6 +197,15 @@ class TestDecimalField:
         with pytest.raises(ValueError, match=r'"test_field"\s+value\s+must\s+be\sa\s+decimal\s+number'):
             decimal_field.to_query_parameter(invalid_value)
 
+    @pytest.mark.parametrize('raw_value, expected', [
+        pytest.param(3.14, Decimal("3.14"), id='float-value'),
+        pytest.param(42, Decimal("42"), id='int-value'),
+        pytest.param("2.50", Decimal("2.50"), id='string-value'),
+    ])
+    def test_get_db_converter(self, raw_value, expected):
+        convert = DecimalField(max_digits=6, decimal_places=2).get_db_converter()
+        assert convert(raw_value) == expected
+
 
 class TestDateField:
 
@@ -205,6 +235,10 @@ class TestDateField:
         with pytest.raises(expected_error_type):
             date_field.to_query_parameter(invalid_value)
 
+    def test_get_db_converter(self):
+        convert = DateField().get_db_converter()
+        assert convert('2020-09-02') == date(2020, 9, 2)
+
 
 class TestDateTimeField:
 
@@ -236,6 +270,12 @@ class TestDateTimeField:
         with pytest.raises(expected_error_type):
             date_field.to_query_parameter(invalid_value)
 
+    def test_get_db_converter(self):
+        convert = DateTimeField().get_db_converter()
+        assert convert('2020-09-02 11:42:33.777') == datetime(2020, 9, 2, 11, 42, 33, 777000)
+        assert convert('2020-09-02 11:42') == datetime(2020, 9, 2, 11, 42)
+        assert convert('2020-09-02') == datetime(2020, 9, 2)
+
 
 class TestAutoField:
 
@@ -302,6 +342,10 @@ class TestForeignKey:
         assert author.id == 1
         assert author.name == 'foo'
 
+    def test_get_db_converter(self, related_models):
+        model_with_fk, _ = related_models
+        assert model_with_fk._meta.get_fk_field("author").get_db_converter() is None
+
     def test_get_no_fk_value(self, related_models):
         model_with_fk, external_model = related_models
         db = external_model._meta.db
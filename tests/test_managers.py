@@ -1,7 +1,17 @@
+from datetime import date, datetime
+from decimal import Decimal
+import io
+import itertools
+import time
+
 import pytest
 
-from minorm.exceptions import MultipleQueryResult
-from minorm.fields import CharField, ForeignKey
+from minorm import transaction
+from minorm.connectors import Connector
+from minorm.db_specs import SQLiteSpec
+from minorm.exceptions import MultipleQueryResult, QueryTimeout, VersionConflict
+from minorm.expressions import Exists, F, OuterRef
+from minorm.fields import BooleanField, CharField, DateField, DateTimeField, DecimalField, ForeignKey, VersionField
 from minorm.managers import QuerySet, OrderByExpression
 from minorm.models import Model
 
@@ -50,7 +60,7 @@ class TestQuerySet:
 
         result = qs.order_by('-age', 'name')
 
-        assert result._order_by == {OrderByExpression('person.age', 'DESC'), OrderByExpression('person.name', 'ASC')}
+        assert result._order_by == [OrderByExpression('person.age', 'DESC'), OrderByExpression('person.name', 'ASC')]
 
     def test_filter_by_pk(self, test_model):
         qs1 = test_model.qs.filter(pk=1)
@@ -205,6 +215,75 @@ class TestQuerySet:
             results = c.fetchall()
         assert len(results) == 2
 
+    def test_update_expression(self, test_model):
+        db = test_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('x', 3), ('y', 5), ('z', 1)])
+
+        qs = test_model.qs.filter(age__gte=F('id'))
+        assert str(qs.query) == (
+            'SELECT person.name, person.age, person.id FROM person WHERE person.age >= person.id'
+        )
+        assert qs.update(age=F('age') + 10) == 2
+        assert test_model.qs.filter(name=F('name')).update(name=F('age')) == 3
+        assert list(test_model.qs.order_by('id').values('name', 'age')) == [
+            {'name': '13', 'age': 13}, {'name': '15', 'age': 15}, {'name': '1', 'age': 1},
+        ]
+
+        assert test_model.qs.filter(age__lt=10).update(age=F('age') * 2, batch_size=1) == 1
+        assert test_model.qs.get(name='1').age == 2
+
+    def test_filter_pattern_expression(self, test_model):
+        people = [('a12b', 12), ('123', 3), ('x', 1)]
+        test_model.qs.bulk_create([test_model(name=name, age=age) for name, age in people])
+
+        qs = test_model.qs.filter(name__contains=F('age'))
+        assert str(qs._where) == 'person.name LIKE {0} || (person.age) || {0}'
+        assert qs._where.values() == ('%', '%')
+        assert sorted(person.name for person in qs) == ['123', 'a12b']
+        assert [person.name for person in test_model.qs.filter(name__startswith=F('age') + 9)] == ['123']
+        assert [person.name for person in test_model.qs.filter(name__endswith=F('name'))] == ['a12b', '123', 'x']
+
+        with pytest.raises(ValueError, match='expression'):
+            test_model.qs.filter(age__in=F('id'))
+
+    def test_bulk_update(self, test_model):
+        people = [test_model.qs.create(name=name, age=age) for name, age in [('x', 3), ('y', 5)]]
+        for person in people:
+            person.age += 10
+            person.name = 'foo'
+
+        assert test_model.qs.bulk_update(people, ['age']) == 2
+        assert list(test_model.qs.order_by('id').values('name', 'age')) == [
+            {'name': 'x', 'age': 13}, {'name': 'y', 'age': 15},
+        ]
+
+        with pytest.raises(ValueError, match='without pk'):
+            test_model.qs.bulk_update([test_model(name='z', age=1)], ['age'])
+
+    def test_bulk_update_version(self, test_db):
+        class Article(Model):
+            title = CharField(max_length=50)
+            version = VersionField()
+
+        Article.create_table()
+        articles = [Article.qs.create(title=title) for title in ('a', 'b', 'c')]
+        assert Article.qs.filter(title='c').update(title='C') == 1
+        assert Article.qs.get(title='C').version == 2  # version is incremented by queryset update
+
+        for article in articles:
+            article.title += '!'
+        with pytest.raises(VersionConflict, match='1 rows'):
+            Article.qs.bulk_update(articles, ['title', 'version'])
+        assert [article.version for article in articles] == [1, 1, 1]
+        assert [row['title'] for row in Article.qs.order_by('id').values('title')] == ['a', 'b', 'C']
+
+        assert Article.qs.bulk_update(articles[:2], ['title']) == 2
+        assert [article.version for article in articles] == [2, 2, 1]
+        assert list(Article.qs.order_by('id').values('title', 'version')) == [
+            {'title': 'a!', 'version': 2}, {'title': 'b!', 'version': 2}, {'title': 'C', 'version': 2},
+        ]
+
     def test_create(self, test_model):
         test_model.qs.create(name='Vasya', age=19)
         with test_model._meta.db.cursor() as c:
@@ -212,6 +291,30 @@ class TestQuerySet:
             results = c.fetchall()
         assert results
 
+    def test_create_using(self, sharded_model, test_model):
+        class Log(Model):
+            title = CharField(max_length=50)
+
+            class Meta:
+                db = sharded_model._meta.db
+
+        Log.create_table()
+        log = Log.qs.using('b').create(title='x')
+        assert [entry.title for entry in Log.qs.using('b')] == ['x']
+        assert not Log.qs.using('a').exists()
+        assert log.pk == 1
+
+        order = sharded_model.qs.using('b').create(tenant_id=2, title='foo')
+        assert sharded_model.qs.using('b').get(pk=order.pk).tenant_id == 2
+
+        other_db = Connector().connect(SQLiteSpec(':memory:'))
+        with other_db.cursor() as curr:
+            curr.execute(test_model.render_sql())
+        person = test_model.qs.using(other_db).create(name='Vasya', age=19)
+        assert test_model.qs.using(other_db).get(pk=person.pk).name == 'Vasya'
+        assert not test_model.qs.exists()
+        other_db.disconnect()
+
     def test_update_with_fk(self, related_models):
         model_with_fk, external_model = related_models
 
@@ -571,3 +674,871 @@ class TestQuerySet:
         qs.exists()
         assert not qs._values_mapping  # should not change attributes of the queryset
         assert not qs._limit
+
+    def test_filter_in_subquery(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar', 19), ('baz', 20)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('b', 2), ('c', 3)])
+
+        qs = model_with_fk.qs.filter(author__in=external_model.qs.filter(age__gte=19), title__neq='c')
+        assert str(qs._where) == (
+            "book.person_id IN (SELECT person.id FROM person WHERE person.age >= {0}) AND book.title != {0}"
+        )
+        assert qs.query_params == (19, 'c')
+
+        results = qs.fetch()
+        assert len(results) == 1
+        assert results[0].title == 'b'
+
+    def test_filter_in_subquery_values(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar', 19)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('b', 2), ('c', 1)])
+
+        author_ids = model_with_fk.qs.filter(title='b').values('author')
+        results = external_model.qs.filter(id__in=author_ids).fetch()
+        assert len(results) == 1
+        assert results[0].name == 'bar'
+
+        with pytest.raises(ValueError, match=r'.*one field.*'):
+            external_model.qs.filter(id__in=model_with_fk.qs.values('id', 'author'))
+
+    def test_filter_exists(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar', 19), ('baz', 20)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('b', 3), ('c', 3)])
+
+        books = model_with_fk.qs.filter(author=OuterRef('pk'), title__neq='a')
+        results = external_model.qs.filter(Exists(books)).fetch()
+        assert len(results) == 1
+        assert results[0].name == 'baz'
+
+        results = external_model.qs.filter(~Exists(model_with_fk.qs.filter(author=OuterRef('pk')))).fetch()
+        assert len(results) == 1
+        assert results[0].name == 'bar'
+
+    def test_filter_exists_same_model(self, test_model):
+        test_model.qs.bulk_create([test_model(name=name, age=age) for name, age in [('a', 1), ('b', 2), ('c', 3)]])
+
+        older = test_model.qs.filter(age__gt=OuterRef('age'))
+        assert [person.name for person in test_model.qs.filter(Exists(older)).order_by('age')] == ['a', 'b']
+        assert [person.name for person in test_model.qs.filter(~Exists(older))] == ['c']
+        assert not test_model.qs.filter(id__in=older)  # ids of the older persons only
+        assert str(older.query).endswith('WHERE person.age > person.age')  # the queryset itself is not changed
+
+        # a subquery of the same table, nested into the subquery, refers to it by another alias:
+        has_older_peer = test_model.qs.filter(age__gt=OuterRef('age')).filter(Exists(older))
+        assert [person.name for person in test_model.qs.filter(Exists(has_older_peer))] == ['a']
+
+        assert test_model.qs.filter(Exists(older)).delete() == 2
+        assert [person.name for person in test_model.qs.all()] == ['c']
+
+    def test_update_subquery(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar', 19)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('b', 2), ('c', 1)])
+
+        rowcount = model_with_fk.qs.filter(author__in=external_model.qs.filter(name='foo')).update(title='x')
+        assert rowcount == 2
+
+        with db.cursor() as c:
+            c.execute('SELECT title FROM book ORDER BY id;')
+            results = c.fetchall()
+        assert [row[0] for row in results] == ['x', 'b', 'x']
+
+    def test_delete_subquery(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar', 19)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('c', 1)])
+
+        rowcount = external_model.qs.filter(~Exists(model_with_fk.qs.filter(author=OuterRef('pk')))).delete()
+        assert rowcount == 1
+
+        with db.cursor() as c:
+            c.execute('SELECT name FROM person;')
+            results = c.fetchall()
+        assert [row[0] for row in results] == ['foo']
+
+    def test_filter_reverse_relation(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar', 19), ('baz', 20)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('b', 1), ('a', 3)])
+
+        qs = external_model.qs.filter(book_set__title__in=('a', 'b'))
+        assert qs.query.render_sql(db.spec) == (
+            'SELECT person.name, person.age, person.id FROM person '
+            'WHERE person.id IN (SELECT book.person_id FROM book WHERE book.title IN (?, ?));'
+        )
+
+        results = qs.fetch()
+        assert len(results) == 2  # no duplicates of rows with multiple related rows
+        assert results[0].name == 'foo'
+        assert results[1].name == 'baz'
+
+        # lookups of one filter call should match the same related row:
+        assert external_model.qs.filter(book_set__title='b', book_set__id=1).fetch() == []
+        assert len(external_model.qs.filter(book_set__title='b').filter(book_set__id=1).fetch()) == 1
+        assert [b.title for b in model_with_fk.qs.filter(author__book_set__title='b').order_by('id')] == ['a', 'b']
+
+    def test_filter_reverse_relation_values(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('Al', 18), ('Al', 19)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('x', 1), ('y', 1), ('x', 2)])
+
+        qs = external_model.qs.filter(book_set__title='x').order_by('age')
+        assert qs.values('name').fetch() == [{'name': 'Al'}, {'name': 'Al'}]
+        assert len(qs.values('name', 'book_set__title').fetch()) == 3
+
+    def test_values_reverse_relation(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar', 19)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('b', 1)])
+
+        results = external_model.qs.values('name', 'book_set__title').fetch()
+        assert results == [
+            {'name': 'foo', 'book_set__title': 'a'},
+            {'name': 'foo', 'book_set__title': 'b'},
+            {'name': 'bar', 'book_set__title': None},
+        ]
+
+    def test_select_related_reverse_relation(self, related_models):
+        model_with_fk, external_model = related_models
+
+        with pytest.raises(ValueError, match=r'.*book_set.*'):
+            external_model.qs.select_related('book_set')
+
+    def test_prefetch_related(self, related_models, mocker):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar', 19), ('baz', 20)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('b', 3), ('c', 1)])
+
+        mocker.patch.object(QuerySet, 'PREFETCH_CHUNK_SIZE', 2)
+        results = list(external_model.qs.prefetch_related('book_set'))
+
+        mocker.patch.object(db, 'cursor', side_effect=AssertionError('prefetched data should be used'))
+        assert [[book.title for book in person.book_set] for person in results] == [['a', 'c'], [], ['b']]
+        assert results[0].book_set[1].author is results[0]
+
+    def test_prefetch_related_get(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar', 19)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 2), ('b', 2)])
+
+        person = external_model.qs.prefetch_related('book_set').get(id=2)
+        assert [book.title for book in person.book_set] == ['a', 'b']
+
+        with pytest.raises(ValueError, match=r'.*foobar.*'):
+            external_model.qs.prefetch_related('foobar')
+
+    def test_copy_from(self, related_models):
+        model_with_fk, external_model = related_models
+
+        author = external_model.qs.create(name='foo', age=18)
+        rows = [model_with_fk(title='a', author=author), ('b', author.pk), ('c', '1')]
+
+        result = model_with_fk.qs.copy_from(iter(rows), batch_size=2)
+        assert result == 3
+
+        with external_model._meta.db.cursor() as c:
+            c.execute('SELECT title, person_id FROM book ORDER BY id;')
+            results = c.fetchall()
+        assert results == [('a', 1), ('b', 1), ('c', 1)]
+
+        with pytest.raises(ValueError, match=r'.*2 values.*'):
+            model_with_fk.qs.copy_from([('d', )])
+
+    def test_copy_from_copy_command(self, test_model, mocker):
+        db = test_model._meta.db
+        mocker.patch.object(db.spec, 'SUPPORTS_COPY', True)
+        curr = mocker.MagicMock()
+        mocker.patch.object(db, 'cursor').return_value.__enter__.return_value = curr
+        copied_data = []
+        curr.copy_expert.side_effect = lambda sql, stream: copied_data.append(stream.read())
+
+        test_model.qs.copy_from([test_model(name='John', age=33), ('', '42')])
+
+        curr.copy_expert.assert_called_once()
+        assert curr.copy_expert.call_args[0][0] == 'COPY person (name, age) FROM STDIN WITH (FORMAT csv);'
+        assert copied_data == ['"John",33\n"",42\n']
+
+    def test_copy_to(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar, "baz"', 19)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('b', 2), ('c', 1)])
+
+        file_obj = io.StringIO()
+        result = model_with_fk.qs.filter(title__neq='c').select_related('author').copy_to(file_obj, header=True)
+        assert result == 2
+        assert file_obj.getvalue() == (
+            'title,author,id,author__name,author__age,author__id\n'
+            '"a",1,1,"foo",18,1\n'
+            '"b",2,2,"bar, ""baz""",19,2\n'
+        )
+
+    def test_copy_to_copy_command(self, test_model, mocker):
+        db = test_model._meta.db
+        mocker.patch.object(db.spec, 'SUPPORTS_COPY', True)
+        curr = mocker.MagicMock()
+        curr.mogrify.return_value = b'SELECT person.name FROM person WHERE person.age > 18'
+        mocker.patch.object(db, 'cursor').return_value.__enter__.return_value = curr
+        file_obj = io.StringIO()
+
+        test_model.qs.filter(age__gt=18).values('name').copy_to(file_obj)
+
+        curr.mogrify.assert_called_once_with('SELECT person.name FROM person WHERE person.age > ?', (18, ))
+        curr.copy_expert.assert_called_once_with(
+            'COPY (SELECT person.name FROM person WHERE person.age > 18) TO STDOUT WITH (FORMAT csv);', file_obj,
+        )
+
+    def test_export(self, test_db, mocker):
+        class Payment(Model):
+            payer = CharField(max_length=50, null=True)
+            amount = DecimalField(max_digits=8, decimal_places=2)
+            paid = DateField()
+            created = DateTimeField()
+            confirmed = BooleanField(null=True)
+
+            class Meta:
+                db = test_db
+
+        Payment.create_table()
+        try:
+            Payment.qs.create(payer='a, "b"', amount=Decimal('12.5'), paid=date(2021, 2, 3),
+                              created=datetime(2021, 2, 3, 4, 5, 6), confirmed=True)
+            Payment.qs.create(payer=None, amount=Decimal('1'), paid=date(2021, 2, 4),
+                              created=datetime(2021, 2, 4), confirmed=None)
+            Payment.qs.create(payer='c', amount=Decimal('0.25'), paid=date(2021, 2, 5),
+                              created=datetime(2021, 2, 5), confirmed=False)
+            mocker.patch.object(QuerySet, 'EXPORT_CHUNK_SIZE', 2)
+            buffer = io.StringIO()
+            file_obj = mocker.Mock(wraps=buffer)
+            assert Payment.qs.order_by('id').export(file_obj) == 3
+            assert buffer.getvalue() == (
+                'payer,amount,paid,created,confirmed,id\n'
+                '"a, ""b""",12.5,2021-02-03,2021-02-03 04:05:06,true,1\n'
+                ',1,2021-02-04,2021-02-04 00:00:00,,2\n'
+                '"c",0.25,2021-02-05,2021-02-05 00:00:00,false,3\n'
+            )
+            assert file_obj.write.call_count == 3  # header and two chunks of rows
+
+            file_obj = io.StringIO()
+            qs = Payment.qs.filter(amount__gt=Decimal('0.5')).order_by('-id')
+            assert qs.export(file_obj, format='jsonl', fields=['payer', 'paid', 'confirmed']) == 2
+            assert file_obj.getvalue() == (
+                '{"payer": null, "paid": "2021-02-04", "confirmed": null}\n'
+                '{"payer": "a, \\"b\\"", "paid": "2021-02-03", "confirmed": true}\n'
+            )
+
+            with pytest.raises(ValueError, match='format'):
+                Payment.qs.export(io.StringIO(), format='xml')
+        finally:
+            Payment.drop_table()
+
+    def test_export_sharded(self, sharded_model, mocker):
+        sharded_model.qs.bulk_create([sharded_model(tenant_id=i, title=title) for i, title in enumerate('abcd')])
+        mocker.patch.object(QuerySet, 'EXPORT_CHUNK_SIZE', 1)
+        iter_rows = mocker.spy(QuerySet, '_iter_rows')
+        file_obj = io.StringIO()
+
+        assert sharded_model.qs.order_by('tenant_id').export(file_obj, fields=['title', 'tenant_id'], header=False) == 4
+        assert file_obj.getvalue() == '"a",0\n"b",1\n"c",2\n"d",3\n'
+        assert not iter_rows.called  # rows of shards are streamed by chunks, instead of loading them at once
+
+    def test_timeout(self, test_model, mocker):
+        db = test_model._meta.db
+        test_model.qs.create(name='x', age=3)
+        set_timeout = mocker.spy(db.spec, 'set_statement_timeout')
+        mocker.patch.object(db.spec, 'PROGRESS_HANDLER_STEPS', 1)
+
+        qs = test_model.qs.filter(age__gt=1).timeout(10)
+        assert [person.name for person in qs] == ['x']
+        assert set_timeout.call_args[0][1] == pytest.approx(10, abs=1)  # the time left till the deadline
+        assert qs.values('name').timeout(None)._timeout is None
+        assert len(test_model.qs.timeout(5).raw('SELECT * FROM person;').using(db)) == 1
+        assert set_timeout.call_args[0][1] == pytest.approx(5, abs=1)  # raw queryset keeps the timeout
+
+        mocker.patch('minorm.db_specs.time.monotonic', side_effect=itertools.count(0, 100))  # the deadline is over
+        with pytest.raises(QueryTimeout):
+            qs.update(age=4)
+        assert test_model.qs.get(name='x').age == 3  # the limit is removed after the query
+
+        with pytest.raises(ValueError, match='positive'):
+            test_model.qs.timeout(0)
+
+    def test_timeout_of_abandoned_iterator(self, test_model):
+        test_model.qs.bulk_create([test_model(name=f'p{age}', age=age) for age in range(300)])
+        rows = test_model.qs.order_by('age').timeout(0.05).iterator()
+        assert next(rows).name == 'p0'  # the rest of rows is never read
+        time.sleep(0.1)
+
+        # the limit of the unfinished iterator doesn't abort other queries:
+        assert len(test_model.qs.filter(age__gte=100)) == 200
+        assert len(test_model.qs.raw('SELECT * FROM person;')) == 300
+        rows.close()
+
+    def test_select_related_compact(self, test_db):
+
+        class Author(Model):
+            name = CharField(max_length=100)
+
+            class Meta:
+                compact = True
+
+        class Post(Model):
+            title = CharField(max_length=100)
+            author = ForeignKey(Author)
+
+            class Meta:
+                compact = True
+
+        Author.create_table()
+        Post.create_table()
+        with test_db.cursor() as c:
+            c.executemany('INSERT INTO author (name) VALUES (?);', [('foo', ), ('bar', )])
+            c.executemany('INSERT INTO post (title, author_id) VALUES (?, ?);', [('a', 2), ('b', 1)])
+
+        results = list(Post.qs.select_related('author'))
+        assert [(post.pk, post.title, post.author_id) for post in results] == [(1, 'a', 2), (2, 'b', 1)]
+        assert results[0].author.name == 'bar'
+        assert results[1].author.name == 'foo'
+
+        authors = list(Author.qs.prefetch_related('post_set'))
+        assert [post.title for post in authors[0].post_set] == ['b']
+
+    def test_select_related_only(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.execute('INSERT INTO person (name, age) VALUES (?, ?);', ('foo', 18))
+            c.execute('INSERT INTO book (title, person_id) VALUES (?, ?);', ('a', 1))
+
+        qs = model_with_fk.qs.select_related('author', only=['title', 'author__name'])
+        assert qs.query.render_sql(db.spec) == (
+            'SELECT book.title, book.id, T11.name, T11.id '
+            'FROM book INNER JOIN person T11 ON T11.id = book.person_id;'
+        )
+
+        book = qs.get()
+        assert (book.pk, book.title, book.author_id) == (1, 'a', 1)
+        assert (book.author.pk, book.author.name, book.author.age) == (1, 'foo', None)
+
+        result = qs.fetch()[0]
+        assert (result.id, result.title) == (1, 'a')
+        assert (result.author.id, result.author.name, result.author.age) == (1, 'foo', None)
+
+        assert qs.select_related('author', only=['author__age'])._related.get_field_names() == [
+            'title', 'id', 'author__name', 'author__age', 'author__id',
+        ]
+
+    def test_select_related_only_not_selected(self, related_models):
+        model_with_fk, __ = related_models
+
+        with pytest.raises(ValueError, match='should be selected'):
+            model_with_fk.qs.select_related(only=['author__name'])
+
+        with pytest.raises(ValueError):
+            model_with_fk.qs.select_related('author', only=['author__title'])
+
+    def test_select_related_null_relation(self, test_db):
+
+        class Author(Model):
+            name = CharField(max_length=100)
+
+        class Post(Model):
+            title = CharField(max_length=100)
+            author = ForeignKey(Author, null=True)
+
+        class Comment(Model):
+            text = CharField(max_length=100)
+            post = ForeignKey(Post)
+
+        Author.create_table()
+        Post.create_table()
+        Comment.create_table()
+        with test_db.cursor() as c:
+            c.execute('INSERT INTO author (name) VALUES (?);', ('foo', ))
+            c.executemany('INSERT INTO post (title, author_id) VALUES (?, ?);', [('a', 1), ('b', None)])
+            c.executemany('INSERT INTO comment (text, post_id) VALUES (?, ?);', [('x', 1), ('y', 2)])
+
+        qs = Comment.qs.select_related('post__author').order_by('id')
+        comments = list(qs)
+        assert comments[0].post.author.name == 'foo'
+        assert comments[1].post.title == 'b'
+        assert comments[1].post.author is None
+
+        results = qs.fetch()
+        assert results[0].post.author.name == 'foo'
+        assert results[1].post.author is None
+
+    def test_join_types(self, test_db):
+
+        class Author(Model):
+            name = CharField(max_length=100)
+
+        class Post(Model):
+            title = CharField(max_length=100)
+            author = ForeignKey(Author, null=True)
+
+        class Comment(Model):
+            text = CharField(max_length=100)
+            post = ForeignKey(Post)
+
+        def joins(qs):
+            return [str(join) for join in qs._related.get_joins(qs._get_used_relations())]
+
+        qs = Comment.qs.select_related('post__author')
+        assert joins(qs) == [
+            'INNER JOIN post T11 ON T11.id = comment.post_id',
+            'LEFT OUTER JOIN author T21 ON T21.id = T11.author_id',
+        ]
+
+        filtered_qs = qs.filter(post__author__name='foo')
+        assert joins(filtered_qs) == [
+            'INNER JOIN post T11 ON T11.id = comment.post_id',
+            'INNER JOIN author T21 ON T21.id = T11.author_id',
+        ]
+        assert joins(filtered_qs.aswell(text='x')) == [
+            'INNER JOIN post T11 ON T11.id = comment.post_id',
+            'LEFT OUTER JOIN author T21 ON T21.id = T11.author_id',
+        ]
+
+        assert joins(Post.qs.filter(comment_set__text='x')) == []  # reverse relations are filtered by subquery
+        assert joins(Author.qs.values('name', 'post_set__title')) == [
+            'LEFT OUTER JOIN post T11 ON author.id = T11.author_id',
+        ]
+
+    def test_unused_joins_pruned(self, related_models):
+        model_with_fk, external_model = related_models
+
+        db = external_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('foo', 18), ('bar', 19)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('b', 2)])
+
+        qs = model_with_fk.qs.select_related('author').values('title')
+        assert qs.query.render_sql(db.spec) == 'SELECT book.title FROM book;'
+
+        filtered_qs = model_with_fk.qs.select_related('author').filter(author__name='bar')
+        assert filtered_qs.exists()
+        assert filtered_qs.select_related(None).query.render_sql(db.spec) == (
+            'SELECT book.title, book.person_id, book.id FROM book '
+            'INNER JOIN person T11 ON T11.id = book.person_id WHERE T11.name = ?;'
+        )
+        assert [book.title for book in filtered_qs] == ['b']
+
+    def test_chaining_does_not_change_queryset(self, related_models):
+        model_with_fk, external_model = related_models
+
+        qs = model_with_fk.qs.filter(title='a')
+        qs.filter(title='b')
+        qs.aswell(title='c')
+        qs.order_by('title')
+        qs.values('title')
+        qs.select_related('author')
+        qs[1:3]
+        qs.first()
+        with pytest.raises(model_with_fk.DoesNotExists):
+            qs.get(id=42)
+
+        assert str(qs._where) == 'book.title = {0}'
+        assert not qs._order_by
+        assert not qs._values_mapping
+        assert not qs._related.relations
+        assert qs._limit is None
+        assert qs._offset is None
+
+    def test_result_cache(self, test_model, mocker):
+        db = test_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('x', 3), ('y', 6), ('z', 6)])
+
+        cursor_spy = mocker.spy(db, 'cursor')
+        qs = test_model.qs.filter(age__gt=3)
+        assert [person.name for person in qs] == ['y', 'z']
+        assert [person.name for person in qs] == ['y', 'z']
+        assert len(qs) == 2
+        assert qs[1].name == 'z'
+        assert qs[-1].name == 'z'
+        assert qs[:1][0].name == 'y'
+        assert qs
+        assert qs.exists()
+        assert qs.first().name == 'y'
+        assert cursor_spy.call_count == 1
+
+        assert len(qs.filter(name='y')) == 1  # a new queryset is not evaluated
+        assert cursor_spy.call_count == 2
+
+    def test_iterator(self, test_model, mocker):
+        db = test_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('x', 3), ('y', 6)])
+
+        cursor_spy = mocker.spy(db, 'cursor')
+        qs = test_model.qs.all()
+        assert [person.name for person in qs.iterator()] == ['x', 'y']
+        assert [person.name for person in qs.iterator()] == ['x', 'y']
+        assert qs._result_cache is None
+        assert cursor_spy.call_count == 2
+
+    def test_bool(self, test_model, mocker):
+        db = test_model._meta.db
+        with db.cursor() as c:
+            c.execute('INSERT INTO person (name, age) VALUES (?, ?);', ('x', 3))
+
+        execute_sql = mocker.spy(QuerySet, '_fetch_one')
+        assert test_model.qs.filter(name='x')
+        assert not test_model.qs.filter(name='y')
+        assert execute_sql.call_count == 2
+        assert execute_sql.call_args[0][0].query.render_sql(db.spec).endswith('LIMIT 1;')
+
+    def test_len(self, test_model):
+        db = test_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('x', 3), ('y', 6), ('z', 6)])
+
+        assert len(test_model.qs) == 3
+        assert len(test_model.qs.filter(age=6)) == 2
+        assert len(test_model.qs.filter(age=42)) == 0
+
+    def test_slice(self, test_model):
+        db = test_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [(name, 1) for name in 'abcdef'])
+
+        qs = test_model.qs[1:5]
+        assert qs.query.render_sql(db.spec).endswith('LIMIT 4 OFFSET 1;')
+        assert [person.name for person in qs] == ['b', 'c', 'd', 'e']
+        assert [person.name for person in qs[2:]] == ['d', 'e']
+        assert [person.name for person in qs[1:2]] == ['c']
+        assert [person.name for person in qs[::2]] == ['b', 'd']
+        assert [person.name for person in test_model.qs[4:]] == ['e', 'f']
+        assert qs[3].name == 'e'
+        assert not test_model.qs[2:2]
+
+        with pytest.raises(IndexError):
+            qs[4]
+
+    def test_index_uses_offset(self, test_model):
+        db = test_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('x', 3), ('y', 6), ('z', 6)])
+
+        qs = test_model.qs.all()
+        assert qs[1].name == 'y'
+        assert qs._result_cache is None
+
+    def test_fetched_values_conversion(self, test_db):
+        class Payment(Model):
+            amount = DecimalField(max_digits=8, decimal_places=2)
+            paid = DateField()
+            created = DateTimeField()
+            confirmed = BooleanField(null=True)
+
+            class Meta:
+                db = test_db
+
+        Payment.create_table()
+        try:
+            payment = Payment.qs.create(
+                amount=Decimal('12.50'), paid=date(2021, 2, 3), created=datetime(2021, 2, 3, 4, 5, 6), confirmed=True,
+            )
+            Payment.qs.create(amount=Decimal('1'), paid=date(2021, 2, 4), created=datetime(2021, 2, 4), confirmed=None)
+
+            fetched = Payment.qs.get(pk=payment.pk)
+            assert fetched.amount == Decimal('12.50')
+            assert fetched.paid == date(2021, 2, 3)
+            assert fetched.created == datetime(2021, 2, 3, 4, 5, 6)
+            assert fetched.confirmed is True
+
+            assert [row.confirmed for row in Payment.qs.order_by('id').fetch()] == [True, None]
+            assert list(Payment.qs.order_by('id').values('paid')) == [{'paid': date(2021, 2, 3)},
+                                                                       {'paid': date(2021, 2, 4)}]
+            assert [p.amount for p in Payment.qs.order_by('id').iterator()] == [Decimal('12.5'), Decimal('1')]
+
+            payment.refresh_from_db()
+            assert payment.created == datetime(2021, 2, 3, 4, 5, 6)
+        finally:
+            Payment.drop_table()
+
+    def test_update_batch_size(self, test_model, mocker):
+        db = test_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [(str(i), i % 2) for i in range(7)])
+
+        sleep = mocker.patch('minorm.managers.time.sleep')
+        progress = mocker.Mock()
+        rowcount = test_model.qs.filter(age=0).update(name='even', batch_size=2, sleep=0.5, progress=progress)
+
+        assert rowcount == 4
+        assert [call[0] for call in progress.call_args_list] == [(2,), (4,)]
+        assert sleep.call_count == 1
+        with db.cursor() as c:
+            c.execute('SELECT id FROM person WHERE name = ?;', ('even',))
+            assert [row[0] for row in c.fetchall()] == [1, 3, 5, 7]
+
+    def test_delete_batch_size(self, related_models, mocker):
+        book_model, person_model = related_models
+        db = person_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [(str(i), i) for i in range(5)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('x', 1), ('x', 3), ('x', 4)])
+
+        commit_spy = mocker.spy(db, 'end')
+        rowcount = person_model.qs.filter(book_set__title='x').delete(batch_size=2)
+
+        assert rowcount == 3
+        assert commit_spy.call_count == 2  # each chunk is committed separately
+        assert [person.pk for person in person_model.qs.order_by('id')] == [2, 5]
+
+    def test_batches_of_slice(self, test_model):
+        test_model.qs.bulk_create([test_model(name=str(i), age=i) for i in range(10)])
+
+        assert test_model.qs.order_by('-age')[:5].update(name='old', batch_size=2) == 5
+        assert test_model.qs.order_by('age')[1:4].delete(batch_size=2) == 3
+        assert [(person.age, person.name) for person in test_model.qs.order_by('age')] == [
+            (0, '0'), (4, '4'), (5, 'old'), (6, 'old'), (7, 'old'), (8, 'old'), (9, 'old'),
+        ]
+
+    def test_update_returning(self, test_model):
+        db = test_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('x', 3), ('y', 5), ('z', 1)])
+
+        qs = test_model.qs.filter(age__gte=3)
+        assert qs.update(age=F('age') + 1, returning=['pk', 'age']) == [{'pk': 1, 'age': 4}, {'pk': 2, 'age': 6}]
+
+        persons = test_model.qs.filter(name='z').update(name='claimed', returning=True)
+        assert [(person.pk, person.name, person.age) for person in persons] == [(3, 'claimed', 1)]
+
+        rows = test_model.qs.update(age=0, batch_size=2, returning=['name'])
+        assert sorted(row['name'] for row in rows) == ['claimed', 'x', 'y']
+
+    def test_delete_returning(self, test_model):
+        db = test_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('x', 3), ('y', 5), ('z', 1)])
+
+        persons = test_model.qs.filter(age__lt=5).delete(returning=True)
+        assert sorted((person.pk, person.name) for person in persons) == [(1, 'x'), (3, 'z')]
+
+        assert test_model.qs.delete(batch_size=1, returning=['name']) == [{'name': 'y'}]
+        assert not test_model.qs.exists()
+
+    def test_returning_not_supported(self, test_model, mocker):
+        mocker.patch.object(type(test_model._meta.db.spec), 'supports_returning', False)
+
+        with pytest.raises(ValueError, match='RETURNING'):
+            test_model.qs.delete(returning=['name'])
+
+        assert test_model.qs.delete() == 0
+
+    def test_select_for_update_render(self, related_models, mocker):
+        model_with_fk, external_model = related_models
+        db = external_model._meta.db
+        mocker.patch.object(db.spec, 'SUPPORTS_SELECT_FOR_UPDATE', True)
+
+        qs = model_with_fk.qs.filter(title='a').order_by('id')[:2].select_for_update(skip_locked=True, of=['self'])
+        assert qs.query.render_sql(db.spec) == (
+            'SELECT book.title, book.person_id, book.id FROM book WHERE book.title = ? '
+            'ORDER BY book.id ASC LIMIT 2 FOR UPDATE OF book SKIP LOCKED;'
+        )
+
+        qs = model_with_fk.qs.select_for_update(nowait=True, of=['author'])
+        assert qs.query.render_sql(db.spec) == (
+            'SELECT book.title, book.person_id, book.id FROM book '
+            'INNER JOIN person T11 ON T11.id = book.person_id FOR UPDATE OF T11 NOWAIT;'
+        )
+        assert str(qs.query) == (
+            'SELECT book.title, book.person_id, book.id FROM book INNER JOIN person T11 ON T11.id = book.person_id'
+        )
+
+        with pytest.raises(ValueError, match='together'):
+            model_with_fk.qs.select_for_update(skip_locked=True, nowait=True)
+
+        with pytest.raises(ValueError):
+            model_with_fk.qs.select_for_update(of=['title'])
+
+    def test_select_for_update_transaction(self, test_model):
+        test_model.qs.create(name='x', age=3)
+        qs = test_model.qs.select_for_update(skip_locked=True)
+        assert qs.query.render_sql(test_model._meta.db.spec) == (
+            'SELECT person.name, person.age, person.id FROM person;'
+        )
+
+        with pytest.raises(transaction.TransactionError, match='inside atomic block'):
+            list(qs)
+
+        with transaction.atomic():
+            with pytest.raises(transaction.TransactionError, match='immediate'):
+                list(qs)
+
+        with transaction.atomic(immediate=True):
+            person = qs.get()
+            test_model.qs.filter(pk=person.pk).update(age=4)
+        assert test_model.qs.get().age == 4
+
+    def test_search(self, related_models):
+        model_with_fk, external_model = related_models
+
+        class Message(Model):
+            subject = CharField(max_length=120)
+            body = CharField(max_length=255, null=True)
+            author = ForeignKey(external_model, null=True)
+
+            class Meta:
+                db = external_model._meta.db
+                search_fields = ('subject', 'body')
+
+        Message.create_table()
+        author = external_model.qs.create(name='Roland', age=40)
+        first = Message.qs.create(
+            subject='The Dark Tower', body='The man in black fled across the desert', author=author,
+        )
+        second = Message.qs.create(subject='Tower', body='dark, dark, dark tower')
+        Message.qs.create(subject='Gunslinger', body=None)
+
+        qs = Message.qs.filter(search='tower dark')
+        assert str(qs._where) == 'message.id IN (SELECT rowid FROM message_fts WHERE message_fts MATCH {0})'
+        assert qs._where.values() == ('"tower" "dark"',)
+        assert {message.pk for message in qs} == {first.pk, second.pk}
+        assert [message.pk for message in Message.qs.filter(search='black" (')] == [first.pk]
+
+        ranked = list(Message.qs.search('dark tower'))
+        assert [message.pk for message in ranked] == [second.pk, first.pk]
+        assert ranked[0].rank > ranked[1].rank > 0
+        assert Message.qs.search('dark tower', rank='score').values('subject')[:1].fetch() == [
+            {'subject': 'Tower', 'score': ranked[0].rank},
+        ]
+        assert Message.qs.search('dark').filter(author__name='Roland').get().pk == first.pk
+
+        # index is kept in sync with rows:
+        Message.qs.filter(pk=second.pk).update(body='nothing')
+        Message.qs.filter(pk=first.pk).delete()
+        assert list(Message.qs.filter(search='dark')) == []
+        assert Message.qs.search('tower').get().pk == second.pk
+        assert Message.qs.search('tower').exists()
+
+        assert external_model.qs.filter(message_set__search='gunslinger').exists() is False
+        with pytest.raises(ValueError, match='search fields'):
+            external_model.qs.search('Roland')
+
+        Message.drop_table()
+
+    def test_raw(self, related_models, mocker):
+        book_model, person_model = related_models
+        db = person_model._meta.db
+        with db.cursor() as c:
+            c.executemany('INSERT INTO person (name, age) VALUES (?, ?);', [('x', 3), ('y', 6)])
+            c.executemany('INSERT INTO book (title, person_id) VALUES (?, ?);', [('a', 1), ('b', 1), ('c', 2)])
+
+        cursor_spy = mocker.spy(db, 'cursor')
+        persons = person_model.qs.raw(
+            'SELECT person.id, name, COUNT(book.id) AS books_number FROM person '
+            'JOIN book ON book.person_id = person.id WHERE age > ? GROUP BY person.id ORDER BY person.id;',
+            (0,),
+        )
+        assert cursor_spy.call_count == 0
+
+        results = list(persons)
+        assert [(person.pk, person.name, person.age, person.books_number) for person in results] == [
+            (1, 'x', None, 2),
+            (2, 'y', None, 1),
+        ]
+        assert len(persons) == 2
+        assert persons[1].name == 'y'
+        assert cursor_spy.call_count == 1
+
+        books = list(book_model.qs.raw('SELECT id, title, person_id FROM book ORDER BY id;').iterator())
+        assert [book.author_id for book in books] == [1, 1, 2]
+        assert books[2].author.name == 'y'
+
+    def test_raw_compact_annotations(self, test_db):
+        class Event(Model):
+            name = CharField(max_length=50)
+
+            class Meta:
+                db = test_db
+                compact = True
+
+        Event.create_table()
+        try:
+            Event.qs.create(name='x')
+            assert [event.name for event in Event.qs.raw('SELECT * FROM event;')] == ['x']
+            with pytest.raises(ValueError, match='extra attributes: upper_name'):
+                list(Event.qs.raw('SELECT id, UPPER(name) AS upper_name FROM event;'))
+        finally:
+            Event.drop_table()
+
+    def test_sharded_filter_by_shard_key(self, sharded_model, mocker):
+        shard_b = sharded_model._meta.db.get_shard('b')
+        sharded_model.qs.bulk_create([sharded_model(tenant_id=i, title=f'order {i}') for i in range(6)])
+
+        cursor_spy = mocker.spy(shard_b, 'cursor')
+        assert [order.title for order in sharded_model.qs.filter(tenant_id=3)] == ['order 3']
+        assert cursor_spy.call_count == 1
+        assert sharded_model.qs.get(tenant_id=5, title='order 5').tenant_id == 5
+        assert sharded_model.qs.filter(tenant_id=1).update(title='updated') == 1
+        assert sharded_model.qs.filter(tenant_id=4).delete() == 1
+        assert sharded_model.qs.filter(title='order 0').update(title='first', returning=['tenant_id']) == [
+            {'tenant_id': 0},
+        ]
+        assert [order.title for order in sharded_model.qs.using('b').order_by('tenant_id')] == [
+            'updated', 'order 3', 'order 5',
+        ]
+
+    def test_sharded_fan_out(self, sharded_model):
+        sharded_model.qs.bulk_create([sharded_model(tenant_id=i, title=f'order {i}') for i in range(10)])
+
+        qs = sharded_model.qs.filter(tenant_id__gte=2)
+        assert len(qs) == 8
+        assert [order.tenant_id for order in qs.order_by('-tenant_id')[1:4]] == [8, 7, 6]
+        assert [row['tenant_id'] for row in qs.order_by('tenant_id').values('tenant_id')[:3]] == [2, 3, 4]
+        assert qs.aswell(tenant_id=0).exists()
+        assert qs.filter(title='order 1').first() is None
+        assert qs.delete() == 8
+        assert sorted(order.tenant_id for order in sharded_model.qs.all()) == [0, 1]
+
+        with pytest.raises(ValueError, match='should be selected'):
+            list(sharded_model.qs.order_by('title').values('tenant_id'))
+
+    def test_using(self, sharded_model, test_model):
+        with pytest.raises(ValueError, match='Unknown shard'):
+            sharded_model.qs.using('c')
+        with pytest.raises(ValueError, match='not sharded'):
+            test_model.qs.using('a')
+        with pytest.raises(ValueError, match='should be specified'):
+            sharded_model.qs.raw('SELECT * FROM purchase;')
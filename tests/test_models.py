@@ -1,6 +1,10 @@
+from datetime import datetime
+
 import pytest
 
-from minorm.fields import AutoField, CharField, IntegerField
+from minorm.exceptions import VersionConflict
+from minorm.expressions import F
+from minorm.fields import AutoField, CharField, DateTimeField, ForeignKey, IntegerField, ReverseRelation, VersionField
 from minorm.managers import QuerySet
 from minorm.models import Model, ModelSetupError
 
@@ -34,6 +38,113 @@ class TestModel:
                     table_name = 'test_model_table'
                     db = test_db
 
+    def test_new_reverse_relation(self, test_db):
+        class Author(Model):
+            name = CharField(max_length=120)
+
+        class Post(Model):
+            author = ForeignKey(Author)
+            editor = ForeignKey(Author, column_name='editor_id')
+            reviewer = ForeignKey(Author, column_name='reviewer_id', related_name='reviewed_posts')
+
+        assert isinstance(Author.post_set, ReverseRelation)
+        assert Author.post_set.fk_field is Post._meta.get_field('author')  # first relation takes implicit name
+        assert Author._meta.get_reverse_relation('reviewed_posts').fk_field is Post._meta.get_field('reviewer')
+
+        with pytest.raises(ModelSetupError, match=r'.*reviewed_posts.*'):
+            class Comment(Model):
+                reviewer = ForeignKey(Author, related_name='reviewed_posts')
+
+    def test_new_search_fields(self, test_db):
+        class Post(Model):
+            title = CharField(max_length=120)
+            body = CharField(max_length=255)
+
+            class Meta:
+                search_fields = ('title', 'body')
+
+        assert Post._meta.search_fields == [Post._meta.get_field('title'), Post._meta.get_field('body')]
+
+        with pytest.raises(ModelSetupError, match='Search fields'):
+            class Comment(Model):
+                body = CharField(max_length=255)
+
+                class Meta:
+                    search_fields = ('text',)
+
+    def test_new_partition_by(self, test_db):
+        class Event(Model):
+            kind = CharField(max_length=20)
+
+            class Meta:
+                partition_by = ('list', 'kind')
+
+        assert Event._meta.partition_method == 'LIST'
+        assert Event._meta.partition_key is Event._meta.get_field('kind')
+
+        with pytest.raises(ModelSetupError, match='method'):
+            class Log(Model):
+                kind = CharField(max_length=20)
+
+                class Meta:
+                    partition_by = ('tree', 'kind')
+
+        with pytest.raises(ModelSetupError, match='field name'):
+            class Report(Model):
+                kind = CharField(max_length=20)
+
+                class Meta:
+                    partition_by = ('hash', 'type')
+
+    def test_new_compact(self, test_db):
+        class Author(Model):
+            name = CharField(max_length=120)
+
+            class Meta:
+                compact = True
+
+        class Post(Model):
+            title = CharField(max_length=120)
+            author = ForeignKey(Author)
+
+            class Meta:
+                compact = True
+
+        assert Post._meta.compact
+        assert Post.__slots__ == ('_prefetched_relations', 'id', 'title', 'author_id', '_author_cached')
+        assert Post._meta.get_field('title').model is Post
+        assert Post._meta.get_field('title').name == 'title'
+
+        author = Author(name='Steven')
+        post = Post(title='foo', author=author)
+        assert not hasattr(post, '__dict__')
+        assert post.title == 'foo'
+        assert post.author is author
+
+        with pytest.raises(AttributeError):
+            post.foo = 'bar'
+
+    def test_hydrate(self, test_db):
+        class Author(Model):
+            name = CharField(max_length=120)
+
+            class Meta:
+                compact = True
+
+        class Post(Model):
+            title = CharField(max_length=120)
+            author = ForeignKey(Author)
+
+        author = Author.hydrate(('Steven', 1))
+        assert isinstance(author, Author)
+        assert author.name == 'Steven'
+        assert author.pk == 1
+
+        post = Post.hydrate(('foo', 1, 2))
+        assert post.title == 'foo'
+        assert post.author_id == 1
+        assert post.pk == 2
+
     def test_qs(self):
         class Person(Model):
             name = CharField(max_length=255)
@@ -140,6 +251,34 @@ class TestModel:
         assert instance.pk == 1
         assert instance.age == 42
 
+    def test_save_returning(self, test_db, mocker):
+
+        class Event(Model):
+            title = CharField(max_length=50)
+            status = CharField(max_length=20, db_default="'new'")
+            created = DateTimeField(db_default='CURRENT_TIMESTAMP')
+
+        Event.create_table()
+        statements = []
+        test_db.connection.set_trace_callback(statements.append)
+
+        event = Event(title='foo')
+        event.save()
+        assert statements == ["INSERT INTO event (title) VALUES ('foo') RETURNING status, created, id;"]
+        assert (event.pk, event.status) == (1, 'new')
+        assert isinstance(event.created, datetime)
+
+        event = Event(title='bar', status='done')
+        event.save()
+        assert (event.pk, event.status) == (2, 'done')
+
+        mocker.patch.object(type(test_db.spec), 'supports_returning', False)
+        event = Event(title='baz')
+        event.save()
+        assert (event.pk, event.status, event.created) == (3, None, None)
+        event.refresh_from_db()
+        assert event.status == 'new'
+
     def test_save_update(self, test_model):
         prev_instance = test_model(name="john", age=33)
         prev_instance.save()
@@ -163,6 +302,56 @@ class TestModel:
         assert new_row[0] == 'steven'
         assert new_row[1] == 20
 
+    def test_save_update_fields(self, test_model):
+        instance = test_model(name="john", age=33)
+        instance.save()
+
+        with pytest.raises(ValueError, match='without pk'):
+            test_model(name="steven", age=19).save(update_fields=['age'])
+
+        instance.name = 'steven'
+        instance.age = F('age') + 1
+        instance.save(update_fields=['age'])
+        instance.refresh_from_db()
+        assert (instance.name, instance.age) == ('john', 34)
+
+        with pytest.raises(ValueError):
+            instance.save(update_fields=['id'])
+
+    def test_save_expression_on_create(self, test_model):
+        with pytest.raises(ValueError, match='new row'):
+            test_model(name="john", age=F('id')).save()
+
+    def test_save_version(self, test_db):
+        class Article(Model):
+            title = CharField(max_length=50)
+            version = VersionField()
+
+        Article.create_table()
+        article = Article(title='foo')
+        article.save()
+        assert article.version == 1
+
+        other_article = Article.qs.get(pk=article.pk)
+        article.title = 'bar'
+        article.save()
+        assert article.version == 2
+
+        other_article.title = 'baz'
+        with pytest.raises(VersionConflict, match='changed or deleted'):
+            other_article.save(update_fields=['title'])
+        assert other_article.version == 1
+
+        other_article.refresh_from_db()
+        other_article.title = 'baz'
+        other_article.save(update_fields=['title'])
+        assert (other_article.version, Article.qs.get().title) == (3, 'baz')
+
+        with pytest.raises(ModelSetupError, match='version'):
+            class Page(Model):
+                version = VersionField()
+                revision = VersionField()
+
     def test_save_with_fk(self, related_models):
         model_with_fk, external_model = related_models
 
@@ -177,6 +366,40 @@ class TestModel:
         assert book.author_id == author.pk
         assert book._author_cached is author
 
+    def test_reverse_relation(self, related_models):
+        model_with_fk, external_model = related_models
+
+        author = external_model.qs.create(name='Steven', age=19)
+        other_author = external_model.qs.create(name='Mark', age=42)
+        model_with_fk.qs.create(title='foo', author=author)
+        model_with_fk.qs.create(title='bar', author=other_author)
+        model_with_fk.qs.create(title='baz', author=author)
+
+        books = author.book_set
+        assert isinstance(books, QuerySet)
+        assert [book.title for book in books] == ['foo', 'baz']
+        assert [book.title for book in books.filter(title='baz')] == ['baz']
+
+    def test_save_compact(self, test_db):
+        class Person(Model):
+            name = CharField(max_length=120)
+            age = IntegerField()
+
+            class Meta:
+                compact = True
+
+        Person.create_table()
+        instance = Person(name="john", age=33)
+        instance.save()
+        assert instance.pk == 1
+
+        instance.age = 34
+        instance.save()
+        Person.qs.filter(id=instance.pk).update(name='foobar')
+        instance.refresh_from_db()
+        assert instance.name == 'foobar'
+        assert instance.age == 34
+
     def test_refresh_from_db(self, test_model):
         instance = test_model(name="john", age=33)
         instance.save()
@@ -196,3 +419,23 @@ class TestModel:
         assert result == 1
         assert not instance.pk
         assert not test_model.qs.filter(id=instance_id).exists()
+
+
+def test_save_sharded(sharded_model):
+    order = sharded_model(tenant_id=3, title='foo')
+    order.save()
+
+    assert sharded_model.qs.using('b').get(pk=order.pk).title == 'foo'
+    assert not sharded_model.qs.using('a').exists()
+
+    order.title = 'bar'
+    order.save()
+    order.refresh_from_db()
+    assert order.title == 'bar'
+
+    other_order = sharded_model(tenant_id=2, title='baz')
+    other_order.save(using='b')
+    assert len(sharded_model.qs.using('b')) == 2
+
+    assert order.delete() == 1
+    assert len(sharded_model.qs.using('b')) == 1
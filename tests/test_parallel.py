@@ -0,0 +1,104 @@
+import sqlite3
+import time
+
+import pytest
+
+from minorm.connectors import ConnectionPool, Connector
+from minorm.db_specs import SQLiteSpec
+from minorm.exceptions import QueryTimeout
+from minorm.fields import CharField, IntegerField
+from minorm.models import Model
+from minorm.parallel import ParallelExecutor
+
+SLOW_QUERY = (
+    'WITH RECURSIVE counter(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM counter WHERE x < 1000000000) '
+    'SELECT MAX(x) AS id FROM counter;'
+)
+
+
+@pytest.fixture
+def shared_db():
+    # pooled connections should see the same in-memory db, so it's opened with shared cache:
+    db = Connector().connect(SQLiteSpec('parallel_test?mode=memory', shared_cache=True, check_same_thread=False))
+    yield db
+    db.disconnect()
+
+
+@pytest.fixture
+def person_model(shared_db):
+    class Person(Model):
+        name = CharField(max_length=50)
+        age = IntegerField()
+
+        class Meta:
+            db = shared_db
+
+    Person.create_table()
+    Person.qs.bulk_create([Person(name=name, age=age) for name, age in [('x', 3), ('y', 6), ('z', 9)]])
+    yield Person
+    Person.drop_table()
+
+
+@pytest.fixture
+def executor():
+    executor = ParallelExecutor(max_workers=2)
+    yield executor
+    executor.close()
+
+
+def test_gather(person_model, executor, mocker):
+    cursor_spy = mocker.spy(person_model._meta.db, 'cursor')
+    acquire_spy = mocker.spy(ConnectionPool, 'acquire')
+
+    young, names, everyone = executor.gather(
+        person_model.qs.filter(age__lt=5),
+        person_model.qs.order_by('-name').values('name'),
+        person_model.qs.raw('SELECT * FROM person;'),
+    )
+
+    assert [person.name for person in young] == ['x']
+    assert names == [{'name': 'z'}, {'name': 'y'}, {'name': 'x'}]
+    assert len(everyone) == 3
+    assert acquire_spy.call_count == 3
+    assert cursor_spy.call_count == 0  # queries are performed on pooled connections
+
+
+def test_gather_timeout(person_model, executor):
+    started = time.monotonic()
+    with pytest.raises(QueryTimeout):
+        executor.gather(person_model.qs.all(), person_model.qs.raw(SLOW_QUERY), timeout=0.2)
+    assert time.monotonic() - started < 5  # slow query is interrupted
+
+    assert len(executor.gather(person_model.qs.all())[0]) == 3  # pooled connection is still usable
+
+
+def test_gather_statement_timeout(person_model, executor):
+    person_model._meta.db.statement_timeout = 0.2
+    with pytest.raises(QueryTimeout):
+        executor.gather(person_model.qs.raw(SLOW_QUERY))  # pooled connections have timeout of the connector
+
+
+def test_gather_error(person_model, executor):
+    with pytest.raises(sqlite3.OperationalError, match='no such table'):
+        executor.gather(person_model.qs.raw(SLOW_QUERY), person_model.qs.raw('SELECT * FROM foo;'))
+
+
+def test_gather_file_db(tmp_path):
+    # connections of the pool are used by different threads, even if db is opened with default options:
+    file_db = Connector().connect(SQLiteSpec(str(tmp_path / 'parallel_test.db')))
+
+    class Metric(Model):
+        value = IntegerField()
+
+        class Meta:
+            db = file_db
+
+    Metric.create_table()
+    Metric.qs.bulk_create([Metric(value=value) for value in range(10)])
+
+    executor = ParallelExecutor(max_workers=3)
+    for __ in range(5):
+        results = executor.gather(*[Metric.qs.filter(value__gte=value) for value in range(6)])
+        assert [len(rows) for rows in results] == [10, 9, 8, 7, 6, 5]
+    executor.close()
+    file_db.disconnect()
@@ -0,0 +1,251 @@
+import pytest
+
+from minorm import transaction
+from datetime import date
+
+from minorm.fields import CharField, DateField, IntegerField
+from minorm.models import Model
+from minorm.queries import CreateIndexQuery, CreateTableQuery
+from minorm.schema import (
+    SchemaError,
+    attach_partition,
+    create_partition,
+    create_table_query,
+    detach_partition,
+    diff,
+    drop_partition,
+    get_table_columns,
+    get_table_indexes,
+    migrate,
+)
+
+
+@pytest.fixture
+def person_table(test_db):
+    with test_db.cursor() as curr:
+        curr.execute('CREATE TABLE person (id INTEGER PRIMARY KEY AUTOINCREMENT, name VARCHAR(50) NOT NULL);')
+    yield test_db
+    with test_db.cursor() as curr:
+        curr.execute('DROP TABLE person;')
+
+
+def render(queries):
+    return [query.render_sql() for query in queries]
+
+
+def test_diff_create_table(test_db):
+    class Person(Model):
+        name = CharField(max_length=50, index=True)
+
+        class Meta:
+            db = test_db
+
+    queries = diff(Person)
+    assert isinstance(queries[0], CreateTableQuery)
+    assert render(queries)[1:] == ['CREATE INDEX person_name_idx ON person (name);']
+
+
+def test_diff_no_changes(test_model):
+    assert diff(test_model) == []
+
+
+def test_diff_add_columns(person_table):
+    class Person(Model):
+        name = CharField(max_length=50)
+        age = IntegerField(null=True, index=True)
+        score = IntegerField(default=0)
+        email = CharField(max_length=50, null=True, unique=True)
+
+        class Meta:
+            db = person_table
+
+    assert render(diff(Person)) == [
+        'ALTER TABLE person ADD COLUMN age INTEGER;',
+        'ALTER TABLE person ADD COLUMN score INTEGER NOT NULL DEFAULT 0;',
+        'ALTER TABLE person ADD COLUMN email VARCHAR(50);',
+        'CREATE INDEX person_age_idx ON person (age);',
+        'CREATE UNIQUE INDEX person_email_uniq ON person (email);',
+    ]
+
+
+def test_diff_add_not_null_column_without_default(person_table):
+    class Person(Model):
+        name = CharField(max_length=50)
+        age = IntegerField()
+
+        class Meta:
+            db = person_table
+
+    with pytest.raises(SchemaError, match='age is not nullable'):
+        diff(Person)
+
+
+def test_diff_add_column_with_db_default(person_table):
+    class Person(Model):
+        name = CharField(max_length=50)
+        age = IntegerField(db_default='0')
+
+        class Meta:
+            db = person_table
+
+    assert render(diff(Person)) == ['ALTER TABLE person ADD COLUMN age INTEGER NOT NULL DEFAULT 0;']
+
+
+def test_diff_change_null_not_supported(person_table):
+    class Person(Model):
+        name = CharField(max_length=50, null=True)
+
+        class Meta:
+            db = person_table
+
+    with pytest.raises(SchemaError, match='person.name nullability'):
+        diff(Person)
+
+
+def test_diff_change_null(person_table, mocker):
+    class Person(Model):
+        name = CharField(max_length=50, null=True)
+
+        class Meta:
+            db = person_table
+
+    mocker.patch.object(person_table.spec, 'SUPPORTS_ALTER_COLUMN', True)
+    assert render(diff(Person)) == ['ALTER TABLE person ALTER COLUMN name DROP NOT NULL;']
+
+
+def test_diff_drop(person_table):
+    with person_table.cursor() as curr:
+        curr.execute('ALTER TABLE person ADD COLUMN age INTEGER;')
+        curr.execute('CREATE INDEX person_age_idx ON person (age);')
+        curr.execute('CREATE INDEX custom_name_index ON person (name);')
+
+    class Person(Model):
+        name = CharField(max_length=50)
+
+        class Meta:
+            db = person_table
+
+    assert diff(Person) == []
+    assert render(diff(Person, drop=True)) == [
+        'DROP INDEX person_age_idx;',
+        'ALTER TABLE person DROP COLUMN age;',
+    ]
+
+
+def test_diff_concurrent_index(person_table, mocker):
+    class Person(Model):
+        name = CharField(max_length=50, index=True)
+
+        class Meta:
+            db = person_table
+
+    mocker.patch.object(person_table.spec, 'SUPPORTS_CONCURRENT_INDEX', True)
+    queries = diff(Person)
+    assert render(queries) == ['CREATE INDEX CONCURRENTLY person_name_idx ON person (name);']
+
+    with transaction.atomic(db=person_table):
+        with pytest.raises(SchemaError, match='inside a transaction'):
+            migrate(Person)
+
+
+@pytest.fixture
+def partitioned_model(test_db):
+    class Event(Model):
+        title = CharField(max_length=50)
+        created = DateField(index=True)
+
+        class Meta:
+            db = test_db
+            partition_by = ('range', 'created')
+
+    return Event
+
+
+def test_create_table_query_partitioned(partitioned_model, mocker):
+    db = partitioned_model._meta.db
+    assert create_table_query(partitioned_model, db).render_sql() == (
+        'CREATE TABLE event (title VARCHAR(50) NOT NULL, created DATE NOT NULL, '
+        'id INTEGER PRIMARY KEY AUTOINCREMENT);'
+    )
+
+    mocker.patch.object(db.spec, 'SUPPORTS_PARTITIONING', True)
+    mocker.patch.object(db.spec, 'SUPPORTS_CONCURRENT_INDEX', True)
+    assert create_table_query(partitioned_model, db).render_sql() == (
+        'CREATE TABLE event (title VARCHAR(50) NOT NULL, created DATE NOT NULL, '
+        'id INTEGER AUTOINCREMENT, PRIMARY KEY (id, created)) PARTITION BY RANGE (created);'
+    )
+    assert render(diff(partitioned_model))[1:] == ['CREATE INDEX event_created_idx ON event (created);']
+
+
+def test_partitions(partitioned_model, test_model, mocker):
+    db = partitioned_model._meta.db
+    with pytest.raises(SchemaError, match='partitioning'):
+        create_partition(partitioned_model, 'event_2024', start=date(2024, 1, 1), end=date(2025, 1, 1))
+
+    mocker.patch.object(db.spec, 'SUPPORTS_PARTITIONING', True)
+    cursor = mocker.patch.object(db, 'cursor').return_value.__enter__.return_value
+
+    create_partition(partitioned_model, 'event_2024', start='2024-01-01', end=date(2025, 1, 1))
+    create_partition(partitioned_model, 'event_old', end=date(2024, 1, 1))
+    attach_partition(partitioned_model, 'event_rest', default=True)
+    detach_partition(partitioned_model, 'event_old', concurrently=True)
+    drop_partition(partitioned_model, 'event_old')
+    assert [call[0][0] for call in cursor.execute.call_args_list] == [
+        "CREATE TABLE event_2024 PARTITION OF event FOR VALUES FROM ('2024-01-01') TO ('2025-01-01');",
+        "CREATE TABLE event_old PARTITION OF event FOR VALUES FROM (MINVALUE) TO ('2024-01-01');",
+        'ALTER TABLE event ATTACH PARTITION event_rest DEFAULT;',
+        'ALTER TABLE event DETACH PARTITION event_old CONCURRENTLY;',
+        'DROP TABLE event_old;',
+    ]
+
+    with pytest.raises(ValueError, match='start or end'):
+        create_partition(partitioned_model, 'event_all')
+    with pytest.raises(SchemaError, match='not partitioned'):
+        drop_partition(test_model, 'person_old')
+
+
+def test_diff_search_index(person_table):
+    class Person(Model):
+        name = CharField(max_length=50)
+
+        class Meta:
+            db = person_table
+            search_fields = ('name',)
+
+    queries = diff(Person)
+    assert render(queries)[0] == (
+        "CREATE VIRTUAL TABLE person_fts USING fts5(name, content='person', content_rowid='id');"
+    )
+    assert render(queries)[-1] == "INSERT INTO person_fts (person_fts) VALUES ('rebuild');"
+
+    with person_table.cursor() as curr:
+        curr.execute("INSERT INTO person (name) VALUES ('John Smith');")
+    migrate(Person)
+    assert diff(Person, drop=True) == []
+    assert Person.qs.filter(search='smith').get().name == 'John Smith'
+    Person.drop_table()
+    assert not person_table.spec.has_search_index(person_table.connection, 'person')
+    Person.create_table()  # table is dropped by fixture
+
+
+def test_migrate(person_table):
+    class Person(Model):
+        name = CharField(max_length=50, unique=True)
+        age = IntegerField(null=True, index=True)
+
+        class Meta:
+            db = person_table
+
+    queries = migrate(Person)
+    assert len(queries) == 3
+    assert isinstance(queries[-1], CreateIndexQuery)
+    assert [column.name for column in get_table_columns('person', person_table)] == ['id', 'name', 'age']
+    assert {(index.columns, index.unique) for index in get_table_indexes('person', person_table)} == {
+        (('name',), True), (('age',), False),
+    }
+    assert migrate(Person) == []
+
+
+def test_migrate_sharded(sharded_model):
+    assert migrate(sharded_model) == []
+    assert diff(sharded_model, db=sharded_model._meta.db.get_shard('b')) == []
@@ -1,6 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
 import sqlite3
 
-from minorm.db_specs import SQLiteSpec
+import pytest
+
+from minorm.db_specs import PostgreSQLSpec, SQLiteSpec
+from minorm.fields import BooleanField, CharField, DateField, DecimalField, IntegerField
+from minorm.schema import ColumnInfo, IndexInfo
 
 
 class TestSQLiteSpec:
@@ -26,3 +33,144 @@ class TestSQLiteSpec:
     def test_auto_field_constrains(self):
         db_spec = SQLiteSpec("")
         assert db_spec.auto_field_constrains == ('AUTOINCREMENT',)
+
+    def test_create_connection_pragmas(self, tmp_path):
+        db_spec = SQLiteSpec(str(tmp_path / 'test.db'), pragmas=SQLiteSpec.HIGH_THROUGHPUT_PRAGMAS)
+        conn = db_spec.create_connection()
+
+        assert conn.execute('PRAGMA journal_mode;').fetchone() == ('wal', )
+        assert conn.execute('PRAGMA synchronous;').fetchone() == (1, )  # NORMAL
+        assert conn.execute('PRAGMA cache_size;').fetchone() == (-64000, )
+        assert conn.execute('PRAGMA temp_store;').fetchone() == (2, )  # MEMORY
+        assert conn.execute('PRAGMA busy_timeout;').fetchone() == (5000, )
+
+    @pytest.mark.parametrize('pragmas', [
+        {'synchronous; DROP TABLE foo': 'OFF'},
+        {'synchronous': 'OFF; DROP TABLE foo'},
+    ])
+    def test_invalid_pragmas(self, pragmas):
+        with pytest.raises(ValueError, match=r'.*pragma.*'):
+            SQLiteSpec(":memory:", pragmas=pragmas)
+
+    def test_create_connection_shared_cache(self):
+        db_spec = SQLiteSpec(":memory:", shared_cache=True)
+        assert db_spec.database_uri == 'file::memory:?cache=shared'
+
+        conn1 = db_spec.create_connection()
+        conn2 = db_spec.create_connection()
+        conn1.execute('CREATE TABLE foo (x INTEGER);')
+        assert conn2.execute('SELECT COUNT(*) FROM foo;').fetchone() == (0, )
+
+    def test_database_uri(self):
+        db_spec = SQLiteSpec("file:test.db?mode=ro", uri=True, shared_cache=True)
+        assert db_spec.database_uri == 'file:test.db?mode=ro&cache=shared'
+
+    def test_create_connection_cached_statements(self, mocker):
+        connect = mocker.patch.object(sqlite3, 'connect', wraps=sqlite3.connect)
+        SQLiteSpec(":memory:", cached_statements=512).create_connection()
+
+        assert connect.call_args[1]['cached_statements'] == 512
+
+    def test_create_connection_check_same_thread(self):
+        conn = SQLiteSpec(":memory:", check_same_thread=False).create_connection()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(lambda: conn.execute('SELECT 1;').fetchone()).result() == (1,)
+
+    def test_get_row_converter(self):
+        db_spec = SQLiteSpec(":memory:")
+        fields = [IntegerField(), DecimalField(max_digits=5, decimal_places=2), DateField(), BooleanField()]
+
+        convert_row = db_spec.get_row_converter(fields)
+        assert convert_row((1, 2.5, '2021-02-03', 1)) == [1, Decimal('2.5'), date(2021, 2, 3), True]
+        assert convert_row((1, None, None, 0)) == [1, None, None, False]
+
+    def test_get_row_converter_no_conversion(self):
+        db_spec = SQLiteSpec(":memory:")
+        assert db_spec.get_row_converter([IntegerField(), CharField(max_length=10)]) is None
+
+    def test_get_row_converter_driver_converts_results(self, mocker):
+        db_spec = SQLiteSpec(":memory:")
+        mocker.patch.object(db_spec, 'CONVERTS_RESULTS', True)
+        assert db_spec.get_row_converter([DateField(), BooleanField()]) is None
+
+    def test_supports_returning(self, mocker):
+        db_spec = SQLiteSpec(":memory:")
+        mocker.patch.object(sqlite3, 'sqlite_version_info', (3, 35, 0))
+        assert db_spec.supports_returning
+
+        mocker.patch.object(sqlite3, 'sqlite_version_info', (3, 31, 1))
+        assert not db_spec.supports_returning
+
+    def test_get_table_columns(self):
+        db_spec = SQLiteSpec(":memory:")
+        conn = db_spec.create_connection()
+        conn.execute('CREATE TABLE foo (id INTEGER PRIMARY KEY, name VARCHAR(20) NOT NULL, age INTEGER);')
+
+        assert db_spec.get_table_columns(conn, 'foo') == [
+            ColumnInfo(name='id', sql_type='INTEGER', null=True, pk=True),
+            ColumnInfo(name='name', sql_type='VARCHAR(20)', null=False, pk=False),
+            ColumnInfo(name='age', sql_type='INTEGER', null=True, pk=False),
+        ]
+        assert db_spec.get_table_columns(conn, 'bar') == []
+
+    def test_get_table_indexes(self):
+        db_spec = SQLiteSpec(":memory:")
+        conn = db_spec.create_connection()
+        conn.execute('CREATE TABLE foo (id INTEGER PRIMARY KEY, name VARCHAR(20), age INTEGER);')
+        conn.execute('CREATE UNIQUE INDEX foo_name_age ON foo (name, age);')
+
+        assert db_spec.get_table_indexes(conn, 'foo') == [
+            IndexInfo(name='foo_name_age', columns=('name', 'age'), unique=True),
+        ]
+
+    def test_prepare_search_query(self):
+        db_spec = SQLiteSpec(":memory:")
+        assert db_spec.prepare_search_query('dark "tower" OR - NEAR(') == '"dark" """tower""" "OR" "NEAR("'
+        assert db_spec.prepare_search_query(' - ') == '""'
+
+
+class TestPostgreSQLSpec:
+
+    def test_search_queries(self, mocker):
+        mocker.patch.object(PostgreSQLSpec, 'prepare_db_driver')
+        db_spec = PostgreSQLSpec('')
+
+        assert db_spec.get_search_index_queries('message', 'id', ['subject', 'body']) == [
+            "ALTER TABLE message ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+            "(to_tsvector('english', coalesce(subject, '') || ' ' || coalesce(body, ''))) STORED;",
+            'CREATE INDEX message_search_idx ON message USING GIN (search_vector);',
+        ]
+        assert db_spec.get_search_condition('message', 'T11', 'id') == (
+            'T11.search_vector', '@@', "plainto_tsquery('english', {0})",
+        )
+        assert db_spec.get_search_rank('message', 'message', 'id') == (
+            "ts_rank(message.search_vector, plainto_tsquery('english', {0}))"
+        )
+        assert db_spec.prepare_search_query('dark tower') == 'dark tower'
+
+    def test_statement_timeout(self, mocker):
+        driver = mocker.patch.object(PostgreSQLSpec, 'prepare_db_driver').return_value
+        db_spec = PostgreSQLSpec('')
+        connection = mocker.MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+
+        db_spec.set_statement_timeout(connection, 2.5)
+        cursor.execute.assert_called_once_with('SET statement_timeout = %s;', (2500, ))
+
+        cursor.reset_mock()
+        db_spec.reset_statement_timeout(connection)
+        cursor.execute.assert_called_once_with('SET statement_timeout = DEFAULT;')
+
+        cursor.reset_mock()
+        db_spec.reset_statement_timeout(connection, 5)  # the default of the connection is restored
+        cursor.execute.assert_called_once_with('SET statement_timeout = %s;', (5000, ))
+
+        cursor.reset_mock()
+        connection.get_transaction_status.return_value = driver.extensions.TRANSACTION_STATUS_INERROR
+        db_spec.reset_statement_timeout(connection)
+        cursor.execute.assert_not_called()
+
+        error = Exception()
+        error.pgcode = '57014'
+        assert db_spec.is_timeout_error(error)
+        assert not db_spec.is_timeout_error(Exception())
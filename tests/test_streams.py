@@ -0,0 +1,56 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from minorm.fields import BooleanField, CharField, DateField, DateTimeField, DecimalField, Field, IntegerField
+from minorm.streams import CSVRowStream, encode_csv_row, encode_csv_value, get_csv_encoder, get_json_encoder
+
+
+@pytest.mark.parametrize('value, expected_result', [
+    (None, ''),
+    ('', '""'),
+    ('foo, "bar"', '"foo, ""bar"""'),
+    (42, '42'),
+    (Decimal('1.50'), '1.50'),
+    (True, 'True'),
+    (date(2020, 11, 10), '2020-11-10'),
+])
+def test_encode_csv_value(value, expected_result):
+    assert encode_csv_value(value) == expected_result
+
+
+@pytest.mark.parametrize('field, value, expected_csv, expected_json', [
+    (CharField(max_length=10), 'a "b"', '"a ""b"""', '"a \\"b\\""'),
+    (CharField(max_length=10), None, '', 'null'),
+    (IntegerField(), 42, '42', '42'),
+    (DecimalField(max_digits=5, decimal_places=2), Decimal('1.50'), '1.50', '1.50'),
+    (BooleanField(), 1, 'true', 'true'),  # SQLite keeps booleans as integers
+    (BooleanField(), False, 'false', 'false'),
+    (DateField(), '2020-11-10', '2020-11-10', '"2020-11-10"'),  # SQLite keeps dates as strings
+    (DateField(), date(2020, 11, 10), '2020-11-10', '"2020-11-10"'),
+    (DateTimeField(), datetime(2020, 11, 10, 1, 2), '2020-11-10 01:02:00', '"2020-11-10 01:02:00"'),
+    (Field(), 0.5, '0.5', '0.5'),
+])
+def test_column_encoders(field, value, expected_csv, expected_json):
+    assert get_csv_encoder(field)(value) == expected_csv
+    assert get_json_encoder(field)(value) == expected_json
+
+
+def test_encode_csv_row():
+    assert encode_csv_row(('foo', None, 3)) == '"foo",,3\n'
+
+
+class TestCSVRowStream:
+
+    def test_read(self):
+        stream = CSVRowStream([('foo', 1), ('bar', None)])
+        assert stream.read() == '"foo",1\n"bar",\n'
+        assert stream.read() == ''
+
+    def test_read_size(self):
+        stream = CSVRowStream(iter([('foo', 1), ('bar', 2)]))
+        assert stream.read(3) == '"fo'
+        assert stream.read(6) == 'o",1\n"'
+        assert stream.read(100) == 'bar",2\n'
+        assert stream.read(100) == ''
@@ -1,4 +1,8 @@
+import pytest
+
 from minorm import transaction
+from minorm.connectors import Connector
+from minorm.db_specs import SQLiteSpec
 
 
 def test_rollback(test_model):
@@ -27,3 +31,115 @@ def test_commit(test_model):
     results = test_model.qs.fetch()
     assert len(results) == 1
     assert results[0].name == "foo"
+
+
+def test_atomic_exception(test_model):
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            test_model.qs.create(name="foo", age=10)
+            raise ValueError
+
+    assert not test_model.qs.exists()
+    assert test_model._meta.db._autocommit
+    assert not test_model._meta.db.in_atomic_block
+
+
+def test_atomic_nested(test_model):
+    with transaction.atomic():
+        test_model.qs.create(name="foo", age=10)
+        with pytest.raises(ValueError):
+            with transaction.atomic():
+                test_model.qs.create(name="bar", age=11)
+                raise ValueError
+        with transaction.atomic():
+            test_model.qs.create(name="baz", age=12)
+
+    assert [person.name for person in test_model.qs] == ["foo", "baz"]
+
+
+def test_atomic_immediate(test_model):
+    db = test_model._meta.db
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+
+    with transaction.atomic(immediate=True):
+        assert db.in_immediate_block
+        with transaction.atomic(immediate=True):
+            test_model.qs.create(name="foo", age=10)
+        transaction.commit()
+    assert not db.in_immediate_block
+    assert statements.count('BEGIN IMMEDIATE') == 2
+
+    with transaction.atomic():
+        with pytest.raises(transaction.TransactionError, match='Immediate'):
+            with transaction.atomic(immediate=True):
+                pass
+
+
+def test_atomic_nested_outer_rollback(test_model):
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            with transaction.atomic():  # savepoint is created before any data modification
+                test_model.qs.create(name="foo", age=10)
+            raise ValueError
+
+    assert not test_model.qs.exists()
+
+
+def test_atomic_db(test_model):
+    other_db = Connector().connect(SQLiteSpec(":memory:"))
+    try:
+        with transaction.atomic(db=other_db):
+            assert other_db.in_atomic_block
+            assert not test_model._meta.db.in_atomic_block
+    finally:
+        other_db.disconnect()
+
+
+def test_commit_nested(test_model):
+    with transaction.atomic():
+        with transaction.atomic():
+            with pytest.raises(transaction.TransactionError):
+                transaction.commit()
+            with pytest.raises(transaction.TransactionError):
+                transaction.rollback()
+
+
+def test_on_commit(test_model):
+    called = []
+
+    with transaction.atomic():
+        transaction.on_commit(lambda: called.append("foo"))
+        with transaction.atomic():
+            transaction.on_commit(lambda: called.append("bar"))
+        with pytest.raises(ValueError):
+            with transaction.atomic():
+                transaction.on_commit(lambda: called.append("baz"))
+                raise ValueError
+        assert not called
+
+    assert called == ["foo", "bar"]
+
+    transaction.on_commit(lambda: called.append("qux"))  # is called at once outside of atomic block
+    assert called == ["foo", "bar", "qux"]
+
+
+def test_on_commit_rollback(test_model):
+    called = []
+
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            transaction.on_commit(lambda: called.append("foo"))
+            raise ValueError
+
+    assert not called
+
+
+def test_batched(test_model, mocker):
+    commit_spy = mocker.spy(test_model._meta.db, 'end')
+
+    result = transaction.batched(lambda i: test_model.qs.create(name=str(i), age=i), range(5), batch_size=2)
+
+    assert result == 5
+    assert commit_spy.call_count == 3
+    assert len(test_model.qs) == 5
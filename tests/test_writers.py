@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+
+from minorm.connectors import Connector
+from minorm.db_specs import SQLiteSpec
+from minorm.fields import CharField, IntegerField
+from minorm.models import Model
+from minorm.writers import BufferedWriter, WriterError
+
+
+@pytest.fixture
+def file_db(tmp_path):
+    # the writer thread uses its own connection, so db should be shared between connections:
+    db = Connector().connect(SQLiteSpec(str(tmp_path / 'writer_test.db')))
+    yield db
+    db.disconnect()
+
+
+@pytest.fixture
+def metric_model(file_db):
+    class Metric(Model):
+        name = CharField(max_length=50)
+        value = IntegerField()
+
+        class Meta:
+            db = file_db
+
+    with file_db.cursor() as curr:
+        curr.execute('CREATE TABLE metric (name VARCHAR(50) NOT NULL, value INTEGER CHECK (value >= 0), '
+                     'id INTEGER PRIMARY KEY AUTOINCREMENT);')
+    yield Metric
+
+
+def test_buffered_writer(metric_model, mocker):
+    insert_spy = mocker.spy(BufferedWriter, '_insert')
+    with BufferedWriter(metric_model, max_rows=3, max_latency=60) as writer:
+        for i in range(7):
+            writer.write(metric_model(name=f'm{i}', value=i))
+        writer.flush()
+        assert metric_model.qs.order_by('id').values('name')[:3].fetch() == [
+            {'name': 'm0'}, {'name': 'm1'}, {'name': 'm2'},
+        ]
+        assert [len(call[0][2]) for call in insert_spy.call_args_list] == [3, 3, 1]
+
+        writer.write(metric_model(name='last', value=7))
+    assert len(metric_model.qs.all()) == 8  # rows are flushed on exit
+
+    with pytest.raises(WriterError, match='closed'):
+        writer.write(metric_model(name='late', value=8))
+
+
+def test_buffered_writer_db_default(file_db):
+    class Task(Model):
+        title = CharField(max_length=50)
+        status = CharField(max_length=20, db_default="'new'")
+
+        class Meta:
+            db = file_db
+
+    with file_db.cursor() as curr:
+        curr.execute("CREATE TABLE task (title VARCHAR(50) NOT NULL, status VARCHAR(20) NOT NULL DEFAULT 'new', "
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT);")
+
+    with BufferedWriter(Task, max_rows=3) as writer:
+        writer.write(Task(title='a'))
+        writer.write(Task(title='b', status='done'))
+        writer.write(Task(title='c'))
+        writer.flush()
+    assert Task.qs.order_by('title').values('title', 'status').fetch() == [
+        {'title': 'a', 'status': 'new'}, {'title': 'b', 'status': 'done'}, {'title': 'c', 'status': 'new'},
+    ]
+
+
+def test_buffered_writer_statement_timeout(metric_model, file_db, mocker):
+    file_db.statement_timeout = 5
+    insert_spy = mocker.spy(BufferedWriter, '_insert')
+    with BufferedWriter(metric_model) as writer:
+        writer.write(metric_model(name='m', value=1))
+    assert insert_spy.call_args[0][1].statement_timeout == 5
+
+
+def test_buffered_writer_multi_row_insert(metric_model, mocker):
+    mocker.patch.object(SQLiteSpec, 'max_query_params', 5)
+    statements = []
+    connect = Connector.connect
+
+    def trace_connect(db, db_spec):
+        connect(db, db_spec)
+        db.connection.set_trace_callback(statements.append)
+        return db
+
+    mocker.patch.object(Connector, 'connect', trace_connect)
+    with BufferedWriter(metric_model, max_rows=10) as writer:
+        for i in range(3):
+            writer.write(metric_model(name=f'm{i}', value=i))
+
+    assert [statement for statement in statements if statement.startswith('INSERT')] == [
+        "INSERT INTO metric (name, value) VALUES ('m0', 0), ('m1', 1);",
+        "INSERT INTO metric (name, value) VALUES ('m2', 2);",
+    ]
+    assert statements.count('BEGIN') == 1  # rows of a batch are inserted in one transaction
+
+
+def test_buffered_writer_latency(metric_model):
+    writer = BufferedWriter(metric_model, max_rows=100, max_latency=0.05)
+    writer.write(metric_model(name='m', value=1))
+    time.sleep(0.5)
+    assert len(metric_model.qs.all()) == 1
+    writer.close()
+
+
+def test_buffered_writer_errors(metric_model):
+    failed = []
+    with BufferedWriter(metric_model, on_error=lambda instance, error: failed.append(instance.name)) as writer:
+        for name, value in [('a', 1), ('b', -1), ('c', 3)]:
+            writer.write(metric_model(name=name, value=value))
+
+        with pytest.raises(ValueError):
+            writer.write(metric_model(name='d', value='foo'))  # invalid values fail at once
+
+    assert failed == ['b']
+    assert [row['name'] for row in metric_model.qs.order_by('name').values('name')] == ['a', 'c']
+
+    writer = BufferedWriter(metric_model)
+    writer.write(metric_model(name='e', value=-1))
+    with pytest.raises(WriterError, match='not written'):
+        writer.flush()
+    writer.close()
+
+
+def test_buffered_writer_backpressure(metric_model, mocker):
+    unblock = threading.Event()
+    insert = BufferedWriter._insert
+    mocker.patch.object(BufferedWriter, '_insert', lambda *args: unblock.wait() and insert(*args))
+
+    writer = BufferedWriter(metric_model, max_rows=1, max_buffered=1)
+    writer.write(metric_model(name='a', value=1))  # taken by the thread, which is blocked
+    writer.write(metric_model(name='b', value=2))
+    with pytest.raises(WriterError, match='full'):
+        writer.write(metric_model(name='c', value=3), timeout=0.1)
+
+    unblock.set()
+    writer.write(metric_model(name='c', value=3), timeout=1)
+    writer.close()
+    assert len(metric_model.qs.all()) == 3